@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License version 2 as published by the Free Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+
+# This script measures the software overhead of the main acquisition code paths
+# (SEMMDStream, SEMSpectrumMDStream, acqmng.acquire() and acquireTiledArea()),
+# by running them on the simulated microscopes.
+# For each combination of settings, the acquisition is run with several
+# repetitions (or number of tiles). The time which is not spent by the
+# (simulated) hardware is reported as overhead. The duration is fitted linearly
+# on the number of pixels (or tiles), so that the fixed costs are separated
+# from the per-pixel overhead.
+# The simulated delays of the hardware are removed as much as possible: the
+# settle time of the e-beam is set to 0, and the actuators move at their maximum
+# speed. The readout time of the CCDs is counted as hardware time.
+# Note: the frames of the CCD are not integrated, as the simulated CCDs have a
+# maximum exposure time much longer than any exposure time worth benchmarking.
+#
+# The backend must not be running, as each microscope is started (and stopped)
+# by the script.
+#
+# Example:
+# ./scripts/acq_benchmark.py --dwell 1e-6 1e-5 --output bench.csv --max-overhead 0.005
+
+from __future__ import division, print_function
+
+import argparse
+import csv
+import itertools
+import logging
+import math
+import numpy
+import odemis
+from odemis import model
+from odemis.acq import acqmng, leech, stream
+from odemis.acq.stitching import acquireTiledArea
+from odemis.util import test
+from odemis.util.comp import compute_camera_fov
+import os
+import sys
+import tempfile
+import time
+import yaml
+
+
+CONFIG_PATH = os.path.dirname(odemis.__file__) + "/../../install/linux/usr/share/odemis/sim/"
+SPARC2_CONFIG = CONFIG_PATH + "sparc2-sim-scanner.odm.yaml"
+SECOM_CONFIG = CONFIG_PATH + "secom-sim.odm.yaml"
+
+class BackendRunningError(Exception):
+    """
+    A backend is already running, so the simulated microscope cannot be started
+    """
+    pass
+
+
+COLUMNS = ("bench", "settings", "n", "duration", "hw_time", "overhead_per_unit",
+           "fit_overhead_per_unit", "fit_fixed_time")
+
+
+def create_bench_config(config):
+    """
+    Create a copy of a microscope file, with the simulated delays which can
+      only be set at initialisation removed (ie, the settle time of the e-beam).
+    config (str): path to the microscope file
+    return (str): path to the new microscope file. It should be deleted by the
+      caller after use.
+    """
+    with open(config) as f:
+        inst = yaml.safe_load(f)
+    for name, attrs in inst.items():
+        init = attrs.get("init") or {}
+        if "settle_time" in init:
+            logging.debug("Setting settle time of %s to 0", name)
+            init["settle_time"] = 0
+
+    fd, path = tempfile.mkstemp(suffix=".odm.yaml")
+    with os.fdopen(fd, "w") as f:
+        yaml.safe_dump(inst, f)
+    return path
+
+
+def remove_hw_delays():
+    """
+    Set the (simulated) actuators to their maximum speed, so that their moves
+    are (nearly) instantaneous.
+    """
+    for comp in model.getComponents():
+        if model.hasVA(comp, "speed"):
+            try:
+                rng = comp.speed.range
+                comp.speed.value = {a: rng[1] for a in comp.speed.value}
+            except Exception:
+                logging.warning("Failed to set speed of %s to the maximum", comp.name)
+
+
+def run_stream(mdst, use_acqmng=False):
+    """
+    Acquire a multiple detector stream, including its leeches.
+    mdst (MultipleDetectorStream)
+    use_acqmng (bool): if True, run the acquisition via acqmng.acquire()
+    return (float): the duration of the acquisition in s
+    """
+    start = time.time()
+    if use_acqmng:
+        data, exp = acqmng.acquire([mdst]).result()
+        if exp:
+            raise exp
+    else:
+        for l in mdst.leeches:
+            l.series_start()
+        data = mdst.acquire().result()
+        for l in mdst.leeches:
+            l.series_complete(data)
+    return time.time() - start
+
+
+def bench_sparc2(args, results):
+    """
+    Run the SEM + CL and SEM + spectrometer acquisitions on the SPARCv2
+    """
+    ebeam = model.getComponent(role="e-beam")
+    sed = model.getComponent(role="se-detector")
+    cl = model.getComponent(role="cl-detector")
+    spec = model.getComponent(role="spectrometer")
+
+    leech_opts = (False, True) if args.leeches else (False,)
+
+    # SEM + CL (both scanned by the e-beam) => hardware time = dwell time
+    for dt, with_dc, via_acqmng in itertools.product(args.dwell, leech_opts, (False, True)):
+        sems = stream.SEMStream("bench sem", sed, sed.data, ebeam)
+        cls = stream.CLSettingsStream("bench cl", cl, cl.data, ebeam,
+                                      emtvas={"dwellTime"})
+        sms = stream.SEMMDStream("bench sem-cl", [sems, cls])
+        cls.emtDwellTime.value = dt
+        if with_dc:
+            sems.leeches.append(_create_drift_corrector(ebeam, sed))
+
+        name = "acqmng.acquire" if via_acqmng else "SEMMDStream"
+        settings = "dwell=%g leech=%s" % (dt, with_dc)
+        runs = []
+        for r in args.rep:
+            cls.repetition.value = (r, r)
+            rep = cls.repetition.value
+            npx = rep[0] * rep[1]
+            dur = run_stream(sms, use_acqmng=via_acqmng)
+            # The hardware might round the dwell time
+            runs.append((npx, dur, npx * cls.emtDwellTime.value))
+        report(results, name, settings, runs)
+
+    # SEM + spectrometer => hardware time = exposure + readout
+    for exp, with_dc in itertools.product(args.exposure, leech_opts):
+        sems = stream.SEMStream("bench sem", sed, sed.data, ebeam)
+        specs = stream.SpectrumSettingsStream("bench spec", spec, spec.data, ebeam)
+        sps = stream.SEMSpectrumMDStream("bench sem-spec", [sems, specs])
+        specs.integrationTime.value = exp
+        if with_dc:
+            sems.leeches.append(_create_drift_corrector(ebeam, sed))
+
+        settings = "exp=%g leech=%s" % (specs.integrationTime.value, with_dc)
+        runs = []
+        for r in args.rep:
+            specs.repetition.value = (r, r)
+            rep = specs.repetition.value
+            npx = rep[0] * rep[1]
+            dur = run_stream(sps)
+            readout = numpy.prod(spec.resolution.value) / spec.readoutRate.value
+            runs.append((npx, dur, npx * (specs.integrationTime.value + readout)))
+        report(results, "SEMSpectrumMDStream", settings, runs)
+
+
+def _create_drift_corrector(ebeam, sed):
+    dc = leech.AnchorDriftCorrector(ebeam, sed)
+    dc.period.value = 10  # s
+    dc.roi.value = (0.525, 0.525, 0.6, 0.6)
+    dc.dwellTime.value = 1e-06  # s
+    return dc
+
+
+def bench_secom(args, results):
+    """
+    Run the tiled acquisition on the SECOM
+    """
+    ccd = model.getComponent(role="ccd")
+    light = model.getComponent(role="light")
+    light_filter = model.getComponent(role="filter")
+    stage = model.getComponent(role="stage")
+
+    fov = compute_camera_fov(ccd)
+    for exp in args.exposure:
+        fs = stream.FluoStream("bench fluo", ccd, ccd.data, light, light_filter)
+        # The simulated camera has a minimum exposure time
+        ccd.exposureTime.value = ccd.exposureTime.clip(exp)
+        runs = []
+        for n in args.tiles:
+            # Tiles overlap by 20%, and a bit less than n tiles is needed to get n tiles
+            area = (0, 0, fov[0] * 0.8 * (n - 0.5), fov[1] * 0.8 * (n - 0.5))
+            stage.moveAbs({'x': 0, 'y': 0}).result()
+            start = time.time()
+            acquireTiledArea([fs], stage, area=area, overlap=0.2).result()
+            dur = time.time() - start
+            # Compute the number of tiles the same way as the acquisition
+            ntiles = (int(math.ceil(area[2] / ((1 - 0.2) * fov[0]))) *
+                      int(math.ceil(area[3] / ((1 - 0.2) * fov[1]))))
+            runs.append((ntiles, dur, ntiles * ccd.exposureTime.value))
+        report(results, "acquireTiledArea", "exp=%g" % (ccd.exposureTime.value,), runs)
+
+
+def report(results, name, settings, runs):
+    """
+    Compute the overhead of a series of acquisitions, and print it.
+    results (list of dict): the results are appended to it
+    name (str): name of the benchmark
+    settings (str): description of the settings
+    runs (list of (int, float, float)): number of units (pixels or tiles),
+      duration, time spent by the hardware (in s)
+    """
+    n = numpy.array([r[0] for r in runs], dtype=float)
+    dur = numpy.array([r[1] for r in runs])
+    hw = numpy.array([r[2] for r in runs])
+    if len(set(n)) >= 2:
+        # overhead = a * n + b
+        a, b = numpy.polyfit(n, dur - hw, 1)
+    else:
+        a, b = float("nan"), float("nan")
+
+    for ni, di, hwi in runs:
+        res = {"bench": name,
+               "settings": settings,
+               "n": ni,
+               "duration": di,
+               "hw_time": hwi,
+               "overhead_per_unit": (di - hwi) / ni,
+               "fit_overhead_per_unit": a,
+               "fit_fixed_time": b,
+               }
+        results.append(res)
+        print("%-20s %-35s n=%-6d %8.3f s (hw %8.3f s) => %8.3f ms/unit" %
+              (name, settings, ni, di, hwi, res["overhead_per_unit"] * 1e3))
+    print("%-20s %-35s fit: %.3f ms/unit + %.3f s" % (name, settings, a * 1e3, b))
+
+
+def run_on_backend(config, fn, args, results):
+    """
+    Start the backend with the given microscope file, run the function, and
+      stop the backend.
+    raises BackendRunningError: if a backend is already running
+    """
+    bench_config = create_bench_config(config)
+    try:
+        try:
+            test.start_backend(bench_config)
+        except LookupError:
+            raise BackendRunningError("A backend is already running")
+        try:
+            remove_hw_delays()
+            fn(args, results)
+        finally:
+            test.stop_backend()
+    finally:
+        os.remove(bench_config)
+
+
+def main(args):
+    """
+    Handles the command line arguments
+    args is the list of arguments passed
+    return (int): value to return to the OS as program exit code
+    """
+    # arguments handling
+    parser = argparse.ArgumentParser(description="Measure the software overhead "
+                                     "of the acquisitions on the simulated microscopes. "
+                                     "The e-beam settle time is removed, and the actuators "
+                                     "are set to their maximum speed.")
+    parser.add_argument("--bench", dest="bench", nargs="+", choices=("sparc2", "secom"),
+                        default=("sparc2", "secom"),
+                        help="Microscopes to run the benchmarks on")
+    parser.add_argument("--rep", dest="rep", type=int, nargs="+", default=(8, 16, 32),
+                        help="Repetitions (in X and Y) of the scanned acquisitions")
+    parser.add_argument("--dwell", dest="dwell", type=float, nargs="+", default=(1e-6, 10e-6),
+                        help="Dwell times (in s) of the e-beam acquisitions")
+    parser.add_argument("--exposure", dest="exposure", type=float, nargs="+", default=(1e-3,),
+                        help="Exposure times (in s) of the CCD acquisitions")
+    parser.add_argument("--tiles", dest="tiles", type=int, nargs="+", default=(2, 3),
+                        help="Number of tiles (in X and Y) of the tiled acquisitions")
+    parser.add_argument("--no-leeches", dest="leeches", action="store_false",
+                        help="Do not run the acquisitions with a drift corrector")
+    parser.add_argument("--output", "-o", dest="output",
+                        help="CSV file where to store the results")
+    parser.add_argument("--max-overhead", dest="max_overhead", type=float,
+                        help="Maximum overhead per pixel/tile (in s). If exceeded, "
+                        "the script returns an error. Requires at least 2 different "
+                        "repetitions and numbers of tiles, to fit the overhead.")
+    parser.add_argument("--log-level", dest="loglev", metavar="<level>", type=int,
+                        default=0, help="set verbosity level (0-2, default = 0)")
+    options = parser.parse_args(args[1:])
+
+    if options.max_overhead is not None:
+        # The overhead per unit can only be fitted with at least 2 points
+        if len(set(options.rep)) < 2 and "sparc2" in options.bench:
+            parser.error("--max-overhead requires at least 2 different --rep")
+        if len(set(options.tiles)) < 2 and "secom" in options.bench:
+            parser.error("--max-overhead requires at least 2 different --tiles")
+
+    loglev_names = [logging.WARNING, logging.INFO, logging.DEBUG]
+    loglev = loglev_names[min(len(loglev_names) - 1, options.loglev)]
+    logging.getLogger().setLevel(loglev)
+
+    benches = {"sparc2": (SPARC2_CONFIG, bench_sparc2),
+               "secom": (SECOM_CONFIG, bench_secom),
+               }
+    results = []
+    try:
+        for b in options.bench:
+            config, fn = benches[b]
+            run_on_backend(config, fn, options, results)
+    except KeyboardInterrupt:
+        logging.info("Interrupted before the end of the execution")
+        return 1
+    except BackendRunningError:
+        logging.error("A backend is already running, stop it before running the benchmarks")
+        return 127
+    except Exception:
+        logging.exception("Unexpected error while performing action.")
+        return 127
+
+    if options.output:
+        with open(options.output, "w") as f:
+            writer = csv.DictWriter(f, COLUMNS)
+            writer.writeheader()
+            writer.writerows(results)
+
+    if options.max_overhead is not None:
+        # NaN (ie, fit failed) is also considered too slow
+        slow = {(r["bench"], r["settings"]): r["fit_overhead_per_unit"] for r in results
+                if not r["fit_overhead_per_unit"] <= options.max_overhead}
+        if slow:
+            for (name, settings), ovh in sorted(slow.items()):
+                logging.error("%s (%s) has an overhead of %g s per unit", name, settings, ovh)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    ret = main(sys.argv)
+    exit(ret)
@@ -39,6 +39,7 @@ from odemis.acq.stream import FluoStream, SEMCCDMDStream, SEMMDStream, SEMTempor
 from odemis.util import img, fluo, executeAsyncTask
 import time
 import copy
+import threading
 from odemis.model import prepare_to_listen_to_more_vas
 
 
@@ -47,8 +48,9 @@ from odemis.model import prepare_to_listen_to_more_vas
 # background. You are in charge of ensuring that no other acquisition is
 # going on at the same time.
 # The manager receives a list of streams to acquire, order them in the best way,
-# and then creates a separate thread to run the acquisition of each stream. It
-# returns a special "ProgressiveFuture" which is a Future object that can be
+# and then creates a separate thread to run the acquisition of each stream.
+# Consecutive streams which use independent hardware are acquired simultaneously.
+# It returns a special "ProgressiveFuture" which is a Future object that can be
 # stopped while already running, and reports from time to time progress on its
 # execution.
 def acquire(streams, settings_obs=None):
@@ -93,12 +95,84 @@ def estimateTime(streams):
     tot_time = 0
     # We don't use foldStreams() as it creates new streams at every call, and
     # anyway sum of each stream should give already a good estimation.
-    for s in streams:
-        tot_time += s.estimateAcquisitionTime()
+    # The streams acquired simultaneously only take the time of the longest one.
+    streams = sorted(streams, key=_weight_stream, reverse=True)
+    for group in _groupIndependentStreams(streams):
+        tot_time += max(s.estimateAcquisitionTime() for s in group)
 
     return tot_time
 
 
+def _getStreamHardware(stream):
+    """
+    Find the hardware components used by a stream during its acquisition.
+    stream (Stream): the stream to acquire
+    return (dict str -> HwComponent): the components used, by name
+    """
+    comps = {}
+    # Multiple detector streams: all the sub-streams are used
+    for s in getattr(stream, "streams", ()):
+        comps.update(_getStreamHardware(s))
+
+    for attr in ("emitter", "detector", "focuser", "scanner"):
+        c = getattr(stream, attr, None)
+        if c is not None:
+            comps[c.name] = c
+
+    # The leeches also use some hardware (eg, the e-beam for drift correction)
+    for l in getattr(stream, "leeches", ()):
+        for attr in ("_scanner", "_detector"):
+            c = getattr(l, attr, None)
+            if c is not None:
+                comps[c.name] = c
+
+    return comps
+
+
+def _groupIndependentStreams(streams):
+    """
+    Group the consecutive streams which can be acquired simultaneously, because
+      they use independent hardware. Two streams are independent if they don't
+      use the same component, and no component of one affects a component of
+      the other one. Streams which need to change the optical path, or whose
+      hardware is unknown, are never acquired simultaneously.
+    streams (list of Streams): the streams, in the order of acquisition
+    return (list of list of Streams): each group of streams, in the same order
+    """
+    groups = []
+    can_join = False  # True if the next stream might join the last group
+    group_used = set()  # names of the components used by the last group
+    group_affected = set()  # names of the components affected by the last group
+    for s in streams:
+        comps = _getStreamHardware(s)
+        used = set(comps.keys())
+        affected = set()
+        for c in comps.values():
+            try:
+                affected.update(c.affects.value)
+            except AttributeError:  # Not a HwComponent
+                pass
+        has_opm = getattr(s, "_opm", None) is not None
+
+        if (can_join and used and
+            not (used & (group_used | group_affected)) and
+            not (affected & group_used) and
+            not (has_opm and any(getattr(gs, "_opm", None) for gs in groups[-1]))
+           ):
+            logging.debug("Will acquire stream %s simultaneously with %s",
+                          s.name.value, ", ".join(gs.name.value for gs in groups[-1]))
+            groups[-1].append(s)
+            group_used |= used
+            group_affected |= affected
+        else:
+            groups.append([s])
+            can_join = bool(used)
+            group_used = used
+            group_affected = affected
+
+    return groups
+
+
 def foldStreams(streams, reuse=None):
     """
     Merge (aka "fold) streams which can be acquired simultaneously into
@@ -247,15 +321,18 @@ class AcquisitionTask(object):
 
         # order the streams for optimal acquisition
         self._streams = sorted(streams, key=_weight_stream, reverse=True)
+        # The streams in the same group are acquired simultaneously
+        self._groups = _groupIndependentStreams(self._streams)
 
         # get the estimated time for each streams
         self._streamTimes = {} # Stream -> float (estimated time)
         for s in streams:
             self._streamTimes[s] = s.estimateAcquisitionTime()
 
-        self._streams_left = set(self._streams) # just for progress update
-        self._current_stream = None
-        self._current_future = None
+        self._groups_left = list(self._groups)  # just for progress update
+        self._streams_left = set(self._streams)
+        self._current_futures = {}  # Future -> float (expected end time)
+        self._started = False
         self._cancelled = False
 
     def run(self):
@@ -268,8 +345,9 @@ class AcquisitionTask(object):
             Exception: if it failed before any result were acquired
         """
         exp = None
-        assert(self._current_stream is None) # Task should be used only once
-        expected_time = sum(self._streamTimes.values())
+        assert(not self._started) # Task should be used only once
+        self._started = True
+        expected_time = sum(self._getGroupTime(g) for g in self._groups)
         # no need to set the start time of the future: it's automatically done
         # when setting its state to running.
         self._future.set_progress(end=time.time() + expected_time)
@@ -297,43 +375,59 @@ class AcquisitionTask(object):
             if not self._settings_obs:
                 logging.warning("Acquisition task has no SettingsObserver, not saving extra "
                                 "metadata.")
-            for s in self._streams:
-                # Get the future of the acquisition, depending on the Stream type
-                if hasattr(s, "acquire"):
-                    f = s.acquire()
-                else: # fall-back to old style stream
-                    f = _futures.wrapSimpleStreamIntoFuture(s)
-                self._current_future = f
-                self._current_stream = s
-                self._streams_left.discard(s)
+            for group in self._groups:
+                # Start the acquisition of all the streams of the group at once
+                futures = OrderedDict()  # Stream -> Future
+                for s in group:
+                    # Get the future of the acquisition, depending on the Stream type
+                    if hasattr(s, "acquire"):
+                        f = s.acquire()
+                    else: # fall-back to old style stream
+                        f = _futures.wrapSimpleStreamIntoFuture(s)
+                    futures[s] = f
+                    self._current_futures[f] = time.time() + self._streamTimes[s]
+                    self._streams_left.discard(s)
+                self._groups_left.remove(group)
 
                 # in case acquisition was cancelled, before the future was set
                 if self._cancelled:
-                    f.cancel()
+                    for f in futures.values():
+                        f.cancel()
                     raise CancelledError()
 
                 # If it's a ProgressiveFuture, listen to the time update
+                for f in futures.values():
+                    try:
+                        f.add_update_callback(self._on_progress_update)
+                    except AttributeError:
+                        pass # not a ProgressiveFuture, fine
+
                 try:
-                    f.add_update_callback(self._on_progress_update)
-                except AttributeError:
-                    pass # not a ProgressiveFuture, fine
-
-                # Wait for the acquisition to be finished.
-                # Will pass down exceptions, included in case it's cancelled
-                das = f.result()
-                if not isinstance(das, collections.Iterable):
-                    logging.warning("Future of %s didn't return a list of DataArrays, but %s", s, das)
-                    das = []
-
-                # Add extra settings to metadata
-                if self._settings_obs:
-                    settings = self._settings_obs.get_all_settings()
-                    for da in das:
-                        da.metadata[model.MD_EXTRA_SETTINGS] = copy.deepcopy(settings)
-                raw_images[s] = das
+                    for s, f in futures.items():
+                        # Wait for the acquisition to be finished.
+                        # Will pass down exceptions, included in case it's cancelled
+                        das = f.result()
+                        if not isinstance(das, collections.Iterable):
+                            logging.warning("Future of %s didn't return a list of DataArrays, but %s", s, das)
+                            das = []
+
+                        # Add extra settings to metadata (the snapshot is
+                        # immutable, so it can be shared by all the DataArrays)
+                        if self._settings_obs:
+                            settings = self._settings_obs.get_all_settings()
+                            for da in das:
+                                da.metadata[model.MD_EXTRA_SETTINGS] = settings
+                        raw_images[s] = das
+                except Exception:
+                    # Don't leave the other streams of the group running
+                    for f in futures.values():
+                        f.cancel()
+                    raise
+                finally:
+                    self._current_futures = {}
 
                 # update the time left
-                expected_time -= self._streamTimes[s]
+                expected_time -= self._getGroupTime(group)
                 self._future.set_progress(end=time.time() + expected_time)
 
             # Tell the leeches it's over. Note: we don't do it in case of
@@ -363,10 +457,11 @@ class AcquisitionTask(object):
         finally:
             # Don't hold references to the streams once it's over
             self._streams = []
+            self._groups = []
+            self._groups_left = []
             self._streams_left.clear()
             self._streamTimes = {}
-            self._current_stream = None
-            self._current_future = None
+            self._current_futures = {}
 
         # Update metadata using OverlayStream (if there was one)
         self._adjust_metadata(raw_images)
@@ -411,24 +506,35 @@ class AcquisitionTask(object):
                 if model.MD_DESCRIPTION not in d.metadata:
                     d.metadata[model.MD_DESCRIPTION] = s.name.value
 
+    def _getGroupTime(self, group):
+        """
+        group (list of Streams): streams acquired simultaneously
+        return (float): the estimated time to acquire all the streams of the group
+        """
+        return max(self._streamTimes[s] for s in group)
+
     def _on_progress_update(self, f, start, end):
         """
-        Called when the current future has made a progress (and so it should
-        provide a better time estimation).
+        Called when one of the current futures has made a progress (and so it
+        should provide a better time estimation).
         """
         # If the acquisition is cancelled or failed, we might receive updates
         # from the sub-future a little after. Let's not make a fuss about it.
         if self._future.done():
             return
 
-        # There is a tiny chance that self._current_future is already set to
-        # None, but the future isn't officially ended yet. Also fine.
-        if self._current_future != f and self._current_future is not None:
-            logging.warning("Progress update not from the current future: %s instead of %s",
-                            f, self._current_future)
+        # There is a tiny chance that self._current_futures is already reset,
+        # but the future isn't officially ended yet. Also fine.
+        current_futures = self._current_futures
+        if f not in current_futures:
+            if current_futures:
+                logging.warning("Progress update not from a current future: %s", f)
             return
 
-        total_end = end + sum(self._streamTimes[s] for s in self._streams_left)
+        # The current group is over when its longest stream is over
+        current_futures[f] = end
+        total_end = (max(current_futures.values()) +
+                     sum(self._getGroupTime(g) for g in self._groups_left))
         self._future.set_progress(end=total_end)
 
     def cancel(self, future):
@@ -438,10 +544,10 @@ class AcquisitionTask(object):
         # put the cancel flag
         self._cancelled = True
 
-        if self._current_future is not None:
-            cancelled = self._current_future.cancel()
-        else:
-            cancelled = False
+        cancelled = False
+        for f in list(self._current_futures):
+            # Note: all the futures must be cancelled, so no short-circuit
+            cancelled = f.cancel() or cancelled
 
         # Report it's too late for cancellation (and so result will come)
         if not cancelled and not self._streams_left:
@@ -450,23 +556,54 @@ class AcquisitionTask(object):
         return True
 
 
+class FrozenDict(dict):
+    """
+    A dict which cannot be modified. As it is immutable, the same instance can
+    be shared (eg, in the metadata of many DataArrays), without copying it.
+    It can still be copied (or pickled) into a normal dict with dict(fd).
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s cannot be modified" % (self.__class__.__name__,))
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
 HIDDEN_VAS = ['children', 'dependencies', 'affects', 'alive', 'state', 'ghosts']
 class SettingsObserver(object):
     """
     Class that listens to all settings, so they can be easily stored as metadata
     at the end of an acquisition.
+    The settings are provided as immutable snapshots. A new snapshot is only
+    created when a setting has changed, and it shares the settings of the
+    components which haven't changed with the previous snapshot.
     """
 
     def __init__(self, components):
         """
         components (set of HwComponents): component which should be observed
         """
+        # component name -> FrozenDict (VA name -> (value, unit))
         self._all_settings = {}
+        # component name -> dict (VA name -> value): updated values not yet in _all_settings
+        self._changed = {}
+        self._snapshot = None  # FrozenDict of _all_settings, or None if outdated
+        self._lock = threading.Lock()
         self._components = components  # keep a reference to the components, so they are not garbage collected
         self._va_updaters = []  # keep a reference to the subscribers so they are not garbage collected
 
         for comp in components:
-            self._all_settings[comp.name] = {}
+            comp_settings = {}
             vas = model.getVAs(comp).items()
             prepare_to_listen_to_more_vas(len(vas))
 
@@ -474,12 +611,40 @@ class SettingsObserver(object):
                 if va_name in HIDDEN_VAS:
                     continue
                 # Store current value of VA (calling .value might take some time)
-                self._all_settings[comp.name][va_name] = [va.value, va.unit]
+                comp_settings[va_name] = (copy.deepcopy(va.value), va.unit)
                 # Subscribe to VA, update dictionary on callback
                 def update_settings(value, comp_name=comp.name, va_name=va_name):
-                    self._all_settings[comp_name][va_name][0] = value
+                    self._update_setting(comp_name, va_name, value)
                 self._va_updaters.append(update_settings)
                 va.subscribe(update_settings)
+            self._all_settings[comp.name] = FrozenDict(comp_settings)
+
+    def _update_setting(self, comp_name, va_name, value):
+        """
+        Record the new value of a VA. It is only copied when the next snapshot
+        is created, so that frequent updates stay cheap.
+        """
+        with self._lock:
+            self._changed.setdefault(comp_name, {})[va_name] = value
+            self._snapshot = None
 
     def get_all_settings(self):
-        return copy.deepcopy(self._all_settings)
+        """
+        return (FrozenDict str -> FrozenDict str -> (value, unit)): for each
+          component name, for each VA name, its current value and unit. The
+          same object is returned as long as no setting has changed. It must
+          not be modified.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                # Only the settings of the components which have changed are
+                # copied, so that the snapshots already provided are not modified.
+                for comp_name, changed in self._changed.items():
+                    comp_settings = dict(self._all_settings[comp_name])
+                    for va_name, value in changed.items():
+                        # in case the VA value is modified in place
+                        comp_settings[va_name] = (copy.deepcopy(value), comp_settings[va_name][1])
+                    self._all_settings[comp_name] = FrozenDict(comp_settings)
+                self._changed = {}
+                self._snapshot = FrozenDict(self._all_settings)
+            return self._snapshot
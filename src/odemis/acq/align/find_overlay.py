@@ -205,7 +205,7 @@ def _DoFindOverlay(future, repetitions, dwell_time, max_allowed_diff, escan,
                 if future._find_overlay_state == CANCELLED:
                     raise CancelledError()
                 logging.debug("Finding spot centers with %d subimages...", len(subimages))
-                spot_coordinates = [spot.FindCenterCoordinates(i) for i in subimages]
+                spot_coordinates = [tuple(c) for c in spot.FindCenterCoordinatesBatch(subimages)]
 
                 # Reconstruct the optical coordinates
                 if future._find_overlay_state == CANCELLED:
@@ -32,7 +32,8 @@ from odemis.acq.align import coordinates, autofocus
 from odemis.acq.align.autofocus import AcquireNoBackground, MTD_EXHAUSTIVE
 from odemis.dataio import tiff
 from odemis.util import executeAsyncTask
-from odemis.util.spot import FindCenterCoordinates, GridPoints, MaximaFind, EstimateLatticeConstant
+from odemis.util.spot import FindCenterCoordinatesBatch, GridPoints, MaximaFind, \
+    EstimateLatticeConstant
 from odemis.util.transform import AffineTransform
 import os
 from scipy.spatial import cKDTree as KDTree
@@ -322,7 +323,7 @@ def FindSpot(image, sensitivity_limit=100):
     if not subimages:
         raise LookupError("No spot detected")
 
-    spot_coordinates = [FindCenterCoordinates(i) for i in subimages]
+    spot_coordinates = [tuple(c) for c in FindCenterCoordinatesBatch(subimages)]
     optical_coordinates = coordinates.ReconstructCoordinates(subimage_coordinates, spot_coordinates)
 
     # Too many spots detected
@@ -23,7 +23,9 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division
 
 import logging
+import queue
 import threading
+import time
 from asyncio import CancelledError
 from concurrent.futures._base import CANCELLED, RUNNING, FINISHED
 
@@ -174,11 +176,7 @@ def cryoSwitchSamplePosition(target):
     stage = model.getComponent(role='stage')
     focus = model.getComponent(role='focus')
 
-    f = model.CancellableFuture()
-    f.task_canceller = _cancelCryoMoveSample
-    f._task_state = RUNNING
-    f._task_lock = threading.Lock()
-    f._running_subf = model.InstantaneousFuture()
+    f = _createCryoMoveFuture()
     # Run in separate thread
     executeAsyncTask(f, _doCryoSwitchSamplePosition, args=(f, stage, focus, target))
     return f
@@ -205,14 +203,15 @@ def _doCryoSwitchSamplePosition(future, stage, focus, target):
             if not required_axes.issubset(stage_position.keys()):
                 raise ValueError("Stage %s metadata does not have all required axes %s." % (list(stage_md.keys())[list(stage_md.values()).index(stage_position)], required_axes))
         current_pos = stage.position.value
-        # To hold the ordered sub moves list
+        # To hold the sub moves, with their dependencies, as a graph
         sub_moves = []
         # Create axis->pos dict from target position given smaller number of axes
         filter_dict = lambda keys, d: {key: d[key] for key in keys}
 
         # Initial submove for all procedures is to park focus if it's not already parked
+        park_focus = None
         if not _isNearPosition(focus.position.value, focus_deactive, {'z'}):
-            sub_moves.append((focus, focus_deactive))
+            park_focus = _addSubMove(sub_moves, focus, focus_deactive)
 
         current_label = getCurrentPositionLabel(current_pos, stage)
         if target == LOADING:
@@ -226,21 +225,26 @@ def _doCryoSwitchSamplePosition(future, stage, focus, target):
             # 2. Move focus to deactive position
             # 3. reference stage
             if not all(stage.referenced.value.values()):
+                if park_focus is None:
+                    park_focus = _addSubMove(sub_moves, focus, focus_deactive)
                 if not all(focus.referenced.value.values()):
-                    run_reference(future, focus)
-                run_sub_move(future, focus, focus_deactive)
-                run_reference(future, stage)
+                    sub_moves[park_focus][2].add(_addSubMove(sub_moves, focus, None))
+                stage_ready = _addSubMove(sub_moves, stage, None, [park_focus])
+            else:
+                stage_ready = park_focus
 
             # Add the sub moves to perform the loading move
-            sub_moves.append((stage, filter_dict({'rx', 'rz'}, stage_deactive)))
-            sub_moves.append((stage, filter_dict({'x', 'y'}, stage_deactive)))
-            sub_moves.append((stage, filter_dict({'z'}, stage_deactive)))
+            rx_rz = _addSubMove(sub_moves, stage, filter_dict({'rx', 'rz'}, stage_deactive), [stage_ready])
+            x_y = _addSubMove(sub_moves, stage, filter_dict({'x', 'y'}, stage_deactive), [rx_rz])
+            _addSubMove(sub_moves, stage, filter_dict({'z'}, stage_deactive), [x_y])
 
         elif target in (IMAGING, COATING):
+            stage_ready = None
             if current_label is LOADING:
                 # Automatically run the referencing procedure as part of the
-                # first step of the movement loading → imaging/coating position
-                run_reference(future, stage)
+                # first step of the movement loading → imaging/coating position.
+                # The focus can be parked at the same time.
+                stage_ready = _addSubMove(sub_moves, stage, None)
             elif current_label is UNKNOWN:
                 raise ValueError("Unable to move to {} while current position is unknown.".format(
                     target_pos_str.get(target, lambda: "unknown")))
@@ -250,18 +254,17 @@ def _doCryoSwitchSamplePosition(future, stage, focus, target):
             focus_active = focus_md[model.MD_FAV_POS_ACTIVE]
             target_pos = stage_active if target is IMAGING else stage_coating
             # Add the sub moves to perform the imaging/coating move
-            sub_moves.append((stage, filter_dict({'z'}, target_pos)))
-            sub_moves.append((stage, filter_dict({'x', 'y'}, target_pos)))
-            sub_moves.append((stage, filter_dict({'rx', 'rz'}, target_pos)))
+            z = _addSubMove(sub_moves, stage, filter_dict({'z'}, target_pos), [park_focus, stage_ready])
+            x_y = _addSubMove(sub_moves, stage, filter_dict({'x', 'y'}, target_pos), [z])
+            rx_rz = _addSubMove(sub_moves, stage, filter_dict({'rx', 'rz'}, target_pos), [x_y])
             # TODO: check if the following movement is necessary as it could be done later, only when the user start
             #  the FM stream (in which case it’d be handled by the optical path manager)
             if target == IMAGING:
-                sub_moves.append((focus, focus_active))
+                _addSubMove(sub_moves, focus, focus_active, [rx_rz])
         else:
             raise ValueError("Unknown target value %s." % target)
 
-        for component, sub_move in sub_moves:
-            run_sub_move(future, component, sub_move)
+        run_sub_moves(future, sub_moves)
     except CancelledError:
         logging.info("_doCryoLoadSample cancelled.")
     except Exception as exp:
@@ -287,11 +290,7 @@ def cryoTiltSample(rx, rz=0):
     stage = model.getComponent(role='stage')
     focus = model.getComponent(role='focus')
 
-    f = model.CancellableFuture()
-    f.task_canceller = _cancelCryoMoveSample
-    f._task_state = RUNNING
-    f._task_lock = threading.Lock()
-    f._running_subf = model.InstantaneousFuture()
+    f = _createCryoMoveFuture()
     # Run in separate thread
     executeAsyncTask(f, _doCryoTiltSample, args=(f, stage, focus, rx, rz,))
     return f
@@ -317,27 +316,27 @@ def _doCryoTiltSample(future, stage, focus, rx, rz):
         # Check that the stage X,Y,Z are within the limits
         if not _isInRange(current_pos, stage_active_range, {'x', 'y', 'z'}):
             raise ValueError("Current position is out of active range.")
-        # To hold the ordered sub moves list to perform the tilting/imaging move
+        # To hold the sub moves, with their dependencies, to perform the tilting/imaging move
         sub_moves = []
         # Park focus only if stage rx is equal to 0
         # Otherwise stop if it's not already parked
+        park_focus = None
         if not _isNearPosition(focus.position.value, focus_deactive, {'z'}):
             if _isNearPosition(current_pos, {'rx': 0}, {'rx'}):
-                sub_moves.append((focus, focus_deactive))
+                park_focus = _addSubMove(sub_moves, focus, focus_deactive)
             else:
                 raise ValueError("Cannot proceed with tilting while focus is not near FAV_POS_DEACTIVE position.")
 
         if rx == 0 and rz == 0:  # Imaging
             # Get the actual Imaging position (which should be ~ 0 as well)
             rx = stage_active['rx']
-            sub_moves.append((stage, {'rz': rz}))
-            sub_moves.append((stage, {'rx': rx}))
+            first = _addSubMove(sub_moves, stage, {'rz': rz}, [park_focus])
+            _addSubMove(sub_moves, stage, {'rx': rx}, [first])
         else:
-            sub_moves.append((stage, {'rx': rx}))
-            sub_moves.append((stage, {'rz': rz}))
+            first = _addSubMove(sub_moves, stage, {'rx': rx}, [park_focus])
+            _addSubMove(sub_moves, stage, {'rz': rz}, [first])
 
-        for component, sub_move in sub_moves:
-            run_sub_move(future, component, sub_move)
+        run_sub_moves(future, sub_moves)
     except CancelledError:
         logging.info("_doCryoTiltSample cancelled.")
     except Exception as exp:
@@ -350,6 +349,19 @@ def _doCryoTiltSample(future, stage, focus, rx, rz):
             future._task_state = FINISHED
 
 
+def _createCryoMoveFuture():
+    """
+    Create the future of a cryo sample stage move, which can be cancelled via _cancelCryoMoveSample
+    :return (CancellableFuture): the future, in the RUNNING state, with no sub move running
+    """
+    f = model.CancellableFuture()
+    f.task_canceller = _cancelCryoMoveSample
+    f._task_state = RUNNING
+    f._task_lock = threading.Lock()
+    f._running_subfs = set()
+    return f
+
+
 def _cancelCryoMoveSample(future):
     """
     Canceller of _doCryoTiltSample and _doCryoSwitchSamplePosition tasks
@@ -360,11 +372,104 @@ def _cancelCryoMoveSample(future):
         if future._task_state == FINISHED:
             return False
         future._task_state = CANCELLED
-        future._running_subf.cancel()
+        for subf in future._running_subfs:
+            subf.cancel()
         logging.debug("CryoMoveSample cancellation requested.")
 
     return True
 
+
+def _addSubMove(sub_moves, component, sub_move, after=()):
+    """
+    Add a sub move to a graph of sub moves, as accepted by run_sub_moves
+    :param sub_moves: (list) the graph of sub moves, which is updated
+    :param component: Either the stage or the focus component
+    :param sub_move: (dict or None) the sub_move axis->pos dict, or None to reference all the axes
+    :param after: (iterable of int or None) index of the sub moves which must be finished
+      before starting this one. None values are ignored, to simplify optional steps.
+    :return (int): index of the new sub move
+    """
+    sub_moves.append((component, sub_move, {i for i in after if i is not None}))
+    return len(sub_moves) - 1
+
+
+def run_sub_moves(future, sub_moves):
+    """
+    Perform a group of sub moves, each one as soon as all the sub moves it
+    depends on are finished. So sub moves which don't depend on each other
+    run concurrently. Cancelling the future cancels all the running sub moves.
+    Each move must finish within MAX_SUBMOVE_DURATION. A referencing can take
+    as long as needed, and if it fails, the error is only logged.
+    :param future: cancellable future of the whole move
+    :param sub_moves: (list of (component, dict or None, set of int)) for each sub move: the component,
+      the axis->pos dict (or None to reference all the axes), and the index of the sub moves it depends on
+    :raises TimeoutError: if a sub move timed out
+    :raises CancelledError: if the move is cancelled
+    :raises ValueError: if some sub moves depend on each other (cycle)
+    """
+    pending = dict(enumerate(sub_moves))  # index -> sub move, for the sub moves not yet started
+    running = {}  # future -> (index, time by which it should be finished, or None if no limit)
+    done = set()  # index of the finished sub moves
+    ended = queue.Queue()  # futures of the sub moves as they finish
+    try:
+        while pending or running:
+            with future._task_lock:
+                if future._task_state == CANCELLED:
+                    logging.info("Move procedure is cancelled.")
+                    raise CancelledError()
+                for i, (component, sub_move, after) in sorted(pending.items()):
+                    if not after <= done:
+                        continue
+                    del pending[i]
+                    if sub_move is None:
+                        logging.debug("Performing {} referencing.".format(component.name))
+                        subf = component.reference(set(component.axes.keys()))
+                        deadline = None
+                    else:
+                        logging.debug("Performing sub move {} -> {}".format(component.name, sub_move))
+                        subf = component.moveAbs(sub_move)
+                        deadline = time.time() + MAX_SUBMOVE_DURATION
+                    running[subf] = (i, deadline)
+                    future._running_subfs.add(subf)
+                    subf.add_done_callback(ended.put)
+
+            if not running:
+                raise ValueError("Sub moves %s cannot be started as they depend on each other." % sorted(pending))
+
+            deadlines = [d for _, d in running.values() if d is not None]
+            timeout = max(0, min(deadlines) - time.time()) if deadlines else None
+            try:
+                subf = ended.get(timeout=timeout)
+            except queue.Empty:
+                late = [i for i, d in running.values() if d is not None and d <= time.time()]
+                logging.error("Timed out during moving {}.".format(
+                    ", ".join("{} -> {}".format(sub_moves[i][0].name, sub_moves[i][1]) for i in late)))
+                raise TimeoutError("Sub moves didn't finish within %g s" % (MAX_SUBMOVE_DURATION,))
+
+            i, _ = running.pop(subf)
+            component, sub_move, _ = sub_moves[i]
+            with future._task_lock:
+                future._running_subfs.discard(subf)
+                if future._task_state == CANCELLED:
+                    logging.info("Move procedure is cancelled after moving {} -> {}.".format(
+                        component.name, sub_move))
+                    raise CancelledError()
+            try:
+                subf.result()  # Raises the exception of the sub move, if it failed
+            except Exception as error:
+                if sub_move is not None:
+                    raise
+                # A failed referencing is not fatal, as the move might still work
+                logging.exception("Failed to reference {}: {}".format(component.name, error))
+            done.add(i)
+    finally:
+        # Don't leave anything moving if the group is stopped early
+        for subf in running:
+            subf.cancel()
+        with future._task_lock:
+            future._running_subfs.difference_update(running)
+
+
 def run_reference(future, component):
     """
     Perform the stage reference procedure
@@ -372,19 +477,7 @@ def run_reference(future, component):
     :param component: Either the stage or the focus component
     :raises CancelledError: if the reference is cancelled
     """
-    try:
-        with future._task_lock:
-            if future._task_state == CANCELLED:
-                logging.info("Reference procedure is cancelled.")
-                raise CancelledError()
-            logging.debug("Performing stage referencing.")
-            future._running_subf = component.reference(set(component.axes.keys()))
-        future._running_subf.result()
-    except Exception as error:
-        logging.exception(error)
-    if future._task_state == CANCELLED:
-        logging.info("Reference procedure is cancelled.")
-        raise CancelledError()
+    run_sub_moves(future, [(component, None, set())])
 
 
 def run_sub_move(future, component, sub_move):
@@ -396,18 +489,4 @@ def run_sub_move(future, component, sub_move):
     :raises TimeoutError: if the sub move timed out
     :raises CancelledError: if the sub move is cancelled
     """
-    try:
-        with future._task_lock:
-            if future._task_state == CANCELLED:
-                logging.info("Move procedure is cancelled before moving {} -> {}.".format(component.name, sub_move))
-                raise CancelledError()
-            logging.debug("Performing sub move {} -> {}".format(component.name, sub_move))
-            future._running_subf = component.moveAbs(sub_move)
-        future._running_subf.result(timeout=MAX_SUBMOVE_DURATION)
-    except TimeoutError:
-        future._running_subf.cancel()
-        logging.exception("Timed out during moving {} -> {}.".format(component.name, sub_move))
-        raise
-    if future._task_state == CANCELLED:
-        logging.info("Move procedure is cancelled after moving {} -> {}.".format(component.name, sub_move))
-        raise CancelledError()
+    run_sub_moves(future, [(component, sub_move, set())])
@@ -26,6 +26,7 @@ from concurrent.futures.thread import ThreadPoolExecutor
 import copy
 import logging
 import math
+import numbers
 import re
 from odemis import model, util
 from odemis.acq import stream
@@ -334,6 +335,10 @@ class OpticalPathManager(object):
             if hasattr(comp, 'axes') and isinstance(comp.axes, dict):
                 self._actuators.append(comp)
 
+        # Pre-computed moves, which only depend on the microscope configuration
+        self._mode_plans = {}  # (str, str) -> list: (mode, target name) -> see _getModePlan()
+        self._selector_plans = {}  # str -> list: target name -> see _getSelectorsPlan()
+
         # last known axes position (before going to an alignment mode)
         self._stored = {}  # (str, str) -> pos: (comp role, axis name) -> position
         self._last_mode = None  # previous mode that was set
@@ -526,22 +531,7 @@ class OpticalPathManager(object):
                               self._focus_out_chamber_view)
                 fmoves.append((focus_comp.moveAbs(self._focus_out_chamber_view), focus_comp, self._focus_out_chamber_view))
 
-        modeconf = self._modes[mode][1]
-        for comp_role, conf in modeconf.items():
-            # Try to access the component needed
-            try:
-                comp = self._getComponent(comp_role)
-            except LookupError:
-                logging.debug("Failed to find component %s, skipping it", comp_role)
-                continue
-
-            # Check whether that actuator affects the target
-            targets = {target.name} | set(target.affects.value)
-            if not any(self.affects(comp.name, n) for n in targets):
-                logging.debug("Actuator %s doesn't affect %s, so not moving it",
-                              comp.name, target.name)
-                continue
-
+        for comp_role, comp, conf in self._getModePlan(mode, target):
             mv = {}
             for axis, pos in conf.items():
                 if axis == "power":
@@ -648,12 +638,14 @@ class OpticalPathManager(object):
             if mv:
                 try:
                     # move actuator
-                    fmoves.append((comp.moveAbs(mv), comp, mv))
+                    mv = self._removeDoneMoves(comp, mv, fmoves)
+                    if mv:
+                        fmoves.append((comp.moveAbs(mv), comp, mv))
                 except AttributeError:
                     logging.warning("%s not an actuator, but tried to move to %s", comp_role, mv)
 
         # Now take care of the selectors based on the target detector
-        fmoves.extend(self.selectorsToPath(target.name))
+        fmoves.extend(self.selectorsToPath(target.name, fmoves))
 
         # If we are about to leave alignment modes, restore values
         if self._last_mode in ALIGN_MODES and mode not in ALIGN_MODES:
@@ -663,7 +655,9 @@ class OpticalPathManager(object):
                 if an == "grating":
                     continue  # handled separately via GRATING_NOT_MIRROR
                 comp = self._getComponent(cr)
-                fmoves.append((comp.moveAbs({an: pos}), comp, {an: pos}))
+                mv = self._removeDoneMoves(comp, {an: pos}, fmoves)
+                if mv:
+                    fmoves.append((comp.moveAbs(mv), comp, mv))
                 del self._stored[cr, an]
 
         # Save last mode
@@ -708,19 +702,57 @@ class OpticalPathManager(object):
                 except IOError as e:
                     logging.warning("Actuator move failed giving the error %s", e)
 
-    def selectorsToPath(self, target):
+    def _getModePlan(self, mode, target):
         """
-        Sets the selectors so the optical path leads to the target component
-        (usually a detector).
+        Find the components to move for the given mode, which affect the target.
+        As it only depends on the microscope configuration, the result is cached.
+        mode (str): name of one of the modes
+        target (Component): the detector targeted
+        return (list of tuple (str, Component, dict)): for each component: its
+          role, the component, and the configuration of the mode (axis -> pos)
+        """
+        try:
+            return self._mode_plans[mode, target.name]
+        except KeyError:
+            pass
+
+        plan = []
+        targets = {target.name} | set(target.affects.value)
+        for comp_role, conf in self._modes[mode][1].items():
+            # Try to access the component needed
+            try:
+                comp = self._getComponent(comp_role)
+            except LookupError:
+                logging.debug("Failed to find component %s, skipping it", comp_role)
+                continue
+
+            # Check whether that actuator affects the target
+            if not any(self.affects(comp.name, n) for n in targets):
+                logging.debug("Actuator %s doesn't affect %s, so not moving it",
+                              comp.name, target.name)
+                continue
+
+            plan.append((comp_role, comp, conf))
+
+        self._mode_plans[mode, target.name] = plan
+        return plan
+
+    def _getSelectorsPlan(self, target):
+        """
+        Find the selectors to move so that the optical path leads to the target.
+        As it only depends on the microscope configuration, the result is cached.
         target (str): component name
-        return (list of tuple (futures, Component, dict)): for each move: the
-          future, the component, and the new position requested
+        return (list of tuple (Component, dict, str or None)): for each move: the
+          component, the position of the axes with choices, and the name of the
+          metadata with the rest of the position (or None)
         """
-        fmoves = []
-        for comp in self._actuators:
-            # TODO: pre-cache this as comp/target -> axis/pos
-            # TODO: don't do moves already done
+        try:
+            return self._selector_plans[target]
+        except KeyError:
+            pass
 
+        plan = []
+        for comp in self._actuators:
             # TODO: extend the path computation to "for every actuator which _affects_
             # the target, move if position known, and update path to that actuator"?
             # Eg, this would improve path computation on SPARCv2 with fiber aligner
@@ -732,19 +764,75 @@ class OpticalPathManager(object):
                             # set the position so it points to the target
                             mv[an] = pos
 
+            # The position in the metadata can be updated (eg, after alignment),
+            # so only remember which one to use.
             comp_md = comp.getMetadata()
             if target in comp_md.get(model.MD_FAV_POS_ACTIVE_DEST, {}):
-                mv.update(comp_md[model.MD_FAV_POS_ACTIVE])
+                md_pos = model.MD_FAV_POS_ACTIVE
             elif target in comp_md.get(model.MD_FAV_POS_DEACTIVE_DEST, {}):
-                mv.update(comp_md[model.MD_FAV_POS_DEACTIVE])
+                md_pos = model.MD_FAV_POS_DEACTIVE
+            else:
+                md_pos = None
+
+            if mv or md_pos:
+                plan.append((comp, mv, md_pos))
+                # make sure this component is also on the optical path
+                plan.extend(self._getSelectorsPlan(comp.name))
 
+        self._selector_plans[target] = plan
+        return plan
+
+    def _removeDoneMoves(self, comp, mv, fmoves=()):
+        """
+        Drop the axes which are already at the requested position, so that only
+        the moves actually needed are requested.
+        comp (Actuator): the component to move
+        mv (dict str -> value): the requested position
+        fmoves (list of tuple (futures, Component, dict)): moves already requested.
+          The axes they move are always kept, as their current position is not final.
+        return (dict str -> value): the position of the axes which have to move
+        """
+        moving = {a for f, c, m in fmoves if c.name == comp.name for a in m}
+        cur_pos = comp.position.value
+        if model.hasVA(comp, "referenced"):
+            referenced = comp.referenced.value
+        else:
+            referenced = {}
+
+        todo = {}
+        for axis, pos in mv.items():
+            # Never skip a non-referenced axis, as its position is not reliable
+            if axis in cur_pos and axis not in moving and referenced.get(axis, True):
+                cur = cur_pos[axis]
+                if cur == pos or (isinstance(pos, numbers.Real) and isinstance(cur, numbers.Real)
+                                  and util.almost_equal(cur, pos)):
+                    logging.debug("Not moving %s.%s, as it's already at %s", comp.name, axis, pos)
+                    continue
+            todo[axis] = pos
+
+        return todo
+
+    def selectorsToPath(self, target, fmoves=()):
+        """
+        Sets the selectors so the optical path leads to the target component
+        (usually a detector). Selectors already at the right position are not moved.
+        target (str): component name
+        fmoves (list of tuple (futures, Component, dict)): moves already requested
+        return (list of tuple (futures, Component, dict)): for each move: the
+          future, the component, and the new position requested
+        """
+        sel_fmoves = []
+        for comp, mv, md_pos in self._getSelectorsPlan(target):
+            mv = mv.copy()
+            if md_pos is not None:
+                mv.update(comp.getMetadata()[md_pos])
+
+            mv = self._removeDoneMoves(comp, mv, list(fmoves) + sel_fmoves)
             if mv:
                 logging.debug("Move %s added so %s targets to %s", mv, comp.name, target)
-                fmoves.append((comp.moveAbs(mv), comp, mv))
-                # make sure this component is also on the optical path
-                fmoves.extend(self.selectorsToPath(comp.name))
+                sel_fmoves.append((comp.moveAbs(mv), comp, mv))
 
-        return fmoves
+        return sel_fmoves
 
     def guessMode(self, guess_stream):
         """
@@ -25,7 +25,7 @@ import math
 import numpy
 from odemis import model, dataio
 from odemis.acq import acqmng
-from odemis.acq.align.autofocus import MeasureOpticalFocus, AutoFocus, MTD_EXHAUSTIVE
+from odemis.acq.align.autofocus import MeasureOpticalFocus, AutoFocus, MTD_EXHAUSTIVE, estimateAutoFocusTime
 from odemis.acq.stitching._simple import register, weave
 from odemis.acq.stitching._constants import WEAVER_COLLAGE_REVERSE
 from odemis.acq.stream import Stream, SEMStream, CameraStream, RepetitionStream, EMStream, ARStream, \
@@ -45,6 +45,76 @@ FOCUS_FIDELITY = 0.3
 FOCUS_RANGE_MARGIN = 10e-5
 # Indicate the number of tiles to skip during focus adjustment
 SKIP_TILES = 3
+# Maximum number of tiles, along each axis, where the focus is measured before the acquisition
+FOCUS_MAP_GRID = 3
+# Order of the polynomial surface fitted on the focus measurements (1 = plane)
+FOCUS_MAP_ORDER = 1
+
+
+class FocusMap(object):
+    """
+    Estimation of the focus position over the sample, as a polynomial surface
+    fitted on focus positions measured at some stage positions.
+    """
+
+    def __init__(self, order=FOCUS_MAP_ORDER):
+        """
+        :param order: (int >= 0) maximum order of the polynomial (1 = plane). If there are
+            not enough measurements for this order, a lower order is used.
+        """
+        self._order = order
+        self._points = []  # list of (float, float, float): x, y stage position and focus position
+        self._center = (0, 0)  # x, y, to keep the fitting well conditioned
+        self._fit_order = 0
+        self._coefs = None
+
+    @property
+    def points(self):
+        return list(self._points)
+
+    def add(self, x, y, z):
+        """
+        Add a focus measurement, and refit the surface
+        :param x, y: (float) stage position (m)
+        :param z: (float) focus position (m) at this stage position
+        """
+        self._points.append((x, y, z))
+        self._fit()
+
+    @staticmethod
+    def _getTerms(x, y, order):
+        """
+        return (ndarray of shape (N, T)): for each position, the value of each polynomial term
+        """
+        x, y = numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float)
+        return numpy.stack([x ** i * y ** j for i in range(order + 1) for j in range(order + 1 - i)], axis=-1)
+
+    def _fit(self):
+        pts = numpy.array(self._points, dtype=float)
+        self._center = pts[:, 0].mean(), pts[:, 1].mean()
+        x, y, z = pts[:, 0] - self._center[0], pts[:, 1] - self._center[1], pts[:, 2]
+
+        # Use the highest order that the number of measurements allows
+        order = self._order
+        while order > 0 and len(pts) < (order + 1) * (order + 2) // 2:
+            order -= 1
+
+        terms = self._getTerms(x, y, order)
+        self._coefs = numpy.linalg.lstsq(terms, z, rcond=None)[0]
+        self._fit_order = order
+        logging.debug("Fitted focus surface of order %d on %d points: %s", order, len(pts), self._coefs)
+
+    def predict(self, x, y):
+        """
+        Estimate the focus position at the given stage position
+        :param x, y: (float) stage position (m)
+        :return: (float) focus position (m)
+        :raise LookupError: if there is no measurement yet
+        """
+        if self._coefs is None:
+            raise LookupError("No focus measured yet")
+        terms = self._getTerms(x - self._center[0], y - self._center[1], self._fit_order)
+        return float(numpy.dot(terms, self._coefs))
 
 
 class TiledAcquisitionTask(object):
@@ -52,7 +122,8 @@ class TiledAcquisitionTask(object):
     The goal of this task is to acquire a set of tiles then stitch them together
     """
 
-    def __init__(self, streams, stage, area, overlap, settings_obs=None, log_path=None, future=None):
+    def __init__(self, streams, stage, area, overlap, settings_obs=None, log_path=None, future=None,
+                 focus_map=False):
         """
         :param streams: (Stream) the streams to acquire
         :param stage: (Actuator) the sample stage to move to the possible tiles locations
@@ -62,6 +133,9 @@ class TiledAcquisitionTask(object):
             that should be saved as metadata
         :param log_path: (string) directory and filename pattern to save acquired images for debugging
         :param future: (ProgressiveFuture or None) future to track progress, pass None for estimation only
+        :param focus_map: (bool) if True, and there is a stream with a focuser, the focus is first measured
+            on a few tiles across the area, and each tile is acquired at the focus predicted from these
+            measurements.
         """
         self._future = future
         self._streams = streams
@@ -91,12 +165,17 @@ class TiledAcquisitionTask(object):
         if self._focus_stream:
             # save initial focus value to be used in the AutoFocus function
             self._good_focus = self._focus_stream.focuser.position.value['z']
-            focuser_range = self._focus_stream.focuser.axes['z'].range
-            # Calculate the focus range by half the focus margin on each side of good focus
-            focus_rng = (self._good_focus - FOCUS_RANGE_MARGIN / 2, self._good_focus + FOCUS_RANGE_MARGIN / 2)
-            # Clip values with focuser_range
-            self._focus_rng = (max(focus_rng[0], focuser_range[0]), min((focus_rng[1], focuser_range[1])))
-            logging.debug("Calculated focus range ={}".format(self._focus_rng))
+
+        # Tiles where to measure the focus before the acquisition, if using a focus map
+        self._focus_map = None
+        self._focus_map_indices = []
+        if self._focus_stream and focus_map:
+            self._focus_map_indices = self._getFocusMapIndices()
+            # Only worthy if it needs less autofocus runs than tiles
+            if len(self._focus_map_indices) < self._nx * self._ny:
+                self._focus_map = FocusMap()
+            else:
+                self._focus_map_indices = []
 
         self._stage = stage
         self._starting_pos = {'x': area[0], 'y': area[1]}  # left, top
@@ -163,6 +242,36 @@ class TiledAcquisitionTask(object):
         logging.debug("Calculated number of tiles nx= %s, ny= %s" % (nx, ny))
         return nx, ny
 
+    def _getFocusRange(self, good_focus):
+        """
+        Calculate the focus range by half the focus margin on each side of the given focus
+        :param good_focus: (float) focus position around which to search
+        :return: (float, float) min/max focus positions, clipped to the focuser range
+        """
+        focuser_range = self._focus_stream.focuser.axes['z'].range
+        focus_rng = (good_focus - FOCUS_RANGE_MARGIN / 2, good_focus + FOCUS_RANGE_MARGIN / 2)
+        return max(focus_rng[0], focuser_range[0]), min(focus_rng[1], focuser_range[1])
+
+    def _getFocusMapIndices(self):
+        """
+        Select the tiles where to measure the focus, evenly spread over the area,
+        with at most FOCUS_MAP_GRID tiles along each axis
+        :return: (list of tuple(int, int)): x/y indices of the tiles, in scanning order
+        """
+        xs = numpy.unique(numpy.round(numpy.linspace(0, self._nx - 1, min(self._nx, FOCUS_MAP_GRID))).astype(int))
+        ys = numpy.unique(numpy.round(numpy.linspace(0, self._ny - 1, min(self._ny, FOCUS_MAP_GRID))).astype(int))
+        return [(int(xs[ix]), int(ys[iy])) for ix, iy in self._generateScanningIndices((len(xs), len(ys)))]
+
+    def _getTilePosition(self, idx, tile_size):
+        """
+        :param idx: (tuple (int, int)) index of tile
+        :param tile_size: (tuple (float, float)) total tile size
+        :return: (float, float) x, y stage position of the tile
+        """
+        overlap = 1 - self._overlap
+        return (self._starting_pos["x"] + idx[0] * tile_size[0] * overlap,
+                self._starting_pos["y"] - idx[1] * tile_size[1] * overlap)
+
     def _cancelAcquisition(self, future):
         """
         Canceler of acquisition task.
@@ -214,10 +323,11 @@ class TiledAcquisitionTask(object):
         # don't move on the axis that is not supposed to have changed
         m = {}
         idx_change = numpy.subtract(idx, prev_idx)
+        pos = self._getTilePosition(idx, tile_size)
         if idx_change[0]:
-            m["x"] = self._starting_pos["x"] + idx[0] * tile_size[0] * overlap
+            m["x"] = pos[0]
         if idx_change[1]:
-            m["y"] = self._starting_pos["y"] - idx[1] * tile_size[1] * overlap
+            m["y"] = pos[1]
 
         logging.debug("Moving to tile %s at %s m", idx, m)
         f = self._stage.moveAbs(m)
@@ -379,8 +489,13 @@ class TiledAcquisitionTask(object):
         :param remaining: (int > 0) The number of remaining tiles
         :returns: (float) estimated required time
         """
+        focus_map_time = 0
         if remaining is None:
             remaining = self._nx * self._ny
+            # The focus map is measured before acquiring the first tile
+            if self._focus_map_indices:
+                focus_map_time = len(self._focus_map_indices) * estimateAutoFocusTime(self._focus_stream.detector,
+                                                                                      self._focus_stream.emitter)
         acq_time = acqmng.estimateTime(self._streams)
 
         # Estimate stitching time based on number of pixels in the overlapping part
@@ -398,7 +513,7 @@ class TiledAcquisitionTask(object):
         except ValueError:  # no current streams
             move_time = 0.5
 
-        return acq_time * remaining + move_time + stitch_time
+        return acq_time * remaining + move_time + stitch_time + focus_map_time
 
     def _save_tiles(self, ix, iy, das):
         """
@@ -438,11 +553,15 @@ class TiledAcquisitionTask(object):
         """
         da_list = []  # for each position, a list of DataArrays
         prev_idx = [0, 0]
+        if self._focus_map:
+            prev_idx = self._measureFocusMap(prev_idx)
         i = 0
         for ix, iy in self._generateScanningIndices((self._nx, self._ny)):
             logging.debug("Acquiring tile %dx%d", ix, iy)
             self._moveToTile((ix, iy), prev_idx, self._sfov)
             prev_idx = ix, iy
+            if self._focus_map:
+                self._moveToPredictedFocus((ix, iy))
 
             das = self._acquireTile(i, ix, iy)
 
@@ -464,6 +583,71 @@ class TiledAcquisitionTask(object):
             i += 1
         return da_list
 
+    def _runAutoFocus(self, good_focus):
+        """
+        Run the autofocus around the given focus position, and block until it's over
+        :param good_focus: (float) focus position expected to be close to the best one
+        :return: (float) the focus position found
+        :raise CancelledError: if the acquisition is cancelled
+        """
+        self._future.running_subf = AutoFocus(self._focus_stream.detector,
+                                              self._focus_stream.emitter,
+                                              self._focus_stream.focuser,
+                                              good_focus=good_focus,
+                                              rng_focus=self._getFocusRange(good_focus),
+                                              method=MTD_EXHAUSTIVE)
+        foc_pos, _ = self._future.running_subf.result()  # blocks until autofocus is finished
+        if self._future._task_state == CANCELLED:
+            raise CancelledError()
+        return foc_pos
+
+    def _measureFocusMap(self, prev_idx):
+        """
+        Run the autofocus on a few tiles spread over the area, and fit the focus map on the results
+        :param prev_idx: (tuple (int, int)) index of the tile at the current stage position
+        :return: (tuple (int, int)) index of the tile at the stage position, after measuring
+        :raise CancelledError: if the acquisition is cancelled
+        """
+        for idx in self._focus_map_indices:
+            if self._future._task_state == CANCELLED:
+                raise CancelledError()
+            self._moveToTile(idx, prev_idx, self._sfov)
+            prev_idx = idx
+            pos = self._getTilePosition(idx, self._sfov)
+            try:
+                good_focus = self._focus_map.predict(*pos)
+            except LookupError:
+                good_focus = self._good_focus
+            try:
+                foc_pos = self._runAutoFocus(good_focus)
+            except CancelledError:
+                raise
+            except Exception:
+                logging.exception("Running autofocus failed on tile %s, not used for the focus map.", idx)
+                continue
+            logging.debug("Measured focus %s m on tile %s at %s", foc_pos, idx, pos)
+            self._focus_map.add(pos[0], pos[1], foc_pos)
+
+        if not self._focus_map.points:
+            logging.warning("Failed to measure the focus, will acquire the tiles without focus map.")
+            self._focus_map = None
+        return prev_idx
+
+    def _moveToPredictedFocus(self, idx):
+        """
+        Move the focus to the position expected by the focus map for the given tile
+        :param idx: (tuple (int, int)) index of the tile at the current stage position
+        """
+        focuser = self._focus_stream.focuser
+        foc_pos = self._focus_map.predict(*self._getTilePosition(idx, self._sfov))
+        rng = focuser.axes['z'].range
+        foc_pos = min(max(rng[0], foc_pos), rng[1])
+        logging.debug("Moving focus to %s m for tile %s", foc_pos, idx)
+        self._future.running_subf = focuser.moveAbs({'z': foc_pos})
+        self._future.running_subf.result()
+        if self._future._task_state == CANCELLED:
+            raise CancelledError()
+
     def _adjustFocus(self, das, i, ix, iy):
         if i % SKIP_TILES != 0:
             logging.debug("Skipping focus adjustment..")
@@ -479,21 +663,21 @@ class TiledAcquisitionTask(object):
             self._good_focus_level = current_focus_level
         # Run autofocus if current focus got worse than permitted deviation
         if abs(current_focus_level - self._good_focus_level) / self._good_focus_level > FOCUS_FIDELITY:
+            pos = self._getTilePosition((ix, iy), self._sfov)
+            if self._focus_map:
+                good_focus = self._focus_map.predict(*pos)
+            else:
+                good_focus = self._good_focus
             try:
-                self._future.running_subf = AutoFocus(self._focus_stream.detector,
-                                                      self._focus_stream.emitter,
-                                                      self._focus_stream.focuser,
-                                                      good_focus=self._good_focus,
-                                                      rng_focus=self._focus_rng,
-                                                      method=MTD_EXHAUSTIVE)
-                self._future.running_subf.result()  # blocks until autofocus is finished
-                if self._future._task_state == CANCELLED:
-                    raise CancelledError()
+                foc_pos = self._runAutoFocus(good_focus)
             except CancelledError:
                 raise
             except Exception as ex:
                 logging.exception("Running autofocus failed on image i= %s." % i)
             else:
+                # Refine the focus map with this new measurement
+                if self._focus_map:
+                    self._focus_map.add(pos[0], pos[1], foc_pos)
                 # Reacquire the out of focus tile (which should be corrected now)
                 das = self._acquireTile(i, ix, iy)
         return das
@@ -566,13 +750,15 @@ class TiledAcquisitionTask(object):
         return st_data
 
 
-def estimateTiledAcquisitionTime(streams, stage, area, overlap=0.2, settings_obs=None, log_path=None):
+def estimateTiledAcquisitionTime(streams, stage, area, overlap=0.2, settings_obs=None, log_path=None,
+                                 focus_map=False):
     """
     Estimate the time required to complete a tiled acquisition task
     :returns: (float) estimated required time
     """
     # Create a tiled acquisition task with future = None
-    task = TiledAcquisitionTask(streams, stage, area, overlap, settings_obs, log_path, future=None)
+    task = TiledAcquisitionTask(streams, stage, area, overlap, settings_obs, log_path, future=None,
+                                focus_map=focus_map)
     return task.estimateTime()
 
 
@@ -586,7 +772,7 @@ def estimateTiledAcquisitionMemory(streams, stage, area, overlap=0.2, settings_o
     return task.estimateMemory()
 
 
-def acquireTiledArea(streams, stage, area, overlap=0.2, settings_obs=None, log_path=None):
+def acquireTiledArea(streams, stage, area, overlap=0.2, settings_obs=None, log_path=None, focus_map=False):
     """
     Start a tiled acquisition task for the given streams (SEM or FM) in order to
     build a complete view of the TEM grid. Needed tiles are first acquired for
@@ -599,6 +785,8 @@ def acquireTiledArea(streams, stage, area, overlap=0.2, settings_obs=None, log_p
     :param settings_obs: (SettingsObserver or None) class that contains a list of all VAs
         that should be saved as metadata
     :param log_path: (string) directory and filename pattern to save acquired images for debugging
+    :param focus_map: (bool) if True, and a stream has a focuser, the focus of each tile is predicted
+        from focus measurements done on a few tiles spread over the area, before the acquisition
     :return: (ProgressiveFuture) an object that represents the task, allow to
         know how much time before it is over and to cancel it. It also permits
         to receive the result of the task, which is a list of model.DataArray:
@@ -609,7 +797,8 @@ def acquireTiledArea(streams, stage, area, overlap=0.2, settings_obs=None, log_p
     future.running_subf = model.InstantaneousFuture()
     future._task_lock = threading.Lock()
     # Create a tiled acquisition task
-    task = TiledAcquisitionTask(streams, stage, area, overlap, settings_obs, log_path, future=future)
+    task = TiledAcquisitionTask(streams, stage, area, overlap, settings_obs, log_path, future=future,
+                                focus_map=focus_map)
     future.task_canceller = task._cancelAcquisition  # let the future cancel the task
     # Estimate memory and check if it's sufficient to decide on running the task
     mem_sufficient, mem_est = task.estimateMemory()
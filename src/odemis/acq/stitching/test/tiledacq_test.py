@@ -30,7 +30,7 @@ import odemis
 import odemis.acq.stream as stream
 from odemis import model
 from odemis.acq.acqmng import SettingsObserver
-from odemis.acq.stitching._tiledacq import TiledAcquisitionTask, acquireTiledArea
+from odemis.acq.stitching._tiledacq import TiledAcquisitionTask, acquireTiledArea, FocusMap
 from odemis.util import test
 from odemis.util.comp import compute_camera_fov
 from odemis.util.test import assert_pos_almost_equal
@@ -159,6 +159,36 @@ class CRYOSECOMTestCase(unittest.TestCase):
         exp_pos = {'x': -0.001, 'y': -0.001008}
         assert_pos_almost_equal(self.stage.position.value, exp_pos, atol=100e-9, match_all=False)
 
+    def test_focus_map_indices(self):
+        """
+        Test the selection of the tiles where the focus is measured before the acquisition
+        """
+        area = (-0.001, -0.001, 0.001, 0.001)
+        overlap = 0.2
+        tiled_acq_task = TiledAcquisitionTask(self.fm_streams, self.stage, area=area, overlap=overlap,
+                                              future=model.InstantaneousFuture(), focus_map=True)
+        tiled_acq_task._nx, tiled_acq_task._ny = 5, 4
+        indices = tiled_acq_task._getFocusMapIndices()
+        self.assertEqual(indices, [(0, 0), (2, 0), (4, 0), (4, 2), (2, 2), (0, 2), (0, 3), (2, 3), (4, 3)])
+
+        tiled_acq_task._nx, tiled_acq_task._ny = 2, 1
+        indices = tiled_acq_task._getFocusMapIndices()
+        self.assertEqual(indices, [(0, 0), (1, 0)])
+
+        # No focus map if every tile would need a focus measurement
+        area = (0, 0, 1e-6, 1e-6)
+        tiled_acq_task = TiledAcquisitionTask(self.fm_streams, self.stage, area=area, overlap=overlap,
+                                              future=model.InstantaneousFuture(), focus_map=True)
+        self.assertIsNone(tiled_acq_task._focus_map)
+
+        # No focus map if not requested (default), or no focuser
+        tiled_acq_task = TiledAcquisitionTask(self.fm_streams, self.stage, area=(-0.001, -0.001, 0.001, 0.001),
+                                              overlap=overlap, future=model.InstantaneousFuture())
+        self.assertIsNone(tiled_acq_task._focus_map)
+        tiled_acq_task = TiledAcquisitionTask(self.sem_streams, self.stage, area=(-0.001, -0.001, 0.001, 0.001),
+                                              overlap=overlap, future=model.InstantaneousFuture(), focus_map=True)
+        self.assertIsNone(tiled_acq_task._focus_map)
+
     def test_get_fov(self):
         """
         Test getting the fov for sem and fm streams
@@ -213,6 +243,42 @@ class CRYOSECOMTestCase(unittest.TestCase):
         self.assertIsInstance(data[0], model.DataArray)
         self.assertEqual(len(data[0].shape), 2)
 
+    def test_focus_map(self):
+        """
+        Test the acquisition with a focus map: each tile is acquired at the predicted focus
+        """
+        fm_fov = compute_camera_fov(self.ccd)
+        area = (0, 0, fm_fov[0] * 3, fm_fov[1] * 3)  # left, top, right, bottom
+        overlap = 0.2
+        tiled_acq_task = TiledAcquisitionTask(self.fm_streams, self.stage, area=area, overlap=overlap,
+                                              future=model.InstantaneousFuture(), focus_map=True)
+        self.assertIsNotNone(tiled_acq_task._focus_map)
+        exp_indices = set(tiled_acq_task._generateScanningIndices((tiled_acq_task._nx, tiled_acq_task._ny)))
+
+        # Record the focus position after each move to the predicted focus
+        focus_moves = {}  # tile index -> (predicted focus, actual focus)
+        orig_move = TiledAcquisitionTask._moveToPredictedFocus
+
+        def move_to_predicted_focus(task, idx):
+            orig_move(task, idx)
+            pred = task._focus_map.predict(*task._getTilePosition(idx, task._sfov))
+            rng = self.focus.axes["z"].range
+            pred = min(max(rng[0], pred), rng[1])
+            focus_moves[idx] = (pred, self.focus.position.value["z"])
+
+        TiledAcquisitionTask._moveToPredictedFocus = move_to_predicted_focus
+        self.addCleanup(setattr, TiledAcquisitionTask, "_moveToPredictedFocus", orig_move)
+
+        self.stage.moveAbs({'x': 0, 'y': 0}).result()
+        future = acquireTiledArea(self.fm_streams, self.stage, area=area, overlap=overlap, focus_map=True)
+        data = future.result()
+        self.assertEqual(future._state, FINISHED)
+        self.assertEqual(len(data), 2)
+
+        self.assertEqual(set(focus_moves.keys()), exp_indices)
+        for idx, (pred, actual) in focus_moves.items():
+            self.assertAlmostEqual(pred, actual, delta=1e-6, msg="Focus not at prediction for tile %s" % (idx,))
+
     def test_progress(self):
         """
        Test progress update of acquireTiledArea function
@@ -265,5 +331,49 @@ class CRYOSECOMTestCase(unittest.TestCase):
         self.updates += 1
 
 
+class FocusMapTestCase(unittest.TestCase):
+    """
+    Test the FocusMap, which doesn't need a backend
+    """
+
+    def test_no_point(self):
+        fmap = FocusMap()
+        with self.assertRaises(LookupError):
+            fmap.predict(0, 0)
+
+    def test_plane(self):
+        """
+        With 3 points or more, the focus is predicted on a plane
+        """
+        fmap = FocusMap()
+        fmap.add(1e-3, 2e-3, 5e-3)
+        # With a single point, the focus is the same everywhere
+        self.assertAlmostEqual(fmap.predict(-1e-3, 4e-3), 5e-3)
+
+        # Tilted sample: focus increases by 10 µm/mm along X and decreases by 20 µm/mm along Y
+        fmap.add(2e-3, 2e-3, 5.01e-3)
+        fmap.add(1e-3, 3e-3, 4.98e-3)
+        self.assertAlmostEqual(fmap.predict(3e-3, 4e-3), 5e-3 + 0.02e-3 - 0.04e-3)
+
+        # Refining with a point on the same plane doesn't change the prediction
+        fmap.add(3e-3, 3e-3, 5e-3)
+        self.assertEqual(len(fmap.points), 4)
+        self.assertAlmostEqual(fmap.predict(3e-3, 4e-3), 5e-3 + 0.02e-3 - 0.04e-3)
+
+    def test_polynomial(self):
+        """
+        With a higher order, a curved sample is also correctly predicted
+        """
+        def focus(x, y):
+            return 1e-3 + 2 * x ** 2 + 0.01 * y
+
+        fmap = FocusMap(order=2)
+        for x in (0, 1e-3, 2e-3):
+            for y in (0, 1e-3, 2e-3):
+                fmap.add(x, y, focus(x, y))
+
+        self.assertAlmostEqual(fmap.predict(1.5e-3, 0.5e-3), focus(1.5e-3, 0.5e-3))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1203,6 +1203,14 @@ class Stream(object):
 
         # Initially, _drange might be None, in which case it will be guessed
         hist, edges = img.histogram(data, irange=self._drange)
+        self._setHistogram(hist, edges)
+
+    def _setHistogram(self, hist, edges):
+        """
+        Update the .histogram VA (and the intensityRange if auto_bc is enabled)
+        hist (ndarray 1D of 0<=int): the full histogram
+        edges (tuple of numbers): lowest and highest bound of the histogram
+        """
         if hist.size > 256:
             chist = img.compactHistogram(hist, 256)
         else:
@@ -1258,7 +1266,7 @@ class Stream(object):
         tform = AffineTransform(rotation=rotation, scale=pxs, translation=translation)
         L = numpy.array([(1, 0), (-shear, 1)])
         tform.transformation_matrix = numpy.dot(tform.transformation_matrix, L)
-        pixel_pos_c = tform.inverse()(p_pos)
+        pixel_pos_c = tform.apply_inverse(p_pos)
         # a "-" is used for the y coordinate because Y axis has the opposite direction in physical coordinates
         pixel_pos = int(pixel_pos_c[0] + size[0] / 2), - int(pixel_pos_c[1] - size[1] / 2)
         if 0 <= pixel_pos[0] < size[0] and 0 <= pixel_pos[1] < size[1]:
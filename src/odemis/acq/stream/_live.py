@@ -58,6 +58,12 @@ class LiveStream(Stream):
                                          range=((0, 0, 0, 0), (1, 1, 1, 1)),
                                          cls=(int, long, float))
 
+        # Raw data, background and histogram computed with the last image
+        # (when using the fused RGB projection), to be reused for the .histogram
+        self._fused_hist = None
+        # True when the histogram of the new data is to be computed with the image
+        self._hist_with_image = False
+
         self._ht_needs_recompute = threading.Event()
         self._hthread = threading.Thread(target=self._histogram_thread,
                                          args=(weakref.ref(self),),
@@ -191,9 +197,98 @@ class LiveStream(Stream):
         else:
             self.raw[0] = data
 
-        self._shouldUpdateHistogram()
+        # If the histogram is computed together with the image, only update the
+        # histogram after the image, so that it can be reused.
+        if self._canFuseProjection(data):
+            self._hist_with_image = True
+        else:
+            self._shouldUpdateHistogram()
         self._shouldUpdateImage()
 
+    def _canFuseProjection(self, data):
+        """
+        data (DataArray): raw data
+        return (bool): True if the image and histogram of the data can be
+          computed together, by the fused projection.
+        """
+        # Only possible if the subclass doesn't have its own projection
+        if type(self)._updateImage is not LiveStream._updateImage:
+            return False
+        return (isinstance(data, model.DataArray) and data.ndim == 2 and
+                data.dtype == numpy.uint16 and isinstance(self.tint.value, tuple))
+
+    def _updateImage(self):
+        """
+        Recomputes the image with all the raw data available.
+        For 16-bit greyscale data (typically, from a camera), the background
+        subtraction, the RGB projection and the histogram are all computed in
+        a single pass. The histogram is then reused by _updateHistogram().
+        """
+        # If the histogram of the new data waits for the image, let it know
+        # once the image is computed (whichever way it's computed).
+        hist_with_image, self._hist_with_image = self._hist_with_image, False
+        try:
+            if not self._updateFusedImage():
+                super(LiveStream, self)._updateImage()
+        finally:
+            if hist_with_image:
+                self._shouldUpdateHistogram()
+
+    def _updateFusedImage(self):
+        """
+        Update the image (and keep the histogram) using the fused projection
+        return (bool): False if the fused projection cannot be used for this data
+        """
+        if not self.raw or not isinstance(self.raw, list):
+            return False
+
+        data = self.raw[0]
+        bkg = self.background.value
+        tint = self.tint.value
+        if not self._canFuseProjection(data):
+            return False
+
+        try:
+            irange = self._getDisplayIRange()
+            rgbim, hist = img.Subtract2RGBHistogram(data, bkg, irange, tint)
+        except ValueError as ex:
+            # Typically, the background doesn't fit the data
+            logging.debug("Cannot use fused projection: %s", ex)
+            return False
+
+        try:
+            self._fused_hist = (data, bkg, hist)
+            rgbim.flags.writeable = False
+            md = self._find_metadata(data.metadata)
+            md[model.MD_DIMS] = "YXC"  # RGB format
+            self.image.value = model.DataArray(rgbim, md)
+        except Exception:
+            logging.exception("Updating %s %s image", self.__class__.__name__, self.name.value)
+        return True
+
+    def _updateHistogram(self, data=None):
+        # If the histogram was already computed together with the image, reuse it
+        fused = self._fused_hist
+        if (data is None and fused is not None and self.raw and
+            fused[0] is self.raw[0] and fused[1] is self.background.value):
+            raw, _, hist = fused
+            self._updateDRange(raw)
+            drange = self._drange
+            if drange is not None and drange[0] == 0:
+                # Same as img.histogram() for unsigned data starting at 0
+                length = drange[1] + 1
+                if hist.size < length:
+                    hist = numpy.pad(hist, (0, length - hist.size), "constant")
+                elif hist.size > length:
+                    # Values above the range are displayed saturated => count them in the last bin
+                    logging.debug("Clipping values up to %d in the histogram of range %s", hist.size - 1, drange)
+                    hist = hist[:length].copy()
+                    hist[-1] += fused[2][length:].sum()
+                self._setHistogram(hist, (0, length - 1))
+                return
+
+        super(LiveStream, self)._updateHistogram(data)
+
     def _onBackground(self, data):
         """Called when the background is changed"""
 
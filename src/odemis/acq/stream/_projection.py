@@ -22,11 +22,14 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 from __future__ import division
 
+import collections
+from concurrent import futures
 import threading
 import weakref
 import logging
 import time
 import math
+import multiprocessing
 import gc
 import numpy
 
@@ -40,12 +43,198 @@ except ImportError:
 
 from odemis import model
 from odemis.util import img, angleres
-from scipy import ndimage
 from odemis.model import MD_PIXEL_SIZE, MD_POL_EPHI, MD_POL_EX, MD_POL_EY, MD_POL_EZ, MD_POL_ETHETA, MD_POL_DS0, \
     MD_POL_S0, MD_POL_DOP, MD_POL_DOLP, MD_POL_UP
 from odemis.acq.stream._static import StaticSpectrumStream
 from abc import abstractmethod
 
+# Maximum memory (in bytes) used by all the tiles cached, raw and projected,
+# for all the tiled projections together.
+TILE_CACHE_SIZE = 512 * 2 ** 20  # B
+
+
+class TileCache(object):
+    """
+    Thread-safe Least Recently Used cache, bounded by the memory used by its
+    content. It's used to share the (raw and projected) tiles between all the
+    projections of the same data.
+    The keys are tuples, with the data source identifier (see get_source_id())
+    as second element, so that the entries of a data source are dropped as soon
+    as the data source is garbage collected.
+    """
+
+    def __init__(self, max_size):
+        """
+        max_size (0<int): maximum number of bytes that can be held in the cache.
+          When this size is reached, the least recently used entries are dropped.
+        """
+        self.max_size = max_size
+        self._size = 0  # B, current size of all the entries
+        self._entries = collections.OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+        # data source (DataArrayShadow) -> int, to create an identifier unique for
+        # the lifetime of the data source (unlike id()), without holding it.
+        self._sources = weakref.WeakKeyDictionary()
+        self._next_source_id = 0
+        # identifiers of the data sources garbage collected, whose entries
+        # couldn't be dropped immediately (because the cache was in use)
+        self._dead_sources = collections.deque()
+
+    def get_source_id(self, das):
+        """
+        das (DataArrayShadow): the data source of the tiles
+        return (int): identifier of the data source, to be used in the keys
+        """
+        with self._lock:
+            try:
+                return self._sources[das]
+            except KeyError:
+                sid = self._next_source_id
+                self._next_source_id += 1
+                self._sources[das] = sid
+                weakref.finalize(das, self._on_source_deleted, sid)
+                return sid
+
+    def _on_source_deleted(self, sid):
+        """
+        Called when a data source is garbage collected, to drop all its entries
+        sid (int): identifier of the data source
+        """
+        self._dead_sources.append(sid)
+        # The garbage collection can happen at any time, including while this
+        # thread holds the lock. In such case, the entries will be dropped on
+        # the next access.
+        if self._lock.acquire(False):
+            try:
+                self._purge_dead_sources()
+            finally:
+                self._lock.release()
+
+    def _purge_dead_sources(self):
+        """
+        Drop the entries of the data sources garbage collected.
+        Must be called with the lock taken.
+        """
+        if not self._dead_sources:
+            return
+        dead = set()
+        while self._dead_sources:
+            dead.add(self._dead_sources.popleft())
+        for key in [k for k in self._entries if k[1] in dead]:
+            self._size -= self._entries.pop(key)[1]
+
+    def get(self, key):
+        """
+        key (hashable): the key of the entry
+        return (object or None): the value of the entry, or None if not in the cache
+        """
+        with self._lock:
+            self._purge_dead_sources()
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return None
+            # put it back at the end, as most recently used
+            self._entries[key] = (value, size)
+            return value
+
+    def put(self, key, value):
+        """
+        Add (or replace) an entry in the cache, and drop the least recently used
+          entries if the cache is too big.
+        key (hashable): the key of the entry
+        value (DataArray): the value to cache
+        """
+        size = value.nbytes
+        with self._lock:
+            self._purge_dead_sources()
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size and len(self._entries) > 1:
+                _, (_, osize) = self._entries.popitem(last=False)
+                self._size -= osize
+
+    def __contains__(self, key):
+        with self._lock:
+            self._purge_dead_sources()
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            self._purge_dead_sources()
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._dead_sources.clear()
+            self._entries.clear()
+            self._size = 0
+
+
+# Shared by all the projections, so that the memory usage is bounded globally,
+# and the tiles can be reused when displaying the same data in multiple views.
+_tile_cache = TileCache(TILE_CACHE_SIZE)
+
+# Executor to read and project in advance the tiles which are likely to be
+# displayed soon. A single thread, to not slow down the main computation.
+_prefetch_executor = model.CancellableThreadPoolExecutor(max_workers=1)
+
+# Number of tiles read and projected simultaneously. Most of the computation
+# is done by numpy (or reading the file), which release the GIL, so the
+# projection of the tiles scales with the number of CPUs.
+TILE_PROJECTION_WORKERS = max(1, min(multiprocessing.cpu_count(), 8))
+_projection_executor = futures.ThreadPoolExecutor(max_workers=TILE_PROJECTION_WORKERS)
+
+# radius (float) -> 2D ndarray of bool: the pixels in a disk, see _getDiskMask()
+_disk_masks = {}
+
+
+def _getDiskMask(radius):
+    """
+    Provides the pixels whose center is within a disk centered on a pixel.
+    The masks are cached, as typically only a few different radii are used.
+    radius (0<=float): radius of the disk in px
+    return (2D ndarray of bool of shape (2*R+1, 2*R+1), with R = int(radius)):
+      True for the pixels in the disk, the center pixel being at (R, R).
+      It must not be modified.
+    """
+    try:
+        return _disk_masks[radius]
+    except KeyError:
+        pass
+
+    r = int(radius)
+    dy, dx = numpy.mgrid[-r:r + 1, -r:r + 1]
+    mask = numpy.hypot(dx, dy) <= radius
+    mask.flags.writeable = False
+    _disk_masks[radius] = mask
+    return mask
+
+
+def _meanInDisk(data, x, y, width):
+    """
+    Average the data over the pixels whose center is within a disk.
+    data (ndarray of shape ...YX): the data. The last two dimensions are the
+      spatial ones.
+    x, y (int): the position of the center of the disk, in px
+    width (0<float): the diameter of the disk, in px. The pixels outside of
+      the data are not counted.
+    return (ndarray of float64 of shape ...): the mean over all the pixels in the disk
+    """
+    mask = _getDiskMask(width / 2)
+    r = mask.shape[0] // 2
+    # Crop the disk to the part inside the data
+    y0, y1 = max(0, y - r), min(y + r + 1, data.shape[-2])
+    x0, x1 = max(0, x - r), min(x + r + 1, data.shape[-1])
+    mask = mask[y0 - y + r:y1 - y + r, x0 - x + r:x1 - x + r]
+
+    # Only the pixels in the disk are copied, as a ...N array
+    pixels = data[..., y0:y1, x0:x1][..., mask]
+    return pixels.sum(axis=-1, dtype=numpy.float64) / pixels.shape[-1]
+
 
 class DataProjection(object):
 
@@ -165,8 +354,9 @@ class RGBProjection(DataProjection):
         Indicate that the .image should be computed _and_ that all the previous
         tiles cached (and visible in the new image) have to be recomputed too
         """
-        # set projected tiles cache as invalid
-        self._projectedTilesInvalid = True
+        # Note: the projected tiles are cached with the projection settings
+        # (tint, intensity range) as part of their key, so the tiles previously
+        # projected are automatically not reused.
         self._shouldUpdateImage()
 
     def onTint(self, value):
@@ -822,6 +1012,11 @@ class RGBSpatialProjection(RGBProjection):
     That is the recommended way to create a RGBSpatialProjection.
     """
 
+    # If True, when the data is pyramidal, the tiles around the displayed area
+    # are read and projected in advance, so that they are immediately available
+    # when panning or zooming.
+    prefetch_tiles = True
+
     def __new__(cls, stream):
 
         if isinstance(stream, StaticSpectrumStream):
@@ -857,12 +1052,9 @@ class RGBSpatialProjection(RGBProjection):
             self.rect = model.TupleContinuous(full_rect, rect_range)
             self.mpp.subscribe(self._onMpp)
             self.rect.subscribe(self._onRect)
-            # initialize the projected tiles cache
-            self._projectedTilesCache = {}
-            # initialize the raw tiles cache
-            self._rawTilesCache = {}
-            # When True, the projected tiles cache should be invalidated
-            self._projectedTilesInvalid = True
+            # Incremented every time the tiles to prefetch change, to stop the
+            # prefetching of the previous tiles
+            self._prefetch_gen = 0
 
         self._shouldUpdateImage()
 
@@ -878,15 +1070,18 @@ class RGBSpatialProjection(RGBProjection):
         exp = round(exp)
         return ps0 * 2 ** exp
 
-    def _projectXY2RGB(self, data, tint=(255, 255, 255)):
+    def _projectXY2RGB(self, data, tint=(255, 255, 255), irange=None):
         """
         Project a 2D spatial DataArray into a RGB representation
         data (DataArray): 2D DataArray
         tint ((int, int, int)): colouration of the image, in RGB.
+        irange (None or (float, float)): intensity range to map to the
+          colours. If None, the current display range of the stream is used.
         return (DataArray): 3D DataArray
         """
-        # TODO replace by local irange
-        irange = self.stream._getDisplayIRange()
+        if irange is None:
+            # TODO replace by local irange
+            irange = self.stream._getDisplayIRange()
         rgbim = img.DataArray2RGB(data, irange, tint)
         rgbim.flags.writeable = False
         # Commented to prevent log flooding
@@ -988,55 +1183,177 @@ class RGBSpatialProjection(RGBProjection):
             int(round(rect[1] / (-ps[1]) + img_shape[1] / 2)) - 1,
         )
 
-    def _getTile(self, x, y, z, prev_raw_cache, prev_proj_cache):
+    def _getProjectionSettings(self):
+        """
+        Read all the settings which have an influence on the projection of a tile.
+        It should be called only once per update of the image (from the image
+        update thread), and the result passed to each tile projection. This
+        way, all the tiles are projected with the same settings, and the
+        projection workers don't access the stream (eg, the display range,
+        which might be updated at the same time).
+        return (tuple of tint, (float, float), int or None): tint, intensity
+          range and Z index
         """
-        Get a tile from a DataArrayShadow. Uses cache.
-        The cache for projected tiles and the cache for raw tiles has always the same tiles
+        tint = self.stream.tint.value
+        if isinstance(tint, list):
+            tint = tuple(tint)
+        irange = tuple(self.stream._getDisplayIRange())
+        if model.hasVA(self.stream, "zIndex"):
+            zidx = self.stream.zIndex.value
+        else:
+            zidx = None
+        return tint, irange, zidx
+
+    @staticmethod
+    def _getSettingsKey(settings):
+        """
+        settings (tuple): projection settings, as returned by _getProjectionSettings()
+        return (tuple or None): the settings in a hashable form, used as part
+          of the key of the projected tiles in the cache. None if the settings
+          cannot be identified, in which case the tiles should not be cached.
+        """
+        tint, irange, zidx = settings
+        if img._isColormap(tint):
+            # The name is not necessarily unique, so also use the actual colours
+            tint = ("colormap", tint.name, tint(numpy.arange(tint.N), bytes=True).tobytes())
+        else:
+            try:
+                hash(tint)
+            except TypeError:
+                logging.debug("Cannot cache tiles projected with tint %s", tint)
+                return None
+        return tint, irange, zidx
+
+    def _getTile(self, x, y, z, settings):
+        """
+        Get a tile from a DataArrayShadow. Uses the (shared) tile cache.
         x (int): X coordinate of the tile
         y (int): Y coordinate of the tile
         z (int): zoom level where the tile is
-        prev_raw_cache (dictionary): raw tiles cache from the
-            last execution of _updateImage
-        prev_proj_cache (dictionary): projected tiles cache from the
-            last execution of _updateImage
+        settings (tuple): projection settings, as returned by _getProjectionSettings()
         return (DataArray, DataArray): raw tile and projected tile
         """
-        # the key of the tile on the cache
-        tile_key = "%d-%d-%d" % (x, y, z)
-
-        # if the raw tile has been already cached, read it from the cache
-        if tile_key in prev_raw_cache:
-            raw_tile = prev_raw_cache[tile_key]
-        elif tile_key in self._rawTilesCache:
-            raw_tile = self._rawTilesCache[tile_key]
-        else:
+        das = self.stream.raw[0]
+        sid = _tile_cache.get_source_id(das)
+        raw_key = ("raw", sid, x, y, z)
+        raw_tile = _tile_cache.get(raw_key)
+        if raw_tile is None:
             # The tile was not cached, so it must be read from the file
-            raw_tile = self.stream.raw[0].getTile(x, y, z)
+            raw_tile = das.getTile(x, y, z)
+            _tile_cache.put(raw_key, raw_tile)
+
+        settings_key = self._getSettingsKey(settings)
+        proj_key = ("rgb", sid, x, y, z, settings_key)
+        proj_tile = _tile_cache.get(proj_key)
+        if proj_tile is None:
+            # The tile was not cached (or with different settings), so it must be projected
+            proj_tile = self._projectTile(raw_tile, settings)
+            if settings_key is not None:
+                _tile_cache.put(proj_key, proj_tile)
 
-        # if the projected tile has been already cached, read it from the cache
-        if tile_key in prev_proj_cache:
-            proj_tile = prev_proj_cache[tile_key]
-        elif tile_key in self._projectedTilesCache:
-            proj_tile = self._projectedTilesCache[tile_key]
-        else:
-            # The tile was not cached, so it must be projected again
-            proj_tile = self._projectTile(raw_tile)
-
-        # cache raw and projected tiles
-        self._rawTilesCache[tile_key] = raw_tile
-        self._projectedTilesCache[tile_key] = proj_tile
         return raw_tile, proj_tile
 
-    def _projectTile(self, tile):
+    def _getTileCount(self, z):
+        """
+        Compute the number of tiles available at a given zoom level
+        z (int): zoom level
+        return (int, int): number of tiles along X and Y
+        """
+        das = self.stream.raw[0]
+        dims = das.metadata.get(model.MD_DIMS, "CTZYX"[-das.ndim::])
+        width = das.shape[dims.index('X')] // (2 ** z)
+        height = das.shape[dims.index('Y')] // (2 ** z)
+        return (int(math.ceil(width / das.tile_shape[0])),
+                int(math.ceil(height / das.tile_shape[1])))
+
+    def _rectToTiles(self, rect, z):
+        """
+        Convert a rect in pixel coordinates (at full resolution) into the tile indices
+        rect (tuple containing x1, y1, x2, y2): Rect on pixel coordinates
+        z (int): zoom level
+        return (tuple containing x1, y1, x2, y2): indices of the first and last tiles
+        """
+        das = self.stream.raw[0]
+        rect = [l / (2 ** z) for l in rect]
+        return tuple(int(math.floor(l / das.tile_shape[0])) for l in rect)
+
+    def _getPrefetchTiles(self, tile_rect, z):
+        """
+        Find the tiles which are likely to be displayed next, after the ones
+        currently displayed.
+        tile_rect (tuple containing x1, y1, x2, y2): indices of the tiles displayed
+        z (int): zoom level of the displayed tiles
+        return (list of (int, int, int)): x, y, z of each tile, in the order they
+          should be prefetched
+        """
+        tiles = []
+
+        # The ring of tiles just around the displayed ones, in case of panning
+        x1, y1, x2, y2 = tile_rect
+        nx, ny = self._getTileCount(z)
+        for x in range(max(0, x1 - 1), min(x2 + 1, nx - 1) + 1):
+            for y in range(max(0, y1 - 1), min(y2 + 1, ny - 1) + 1):
+                if not (x1 <= x <= x2 and y1 <= y <= y2):
+                    tiles.append((x, y, z))
+
+        # The tiles at the next zoom levels (in and out), in case of zooming
+        prect = self._rectWorldToPixel(self.rect.value)
+        for nz in (z - 1, z + 1):
+            if not 0 <= nz <= self.stream.raw[0].maxzoom:
+                continue
+            x1, y1, x2, y2 = self._rectToTiles(prect, nz)
+            nx, ny = self._getTileCount(nz)
+            for x in range(max(0, x1), min(x2, nx - 1) + 1):
+                for y in range(max(0, y1), min(y2, ny - 1) + 1):
+                    tiles.append((x, y, nz))
+
+        return tiles
+
+    def _schedulePrefetch(self, tile_rect, z, settings):
+        """
+        Start reading and projecting in the background the tiles around the
+        ones currently displayed. Any previous prefetching is stopped.
+        tile_rect (tuple containing x1, y1, x2, y2): indices of the tiles displayed
+        z (int): zoom level of the displayed tiles
+        settings (tuple): projection settings of the displayed tiles
+        """
+        self._prefetch_gen += 1
+        if not self.prefetch_tiles:
+            return
+        tiles = self._getPrefetchTiles(tile_rect, z)
+        if tiles:
+            _prefetch_executor.submit(self._prefetchTiles, tiles, self._prefetch_gen, settings)
+
+    def _prefetchTiles(self, tiles, gen, settings):
+        """
+        Put the given tiles in the cache, unless the view changes
+        tiles (list of (int, int, int)): x, y, z of each tile
+        gen (int): value of ._prefetch_gen when the prefetching was requested
+        settings (tuple): projection settings, as returned by _getProjectionSettings()
+        """
+        try:
+            for i, (x, y, z) in enumerate(tiles):
+                # Stop as soon as the view has changed, as these tiles might not be needed anymore
+                if gen != self._prefetch_gen or self._im_needs_recompute.is_set():
+                    logging.debug("Stopping prefetching of tiles, after %d/%d tiles", i, len(tiles))
+                    return
+                self._getTile(x, y, z, settings)
+        except Exception:
+            logging.exception("Failed to prefetch tiles of %s", self.stream.name.value)
+
+    def _projectTile(self, tile, settings=None):
         """
         Project the tile
         tile (DataArray): Raw tile
+        settings (None or tuple): projection settings, as returned by
+          _getProjectionSettings(). If None, the current settings are used.
         return (DataArray): Projected tile
         """
+        if settings is None:
+            settings = self._getProjectionSettings()
+        tint, irange, zidx = settings
         dims = tile.metadata.get(model.MD_DIMS, "CTZYX"[-tile.ndim::])
         ci = dims.find("C")  # -1 if not found
-        # handle the tint
-        tint = self.stream.tint.value
 
         if dims in ("CYX", "YXC") and tile.shape[ci] in (3, 4):  # is RGB?
             # Take the RGB data as-is, just needs to make sure it's in the right order
@@ -1054,17 +1371,49 @@ class RGBSpatialProjection(RGBProjection):
             tile.metadata = self.stream._find_metadata(tile.metadata)
             tile.metadata[model.MD_DIMS] = "YXC"  # RGB format
             return tile
-        elif dims in ("ZYX",) and model.hasVA(self.stream, "zIndex"):
-            tile = img.getYXFromZYX(tile, self.stream.zIndex.value)
+        elif dims in ("ZYX",) and zidx is not None:
+            tile = img.getYXFromZYX(tile, zidx)
             tile.metadata[model.MD_DIMS] = "ZYX"
         else:
             tile = img.ensure2DImage(tile)
 
-        return self._projectXY2RGB(tile, tint)
+        return self._projectXY2RGB(tile, tint, irange)
+
+    @staticmethod
+    def _getTileRings(tile_rect):
+        """
+        Group the tiles of an area by their distance to the center of the area.
+        tile_rect (tuple containing x1, y1, x2, y2): indices of the first and last tiles
+        return (list of list of (int, int)): x, y of each tile, grouped by ring
+          around the center, from the center outwards. The tiles within all the
+          first N rings always form a rectangle.
+        """
+        x1, y1, x2, y2 = tile_rect
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        rings = {}
+        for x in range(x1, x2 + 1):
+            for y in range(y1, y2 + 1):
+                d = int(max(abs(x - cx), abs(y - cy)))
+                rings.setdefault(d, []).append((x, y))
+        return [rings[d] for d in sorted(rings)]
+
+    def _getTileIfNeeded(self, x, y, z, settings):
+        """
+        Same as _getTile(), but doesn't do anything if the area to display has
+        changed in the meantime (as the tile is likely not needed anymore).
+        return (DataArray, DataArray) or None: raw tile and projected tile
+        """
+        if self._im_needs_recompute.is_set():
+            return None
+        return self._getTile(x, y, z, settings)
 
-    def _getTilesFromSelectedArea(self):
+    def _getTilesFromSelectedArea(self, partial_cb=None):
         """
         Get the tiles inside the region defined by .rect and .mpp
+        The tiles are read and projected in parallel, starting from the center.
+        partial_cb (None or callable): called with the raw and projected tiles
+          (2D tuples of DataArrays) every time a larger rectangle around the
+          center is ready, before all the tiles are available.
         return (DataArray, DataArray): Raw tiles and projected tiles
         """
 
@@ -1073,65 +1422,81 @@ class RGBSpatialProjection(RGBProjection):
         class NeedRecomputeException(Exception):
             pass
 
-        das = self.stream.raw[0]
-
-        # store the previous cache to use in this execution
-        prev_raw_cache = self._rawTilesCache
-        prev_proj_cache = self._projectedTilesCache
         # Execute at least once. If mpp and rect changed in
         # the last execution of the loops, execute again
         need_recompute = True
         while need_recompute:
             z = self._zFromMpp()
             rect = self._rectWorldToPixel(self.rect.value)
+            # Read the settings only once, and share them with all the workers
+            settings = self._getProjectionSettings()
             # convert the rect coords to tile indexes
-            rect = [l / (2 ** z) for l in rect]
-            rect = [int(math.floor(l / das.tile_shape[0])) for l in rect]
-            x1, y1, x2, y2 = rect
-            # the 4 lines below avoids that lots of old tiles
-            # stays in instance caches
-            prev_raw_cache.update(self._rawTilesCache)
-            prev_proj_cache.update(self._projectedTilesCache)
-            # empty current caches
-            self._rawTilesCache = {}
-            self._projectedTilesCache = {}
-
-            raw_tiles = []
-            projected_tiles = []
+            tile_rect = self._rectToTiles(rect, z)
+            rings = self._getTileRings(tile_rect)
+            tiles_todo = collections.deque(t for r in rings for t in r)
+
+            tiles = {}  # (x, y) -> (raw tile, projected tile)
+            tfutures = {}  # (x, y) -> Future
             need_recompute = False
             try:
-                for x in range(x1, x2 + 1):
-                    rt_column = []
-                    pt_column = []
-
-                    for y in range(y1, y2 + 1):
-                        # the projected tiles cache is invalid
-                        if self._projectedTilesInvalid:
-                            self._projectedTilesCache = {}
-                            prev_proj_cache = {}
-                            self._projectedTilesInvalid = False
-                            raise NeedRecomputeException()
-
-                        # check if the image changed in the middle of the process
-                        if self._im_needs_recompute.is_set():
-                            self._im_needs_recompute.clear()
-                            # Raise the exception, so everything will be calculated again,
-                            # but using the cache from the last execution
-                            raise NeedRecomputeException()
-
-                        raw_tile, proj_tile = \
-                            self._getTile(x, y, z, prev_raw_cache, prev_proj_cache)
-                        rt_column.append(raw_tile)
-                        pt_column.append(proj_tile)
-
-                    raw_tiles.append(tuple(rt_column))
-                    projected_tiles.append(tuple(pt_column))
-
+                for i, ring in enumerate(rings):
+                    for t in ring:
+                        while t not in tiles:
+                            # check if the image changed in the middle of the process
+                            if self._im_needs_recompute.is_set():
+                                self._im_needs_recompute.clear()
+                                # Raise the exception, so everything will be calculated again,
+                                # but using the tiles already cached
+                                raise NeedRecomputeException()
+
+                            # Only schedule a few tiles in advance, to be able
+                            # to stop quickly if the area changes. Until the
+                            # first tile is ready, only one tile is read, so that
+                            # if the area changes immediately, at most one tile
+                            # was read for nothing.
+                            max_scheduled = TILE_PROJECTION_WORKERS if tiles else 1
+                            while tiles_todo and len(tfutures) < max_scheduled:
+                                nt = tiles_todo.popleft()
+                                tfutures[nt] = _projection_executor.submit(self._getTileIfNeeded,
+                                                                           nt[0], nt[1], z, settings)
+
+                            f = tfutures[t]
+                            try:
+                                ret = f.result(timeout=0.05)
+                            except futures.TimeoutError:
+                                continue
+                            del tfutures[t]
+                            if ret is None:  # Not computed as the area changed
+                                tiles_todo.appendleft(t)
+                                continue
+                            tiles[t] = ret
+
+                    if partial_cb and i < len(rings) - 1:
+                        partial_cb(*self._tilesToGrid(tiles))
             except NeedRecomputeException:
                 # image changed
                 need_recompute = True
+            finally:
+                for f in tfutures.values():
+                    f.cancel()
 
-        return tuple(raw_tiles), tuple(projected_tiles)
+        self._schedulePrefetch(tile_rect, z, settings)
+        return self._tilesToGrid(tiles)
+
+    @staticmethod
+    def _tilesToGrid(tiles):
+        """
+        Convert the tiles into 2D tuples.
+        tiles (dict (int, int) -> (DataArray, DataArray)): x, y -> raw and projected
+          tiles. The tiles must cover a rectangle.
+        return (tuple of tuple of DataArray, tuple of tuple of DataArray): raw
+          tiles and projected tiles, with the first dimension being X.
+        """
+        xs = sorted(set(x for x, y in tiles))
+        ys = sorted(set(y for x, y in tiles))
+        raw_tiles = tuple(tuple(tiles[(x, y)][0] for y in ys) for x in xs)
+        projected_tiles = tuple(tuple(tiles[(x, y)][1] for y in ys) for x in xs)
+        return raw_tiles, projected_tiles
 
     def _updateImage(self):
         """ Recomputes the image with all the raw data available
@@ -1144,7 +1509,7 @@ class RGBSpatialProjection(RGBProjection):
         try:
             if isinstance(raw[0], model.DataArrayShadow):
                 # DataArrayShadow => need to get each tile individually
-                self._raw, projected_tiles = self._getTilesFromSelectedArea()
+                self._raw, projected_tiles = self._getTilesFromSelectedArea(self._onPartialTiles)
                 self.image.value = projected_tiles
             else:
                 self.image.value = self._projectTile(raw[0])
@@ -1152,6 +1517,16 @@ class RGBSpatialProjection(RGBProjection):
         except Exception:
             logging.exception("Updating %s %s image", self.__class__.__name__, self.stream.name.value)
 
+    def _onPartialTiles(self, raw_tiles, projected_tiles):
+        """
+        Called when part of the tiles are ready, to already show them
+        raw_tiles (tuple of tuple of DataArray): the raw tiles available
+        projected_tiles (tuple of tuple of DataArray): the corresponding projected tiles
+        """
+        # Update the raw data first, so that it always matches the image
+        self._raw = raw_tiles
+        self.image.value = projected_tiles
+
     def projectAsRaw(self):
         """ Project a raw image without converting to RGB
 
@@ -1342,6 +1717,65 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
             logging.exception("Updating %s %s image", self.__class__.__name__, self.stream.name.value)
 
 
+def _meanAlongLine(data, start, end, n, width):
+    """
+    Interpolate (bilinearly) the data along a line, and average it over the
+    width of the line.
+    The data is read one line parallel to the main line at a time, so the
+    temporary memory is only proportional to the size of the output.
+    data (ndarray of shape CYX): the data
+    start, end ((float, float)): X/Y position of the first and last point of
+      the line (in px)
+    n (1<int): number of points along the line
+    width (0<int): number of points across the line, separated by 1 px
+    return (ndarray of float64 of shape nC): for each point of the line, the
+      mean of all the points of the width which are inside the data. If none is
+      inside the data, the value is 0.
+    """
+    h, w = data.shape[-2:]
+    v = (end[0] - start[0], end[1] - start[1])
+    l = math.hypot(*v)
+    pv = (-v[1] / l, v[0] / l)  # perpendicular unit vector
+    spread = (width - 1) / 2
+    # If the data has a width (or height) of 1 px (ie, it's just a line), the
+    # points are considered inside the data if they are within the pixel (ie,
+    # less than 0.5 px away from its center). Otherwise, with an even width,
+    # none of the points would be inside the data.
+    xmin, xmax = (-0.5, 0.5) if w == 1 else (0, w - 1)
+    ymin, ymax = (-0.5, 0.5) if h == 1 else (0, h - 1)
+
+    line_xs = numpy.linspace(start[0], end[0], n)
+    line_ys = numpy.linspace(start[1], end[1], n)
+    datasum = numpy.zeros((data.shape[0], n), dtype=numpy.float64)
+    count = numpy.zeros(n, dtype=numpy.int64)  # number of points inside the data
+    for o in numpy.linspace(-spread, spread, width):
+        xs = line_xs + pv[0] * o
+        ys = line_ys + pv[1] * o
+        inside = numpy.flatnonzero((xmin <= xs) & (xs <= xmax) & (ymin <= ys) & (ys <= ymax))
+        if not inside.size:
+            continue
+        # Only changes the points on a 1 px axis
+        xs = numpy.clip(xs[inside], 0, w - 1)
+        ys = numpy.clip(ys[inside], 0, h - 1)
+        x0 = numpy.floor(xs).astype(numpy.intp)
+        y0 = numpy.floor(ys).astype(numpy.intp)
+        fx = xs - x0
+        fy = ys - y0
+        # On the last row/column, the weight of the next one is 0
+        x1 = numpy.minimum(x0 + 1, w - 1)
+        y1 = numpy.minimum(y0 + 1, h - 1)
+
+        datasum[:, inside] += (data[:, y0, x0] * ((1 - fy) * (1 - fx)) +
+                               data[:, y0, x1] * ((1 - fy) * fx) +
+                               data[:, y1, x0] * (fy * (1 - fx)) +
+                               data[:, y1, x1] * (fy * fx))
+        count[inside] += 1
+
+    valid = count > 0
+    datasum[:, valid] /= count[valid]
+    return datasum.T
+
+
 class LineSpectrumProjection(RGBProjection):
     """
     Project a spectrum from the selected_line of the stream.
@@ -1402,41 +1836,12 @@ class LineSpectrumProjection(RGBProjection):
         if l < 1:  # a line of just one pixel is considered not valid
             return None
 
-        # FIXME: if the data has a width of 1 (ie, just a line), and the
-        # requested width is an even number, the output is empty (because all
-        # the interpolated points are outside of the data.
-
-        # Coordinates of each point: ndim of data (5-2), pos on line (Y), spectrum (X)
-        # The line is scanned from the end till the start so that the spectra
-        # closest to the origin of the line are at the bottom.
-        coord = numpy.empty((3, width, n, spec2d.shape[0]))
-        coord[0] = numpy.arange(spec2d.shape[0])  # spectra = all
-        coord_spc = coord.swapaxes(2, 3)  # just a view to have (line) space as last dim
-        coord_spc[-1] = numpy.linspace(start[0], end[0], n)  # X axis
-        coord_spc[-2] = numpy.linspace(start[1], end[1], n)  # Y axis
-
-        # Spread over the width
-        # perpendicular unit vector
-        pv = (-v[1] / l, v[0] / l)
-        width_coord = numpy.empty((2, width))
-        spread = (width - 1) / 2
-        width_coord[-1] = numpy.linspace(pv[0] * -spread, pv[0] * spread, width)  # X axis
-        width_coord[-2] = numpy.linspace(pv[1] * -spread, pv[1] * spread, width)  # Y axis
-
-        coord_cw = coord[1:].swapaxes(0, 2).swapaxes(1, 3)  # view with coordinates and width as last dims
-        coord_cw += width_coord
-
-        # Interpolate the values based on the data
-        if width == 1:
-            # simple version for the most usual case
-            spec1d = ndimage.map_coordinates(spec2d, coord[:, 0, :, :], order=1)
-        else:
-            # FIXME: the mean should be dependent on how many pixels inside the
-            # original data were pick on each line. Currently if some pixels fall
-            # out of the original data, the outside pixels count as 0.
-            # force the intermediate values to float, as mean() still needs to run
-            spec1d_w = ndimage.map_coordinates(spec2d, coord, output=numpy.float, order=1)
-            spec1d = spec1d_w.mean(axis=0)
+        # The line is scanned from the start to the end. Only the points
+        # inside the data are taken into account in the mean over the width.
+        spec1d = _meanAlongLine(spec2d, start, end, n, width)
+        if width == 1 and spec2d.dtype.kind in "iu":
+            # Just one point, so keep the original type
+            spec1d = numpy.round(spec1d).astype(spec2d.dtype)
         assert spec1d.shape == (n, spec2d.shape[0])
 
         # Use metadata to indicate spatial distance between pixel
@@ -1558,24 +1963,7 @@ class PixelTemporalSpectrumProjection(RGBProjection):
             data = numpy.swapaxes(data, 0, 1)
             return model.DataArray(data, md)
 
-        # There are various ways to do it with numpy. As typically the spectrum
-        # dimension is big, and the number of pixels to sum is small, it seems
-        # the easiest way is to just do some kind of "clever" mean. Using a
-        # masked array would also work, but that'd imply having a huge mask.
-        radius = width / 2
-        n = 0
-        # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros((spec2d.shape[0], spec2d.shape[1]), dtype=numpy.float64)
-        # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, spec2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, spec2d.shape[-2])):
-                if math.hypot(x - px, y - py) <= radius:
-                    n += 1
-                    datasum += spec2d[:, :, py, px]
-
-        mean = datasum / n
+        mean = _meanInDisk(spec2d, x, y, width)
         mean = numpy.swapaxes(mean, 0, 1)
         return model.DataArray(mean.astype(spec2d.dtype), md)
 
@@ -1692,25 +2080,7 @@ class SinglePointSpectrumProjection(DataProjection):
             data = spec2d[:, y, x]
             return model.DataArray(data, md)
 
-        # There are various ways to do it with numpy. As typically the spectrum
-        # dimension is big, and the number of pixels to sum is small, it seems
-        # the easiest way is to just do some kind of "clever" mean. Using a
-        # masked array would also work, but that'd imply having a huge mask.
-        radius = width / 2
-        n = 0
-        # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros(spec2d.shape[0], dtype=numpy.float64)
-        # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, spec2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, spec2d.shape[-2])):
-                if math.hypot(x - px, y - py) <= radius:
-                    n += 1
-                    datasum += spec2d[:, py, px]
-
-        mean = datasum / n
-
+        mean = _meanInDisk(spec2d, x, y, width)
         return model.DataArray(mean, md)
 
     def projectAsRaw(self):
@@ -1779,24 +2149,7 @@ class SinglePointTemporalProjection(DataProjection):
             data = chrono2d[:, y, x]
             return model.DataArray(data, md)
 
-        # There are various ways to do it with numpy. As typically the spectrum
-        # dimension is big, and the number of pixels to sum is small, it seems
-        # the easiest way is to just do some kind of "clever" mean. Using a
-        # masked array would also work, but that'd imply having a huge mask.
-        radius = width / 2
-        n = 0
-        # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros(chrono2d.shape[0], dtype=numpy.float64)
-        # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, chrono2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, chrono2d.shape[-2])):
-                if math.hypot(x - px, y - py) <= radius:
-                    n += 1
-                    datasum += chrono2d[:, py, px]
-
-        mean = datasum / n
+        mean = _meanInDisk(chrono2d, x, y, width)
         return model.DataArray(mean.astype(chrono2d.dtype), md)
 
     def projectAsRaw(self):
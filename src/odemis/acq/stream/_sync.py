@@ -44,6 +44,7 @@ from odemis.model import MD_POS, MD_DESCRIPTION, MD_PIXEL_SIZE, MD_ACQ_DATE, MD_
 from odemis.model import hasVA
 from odemis.util import units, executeAsyncTask, almost_equal, img
 import queue
+import tempfile
 import threading
 import time
 
@@ -72,6 +73,20 @@ import weakref
 # with a scanner/emitter.
 EBEAM_DETECTORS = ("se-detector", "bs-detector", "cl-detector", "monochromator",
                    "ebic-detector")
+# The arrays storing the acquired data which are bigger than this size are kept
+# in a temporary file (memory mapped) instead of the memory, so that big
+# acquisitions are limited by the disk space, not the RAM.
+MEMMAP_MIN_SIZE = 512 * 2 ** 20  # B
+# Directory where these temporary files are created. If None, the default
+# temporary directory is used. Note that it shouldn't be on a tmpfs, as it is
+# kept in memory.
+MEMMAP_DIR = None
+# Maximum size of the temporary arrays used to average the data of several passes
+MEAN_CHUNK_SIZE = 64 * 2 ** 20  # B
+# During a vector scan, the e-beam stays on each position a bit longer than the
+# expected CCD frame duration, to be certain that the CCD is ready to receive
+# the trigger of the next position.
+VECTOR_SCAN_DWELL_MARGIN = 1.1  # ratio
 GUI_BLUE = (47, 167, 212) # FG_COLOUR_EDIT - from src/odemis/gui/__init__.py
 GUI_ORANGE = (255, 163, 0) # FG_COLOUR_HIGHLIGHT - from src/odemis/gui/__init__.py
 
@@ -553,17 +568,23 @@ class MultipleDetectorStream(with_metaclass(ABCMeta, Stream)):
         # average it (to reduce noise) or at least in case of fuzzing, store and
         # average the N expected images
         if not self._acq_complete[n].is_set():
-            # Update metadata based on user settings
-            s = self._streams[n]
-            if hasattr(s, "tint"):
-                try:
-                    data.metadata[model.MD_USER_TINT] = img.tint_to_md_format(s.tint.value)
-                except ValueError as ex:
-                    logging.warning("Failed to store user tint for stream %s: %s", s.name.value, ex)
-
+            self._addUserTint(n, data)
             self._acq_data[n].append(data)  # append image acquired from detector to list
             self._acq_complete[n].set()  # indicate the data has been received
 
+    def _addUserTint(self, n, data):
+        """
+        Update the metadata of the data based on the user settings of the stream.
+        :param n (0<=int): the detector/stream index
+        :param data (DataArray): data received from the detector. Its metadata is updated.
+        """
+        s = self._streams[n]
+        if hasattr(s, "tint"):
+            try:
+                data.metadata[model.MD_USER_TINT] = img.tint_to_md_format(s.tint.value)
+            except ValueError as ex:
+                logging.warning("Failed to store user tint for stream %s: %s", s.name.value, ex)
+
     def _preprocessData(self, n, data, i):
         """
         Preprocess the raw data, just after it was received from the detector.
@@ -831,7 +852,7 @@ class MultipleDetectorStream(with_metaclass(ABCMeta, Stream)):
             md.update({MD_POS: center,
                        MD_PIXEL_SIZE: pxs,
                        MD_DESCRIPTION: self._streams[n].name.value})
-            da = model.DataArray(numpy.zeros(shape=rep[::-1] * numpy.array(tile_shape), dtype=raw_data.dtype), md)
+            da = self._createLiveArray(tuple(rep[::-1] * numpy.array(tile_shape)), raw_data.dtype, md)
             self._live_data[n].append(da)
             self._acq_mask = numpy.zeros(shape=rep[::-1] * numpy.array(tile_shape), dtype=numpy.bool)
 
@@ -868,7 +889,7 @@ class MultipleDetectorStream(with_metaclass(ABCMeta, Stream)):
             md.update({MD_POS: center,
                        MD_PIXEL_SIZE: pxs,
                        MD_DESCRIPTION: self._streams[n].name.value})
-            da = model.DataArray(numpy.zeros(shape=rep[::-1], dtype=raw_data.dtype), md)
+            da = self._createLiveArray(rep[::-1], raw_data.dtype, md)
             self._live_data[n].append(da)
             self._acq_mask = numpy.zeros(rep[::-1], dtype=numpy.bool)
 
@@ -878,6 +899,30 @@ class MultipleDetectorStream(with_metaclass(ABCMeta, Stream)):
                            px_idx[0]: px_idx[0] + tile_shape[0],
                            px_idx[1]: px_idx[1] + tile_shape[1]] = raw_data
 
+    def _createLiveArray(self, shape, dtype, md):
+        """
+        Allocates an array to store the data of a stream during the acquisition.
+        Big arrays are backed by a temporary file instead of the memory (see
+        MEMMAP_MIN_SIZE). The file is automatically deleted when the array is
+        not used anymore.
+        :param shape: (tuple of int) shape of the array
+        :param dtype: (numpy.dtype) type of the data
+        :param md: (dict) metadata of the array
+        :returns: (DataArray) array filled with zeros
+        """
+        dtype = numpy.dtype(dtype)
+        nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        if nbytes < MEMMAP_MIN_SIZE:
+            return model.DataArray(numpy.zeros(shape, dtype=dtype), md)
+
+        logging.debug("Storing acquisition data of shape %s (%d MB) on disk",
+                      shape, nbytes // 2 ** 20)
+        # The file is deleted as soon as it's closed, but the memory map keeps
+        # its own reference to it, until it's not used anymore.
+        with tempfile.TemporaryFile(prefix="odemis-acq-", dir=MEMMAP_DIR) as f:
+            data = numpy.memmap(f, dtype=dtype, mode="w+", shape=tuple(shape))
+        return model.DataArray(data, md)
+
     def _assembleFinalData(self, n, data):
         """
         Update ._raw by assembling the data acquired.
@@ -898,11 +943,31 @@ class MultipleDetectorStream(with_metaclass(ABCMeta, Stream)):
                 md[model.MD_EXP_TIME] *= len(data)
             md[model.MD_INTEGRATION_COUNT] = md.get(model.MD_INTEGRATION_COUNT, 1) * len(data)
 
-            self._raw.append(model.DataArray(
-                                 numpy.mean(data, axis=0).astype(data[0].dtype), md))
+            self._raw.append(self._meanPasses(data, md))
         else:  # No data at all
             logging.warning("No final data for stream %s/%d", self.name.value, n)
 
+    def _meanPasses(self, data, md):
+        """
+        Average the data of several passes, without holding the whole result
+        in memory: it's computed in chunks, and stored in an array from
+        _createLiveArray() (ie, on disk if big).
+        :param data: (list of DataArrays of the same shape) the data of each pass
+        :param md: (dict) metadata of the result
+        :returns: (DataArray) the average, of the same type as the data
+        """
+        shape, dtype = data[0].shape, data[0].dtype
+        res = self._createLiveArray(shape, dtype, md)
+        row_size = int(numpy.prod(shape[1:])) * numpy.dtype(numpy.float64).itemsize
+        nrows = max(1, MEAN_CHUNK_SIZE // max(1, row_size))
+        for i in range(0, shape[0], nrows):
+            acc = numpy.zeros((min(nrows, shape[0] - i),) + shape[1:], dtype=numpy.float64)
+            for d in data:
+                acc += d[i:i + nrows]
+            acc /= len(data)
+            res[i:i + nrows] = acc.astype(dtype)
+        return res
+
     def _projectXY2RGB(self, data, tint=(255, 255, 255)):
         """
         Projects a 2D spatial DataArray into a RGB representation.
@@ -969,6 +1034,9 @@ class SEMCCDMDStream(MultipleDetectorStream):
     moving the SEM spot and starts a new CCD acquisition at each spot. It brings
     a bit more overhead than linking directly the event of the SEM to the CCD
     detector trigger, but it's very reliable.
+    If the e-beam scanner supports vector scanning (ie, it has a .scanPath VA and
+    a .newPosition Event), all the spot positions are instead passed at once to
+    the scanner, which triggers the CCD at each position.
     If the "integration time" requested is longer than the maximum exposure time of the detector,
     image integration will be performed.
     """
@@ -1009,6 +1077,14 @@ class SEMCCDMDStream(MultipleDetectorStream):
         self._trigger = self._ccd.softwareTrigger
         self._ccd_idx = len(self._streams) - 1  # optical detector is always last in streams
 
+        # For the vector scan: all the data received during the scan, for each stream
+        self._vector_data = [[] for _ in self._streams]
+        self._vector_expected = 0  # number of data expected per stream
+        self._vector_received = threading.Event()  # set every time a data is received
+        self._vector_subscribers = []  # to keep a ref
+        for i, s in enumerate(self._streams):
+            self._vector_subscribers.append(partial(self._onVectorData, i))
+
     def _estimateRawAcquisitionTime(self):
         """
         :returns (float): Time in s for acquiring the whole image, without drift correction.
@@ -1030,7 +1106,11 @@ class SEMCCDMDStream(MultipleDetectorStream):
             else:
                 exp = self._sccd._getDetectorVA("exposureTime").value
 
-            dur_image = (exp + readout + 0.03) * 1.20
+            if self._canVectorScan(exp + readout):
+                # No software overhead, just the time the e-beam stays on each position
+                dur_image = (exp + readout) * VECTOR_SCAN_DWELL_MARGIN
+            else:
+                dur_image = (exp + readout + 0.03) * 1.20
             duration = numpy.prod(self.repetition.value) * dur_image
             # Add the setup time
             duration += self.SETUP_OVERHEAD
@@ -1123,6 +1203,26 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
         return exp + readout, integration_count
 
+    def _canVectorScan(self, img_time):
+        """
+        :param img_time (0<float): Expected time spent for one CCD image.
+        :returns (bool): True if the acquisition can be done by passing all the
+          spot positions at once to the e-beam scanner, which then triggers the
+          CCD at each position.
+        """
+        if hasattr(self, "fuzzing") and self.fuzzing.value:
+            # Each position would be scanned (much) shorter than the CCD frame
+            return False
+        if not (model.hasVA(self._emitter, "scanPath") and hasattr(self._emitter, "newPosition")):
+            return False
+        # The e-beam must stay on each position until the CCD is done, otherwise
+        # the images would not correspond to the positions.
+        if img_time * VECTOR_SCAN_DWELL_MARGIN > self._emitter.dwellTime.range[1]:
+            logging.debug("Cannot use vector scan as CCD frame (%g s) is longer than the maximum dwell time",
+                          img_time)
+            return False
+        return True
+
     def _onCompletedData(self, n, raw_das):
         """
         Called at the end of an entire acquisition. It should assemble the data
@@ -1157,17 +1257,23 @@ class SEMCCDMDStream(MultipleDetectorStream):
         """
         Acquires images from the multiple detectors via software synchronisation.
         Acquires images via moving the ebeam.
-        Warning: can be quite memory consuming if the grid is big
+        Note: if the grid is big, the data is stored on disk (see MEMMAP_MIN_SIZE)
         :param future: Current future running for the whole acquisition.
         :returns (list of DataArray): All the data acquired.
         :raises:
           CancelledError() if cancelled
           Exceptions if error
         """
-        # TODO: handle better very large grid acquisition (than memory oops)
+        # The dwell time is adjusted for the acquisition, so restore it afterwards
+        orig_dwell_time = self._emitter.dwellTime.value
         try:
             self._acq_done.clear()
             img_time, integration_count = self._adjustHardwareSettings()
+            vector_scan = self._canVectorScan(img_time)
+            if vector_scan:
+                # The scanner triggers the CCD, so it must not move to the next
+                # position before the CCD is done with the current one.
+                self._emitter.dwellTime.value = self._emitter.dwellTime.clip(img_time * VECTOR_SCAN_DWELL_MARGIN)
             dwell_time = self._emitter.dwellTime.value * integration_count  # total time of ebeam spent on one pos/pixel
             sem_time = dwell_time * numpy.prod(self._emitter.resolution.value)
             spot_pos = self._getSpotPositions()  # list of center positions for each point of the ROI
@@ -1216,10 +1322,20 @@ class SEMCCDMDStream(MultipleDetectorStream):
             # retrigger, or unsynchronise/resynchronise just before the end of
             # last scan).
 
+            # When the scanner supports vector scan, the software round-trips for
+            # each spot are avoided by sending all the positions at once to the
+            # scanner, and the CCD is triggered by the .newPosition Event (see
+            # _acquireVectorScan()). The CCD data and the e-beam data are
+            # matched by their order of arrival.
+
             # prepare detector
-            self._ccd_df.synchronizedOn(self._trigger)
-            # subscribe to last entry in _subscribers (optical detector)
-            self._ccd_df.subscribe(self._subscribers[self._ccd_idx])
+            if vector_scan:
+                # The CCD is only subscribed during each vector scan
+                self._ccd_df.synchronizedOn(self._emitter.newPosition)
+            else:
+                self._ccd_df.synchronizedOn(self._trigger)
+                # subscribe to last entry in _subscribers (optical detector)
+                self._ccd_df.subscribe(self._subscribers[self._ccd_idx])
 
             # Instead of subscribing/unsubscribing to the SEM for each pixel,
             # we've tried to keep subscribed, but request to be unsynchronised/
@@ -1268,6 +1384,12 @@ class SEMCCDMDStream(MultipleDetectorStream):
                     f.result()
                     time_move_pol_left -= time_move_pol_once
 
+                if vector_scan:
+                    n = self._acquireVectorScan(n, pol_idx, spot_pos, img_time, integration_count, sub_pxs,
+                                                tot_num, leech_nimg, leech_time_pimg, time_move_pol_left,
+                                                future)
+                    continue
+
                 # iterate over pixel positions for scanning.
                 for px_idx in numpy.ndindex(*rep[::-1]):  # last dim (X) iterates first
                     trans = tuple(spot_pos[px_idx])  # spot position
@@ -1310,29 +1432,12 @@ class SEMCCDMDStream(MultipleDetectorStream):
                     for i in range(integration_count):
                         self._acquireImage(n, px_idx, img_time, sem_time, sub_pxs,
                                            tot_num, leech_nimg, extra_time, future)
-                        # Live update the setting stream with the new data
-                        try:
-                            self._sccd._onNewData(self._ccd_df, self._acq_data[self._ccd_idx][-1])
-                        except Exception:
-                            logging.exception("Failed to update CCD live view")
-                        # integrate the acquired images one after another
-                        for stream_idx, das in enumerate(self._acq_data):
-                            if self._img_intor[stream_idx] is None:
-                                self._img_intor[stream_idx] = img.ImageIntegrator(integration_count)
-                            self._acq_data[stream_idx] = [self._img_intor[stream_idx].append(das[-1])]
-
+                        self._integrateImage(integration_count)
                         n += 1  # number of images acquired so far
 
-                    for i, das in enumerate(self._acq_data):
-                        self._assembleLiveData(i, das[-1], px_idx, rep, pol_idx)
-
-                    # Activate _updateImage thread
-                    self._shouldUpdateImage()
+                    self._completePixel(px_idx, rep, pol_idx)
                     logging.debug("Done acquiring image number %s out of %s.", n, tot_num)
 
-                    self._img_intor = [None for _ in self._streams]
-                    self._acq_data = [[] for _ in self._streams]  # delete acq_data to use less RAM
-
             # acquisition done!
             for s, sub in zip(self._streams, self._subscribers):
                 s._dataflow.unsubscribe(sub)
@@ -1374,6 +1479,10 @@ class SEMCCDMDStream(MultipleDetectorStream):
             self._current_scan_area = None  # Indicate we are done for the live (also in case of error)
             for s in self._streams:
                 s._unlinkHwVAs()
+            try:
+                self._emitter.dwellTime.value = orig_dwell_time
+            except Exception:
+                logging.exception("Failed to restore the e-beam dwell time")
             self._dc_estimator = None
             self._current_future = None
             self._acq_data = [[] for _ in self._streams]  # regain a bit of memory
@@ -1385,6 +1494,210 @@ class SEMCCDMDStream(MultipleDetectorStream):
             self._streams[0].image.value = None
             self._img_intor = [None for _ in self._streams]
 
+    def _integrateImage(self, integration_count):
+        """
+        Live update the CCD settings stream with the last acquired image, and
+        integrate the last image of each stream with the previous ones acquired
+        at the same position.
+        :param integration_count (0<int): Number of images to integrate per position.
+        """
+        # Live update the setting stream with the new data
+        try:
+            self._sccd._onNewData(self._ccd_df, self._acq_data[self._ccd_idx][-1])
+        except Exception:
+            logging.exception("Failed to update CCD live view")
+        # integrate the acquired images one after another
+        for stream_idx, das in enumerate(self._acq_data):
+            if self._img_intor[stream_idx] is None:
+                self._img_intor[stream_idx] = img.ImageIntegrator(integration_count)
+            self._acq_data[stream_idx] = [self._img_intor[stream_idx].append(das[-1])]
+
+    def _completePixel(self, px_idx, rep, pol_idx):
+        """
+        Store the (integrated) data of each stream once all the images of an
+        e-beam position have been acquired.
+        :param px_idx (int, int): Current scanning position of ebeam (Y, X).
+        :param rep (int, int): Repetition (X, Y).
+        :param pol_idx (int): Index of the polarization position.
+        """
+        for i, das in enumerate(self._acq_data):
+            self._assembleLiveData(i, das[-1], px_idx, rep, pol_idx)
+
+        # Activate _updateImage thread
+        self._shouldUpdateImage()
+
+        self._img_intor = [None for _ in self._streams]
+        self._acq_data = [[] for _ in self._streams]  # delete acq_data to use less RAM
+
+    def _onVectorData(self, n, df, data):
+        """
+        Callback function, for each stream n, during a vector scan. Contrarily
+        to _onData(), all the data is kept, as each one corresponds to a different
+        position of the scan path.
+        :param n (0<=int): the detector/stream index
+        :param df (DataFlow): detector's dataflow
+        :param data (DataArray): image received from the detector
+        """
+        if len(self._vector_data[n]) >= self._vector_expected:
+            # The scanner might have started the path again before being stopped
+            logging.debug("Dropping extra data from stream %d", n)
+            return
+
+        self._addUserTint(n, data)
+        self._vector_data[n].append(data)
+        self._vector_received.set()
+
+    def _acquireVectorScan(self, n, pol_idx, spot_pos, img_time, integration_count, sub_pxs,
+                           tot_num, leech_nimg, leech_time_pimg, extra_time_pol, future):
+        """
+        Acquires all the e-beam positions of the repetition by passing them at
+        once to the scanner (vector scan). The scanner triggers the CCD at each
+        position, so there is no software round-trip per position. The positions
+        are scanned in blocks, so that the leeches can run in-between.
+        :param n (int): Number of images acquired so far.
+        :param pol_idx (int): Index of the polarization position.
+        :param spot_pos (ndarray of shape Y, X, 2): Center of each e-beam spot (in px).
+        :param img_time (0<float): Expected time spend for one image.
+        :param integration_count (0<int): Number of images to integrate per position.
+        :param sub_pxs (float, float): Sub-pixel size.
+        :param tot_num (int): Total number of images.
+        :param leech_nimg (list of 0<int or None): For each leech, number of images before the leech should be
+                executed again. It's automatically updated inside the list. (nimg = next image).
+        :param leech_time_pimg (float): Extra time needed on average for a single image for all leeches.
+        :param extra_time_pol (float): Extra time needed for moving the polarizer HW.
+        :param future: Current future running for the whole acquisition.
+        :returns (int): Number of images acquired so far, including this scan.
+        """
+        rep = self.repetition.value
+        trans_rng = self._emitter.translation.range
+        px_idxs = list(numpy.ndindex(*rep[::-1]))  # last dim (X) iterates first
+
+        i = 0  # index of the next position to acquire
+        while i < len(px_idxs):
+            # Scan all the positions until the next leech has to run
+            nimgs = [ni for ni in leech_nimg if ni is not None]
+            if nimgs:
+                npos = max(1, min(nimgs) // integration_count)
+            else:
+                npos = len(px_idxs)
+            block = px_idxs[i:i + npos]
+
+            # take care of drift
+            trans = numpy.array([spot_pos[px_idx] for px_idx in block])
+            if self._dc_estimator:
+                trans -= self._dc_estimator.tot_drift
+            cptrans = numpy.clip(trans, trans_rng[0], trans_rng[1])
+            if (cptrans != trans).any():
+                if self._dc_estimator:
+                    logging.error("Drift of %s px caused acquisition region out of bounds",
+                                  self._dc_estimator.tot_drift)
+                else:
+                    logging.error("Unexpected clipping in the scan spot positions")
+            # Each position is repeated for every image to integrate
+            path = [tuple(t) for t in cptrans.tolist() for _ in range(integration_count)]
+
+            last_das = self._acquireVectorBlock(n, pol_idx, block, path, img_time, integration_count,
+                                                sub_pxs, tot_num, leech_time_pimg, extra_time_pol, future)
+            n += len(path)
+            i += len(block)
+
+            # Check if it's time to run a leech
+            for li, l in enumerate(self.leeches):
+                if leech_nimg[li] is None:
+                    continue
+                leech_nimg[li] -= len(path)
+                if leech_nimg[li] <= 0:
+                    try:
+                        nimg = l.next(last_das)
+                        logging.debug("Ran leech %s successfully. Will run next leech after %s acquisitions.", l, nimg)
+                    except Exception:
+                        logging.exception("Leech %s failed, will retry next image", l)
+                        nimg = 1  # try again next pixel
+                    leech_nimg[li] = nimg
+                    if self._acq_state == CANCELLED:
+                        raise CancelledError()
+
+        return n
+
+    def _acquireVectorBlock(self, n, pol_idx, block, path, img_time, integration_count, sub_pxs,
+                            tot_num, leech_time_pimg, extra_time_pol, future):
+        """
+        Runs one vector scan, and processes the data received for each position.
+        :param n (int): Number of images acquired so far.
+        :param pol_idx (int): Index of the polarization position.
+        :param block (list of (int, int)): Index of each position scanned (Y, X).
+        :param path (list of (float, float)): Translation of each image to acquire.
+          There are integration_count successive images per position.
+        :param img_time, integration_count, sub_pxs, tot_num, leech_time_pimg,
+          extra_time_pol, future: see _acquireVectorScan()
+        :returns (list of DataArray): The last (non integrated) data of each stream.
+        """
+        rep = self.repetition.value
+        tile_size = self._emitter.resolution.value
+        self._vector_data = [[] for _ in self._streams]
+        self._vector_expected = len(path)
+
+        if self._acq_state == CANCELLED:
+            raise CancelledError()
+
+        logging.debug("Starting vector scan of %d positions", len(path))
+        self._emitter.scanPath.value = path
+        try:
+            # Subscribe the CCD first, so that it's ready for the first trigger
+            self._ccd_df.subscribe(self._vector_subscribers[self._ccd_idx])
+            for s, sub in zip(self._streams[:-1], self._vector_subscribers[:-1]):
+                s._dataflow.subscribe(sub)
+
+            tlast = time.time()  # time the last image was received
+            for k in range(len(path)):
+                px_idx = block[k // integration_count]
+                # Wait until the data of all the streams is received
+                while True:
+                    self._vector_received.clear()
+                    if self._acq_state == CANCELLED:
+                        raise CancelledError()
+                    if all(len(d) > k for d in self._vector_data):
+                        break
+                    if time.time() > tlast + img_time * 3 + 5:
+                        raise TimeoutError("Acquisition of repetition stream for pixel %s timed out after %g s"
+                                           % (px_idx, img_time * 3 + 5))
+                    self._vector_received.wait(0.1)
+
+                dur = time.time() - tlast
+                tlast = time.time()
+                if k % integration_count == 0:
+                    self._current_scan_area = (px_idx[1] * tile_size[0],
+                                               px_idx[0] * tile_size[1],
+                                               (px_idx[1] + 1) * tile_size[0] - 1,
+                                               (px_idx[0] + 1) * tile_size[1] - 1)
+                    # Reset live image, to not mix the images of the previous position
+                    self._sccd.raw = []
+
+                last_das = []
+                for das, vdata in zip(self._acq_data, self._vector_data):
+                    das.append(vdata[k])
+                    last_das.append(vdata[k])
+                    vdata[k] = None  # Not needed anymore => less RAM used
+                self._preprocessCCDData(n, px_idx, sub_pxs)
+                last_das[-1] = self._acq_data[self._ccd_idx][-1]
+
+                extra_time = (tot_num - n + 1) * leech_time_pimg + extra_time_pol
+                self._updateProgress(future, dur, n + 1, tot_num, extra_time)
+
+                self._integrateImage(integration_count)
+                n += 1  # number of images acquired so far
+
+                if (k + 1) % integration_count == 0:
+                    self._completePixel(px_idx, rep, pol_idx)
+                    logging.debug("Done acquiring image number %s out of %s.", n, tot_num)
+
+            return last_das
+        finally:
+            for s, sub in zip(self._streams, self._vector_subscribers):
+                s._dataflow.unsubscribe(sub)
+            self._emitter.scanPath.value = []
+            self._vector_data = [[] for _ in self._streams]
+
     def _waitForImage(self, img_time):
         """
         Wait for the detector to acquire the image.
@@ -1507,17 +1820,7 @@ class SEMCCDMDStream(MultipleDetectorStream):
             if self._acq_state == CANCELLED:
                 raise CancelledError()
 
-            # MD_POS default to the center of the stage, but it needs to be
-            # the position of the e-beam (without the shift for drift correction)
-            raw_pos = self._acq_data[0][-1].metadata[MD_POS]
-            drift_shift = self._dc_estimator.tot_drift if self._dc_estimator else (0, 0)
-            cor_pos = (raw_pos[0] + drift_shift[0] * sub_pxs[0],
-                       raw_pos[1] - drift_shift[1] * sub_pxs[1])  # Y is upside down
-            ccd_data = self._acq_data[self._ccd_idx][-1]
-            ccd_data.metadata[MD_POS] = cor_pos
-
-            self._acq_data[-1][-1] = self._preprocessData(self._ccd_idx, ccd_data, px_idx)
-            logging.debug("Processed CCD data %d = %s", n, px_idx)
+            self._preprocessCCDData(n, px_idx, sub_pxs)
 
             self._updateProgress(future, time.time() - start, n + 1, tot_num, extra_time)
 
@@ -1541,6 +1844,26 @@ class SEMCCDMDStream(MultipleDetectorStream):
             # no need to retry
             break
 
+    def _preprocessCCDData(self, n, px_idx, sub_pxs):
+        """
+        Updates the position of the last CCD data to the position of the e-beam,
+        and preprocesses it.
+        :param n (int): Number of images acquired so far.
+        :param px_idx (int, int): Current scanning position of ebeam.
+        :param sub_pxs (float, float): Sub-pixel size.
+        """
+        # MD_POS default to the center of the stage, but it needs to be
+        # the position of the e-beam (without the shift for drift correction)
+        raw_pos = self._acq_data[0][-1].metadata[MD_POS]
+        drift_shift = self._dc_estimator.tot_drift if self._dc_estimator else (0, 0)
+        cor_pos = (raw_pos[0] + drift_shift[0] * sub_pxs[0],
+                   raw_pos[1] - drift_shift[1] * sub_pxs[1])  # Y is upside down
+        ccd_data = self._acq_data[self._ccd_idx][-1]
+        ccd_data.metadata[MD_POS] = cor_pos
+
+        self._acq_data[-1][-1] = self._preprocessData(self._ccd_idx, ccd_data, px_idx)
+        logging.debug("Processed CCD data %d = %s", n, px_idx)
+
     def _adjustHardwareSettingsScanStage(self):
         """
         Read the SEM and CCD stream settings and adapt the SEM scanner
@@ -2175,8 +2498,8 @@ class SEMSpectrumMDStream(SEMCCDMDStream):
             md[MD_DESCRIPTION] = self._streams[n].name.value
 
             # Shape of spectrum data = C11YX
-            da = numpy.zeros(shape=(spec_shape[1], 1, 1, rep[1], rep[0]), dtype=raw_data.dtype)
-            self._live_data[n].append(model.DataArray(da, md))
+            da = self._createLiveArray((spec_shape[1], 1, 1, rep[1], rep[0]), raw_data.dtype, md)
+            self._live_data[n].append(da)
 
         self._live_data[n][pol_idx][:, 0, 0, px_idx[0], px_idx[1]] = raw_data.reshape(spec_shape[1])
 
@@ -2462,8 +2785,8 @@ class SEMTemporalSpectrumMDStream(SEMCCDMDStream):
             md[MD_DESCRIPTION] = self._streams[n].name.value
 
             # Shape of spectrum data = CT1YX
-            da = numpy.zeros(shape=(spec_res, temp_res, 1, rep[1], rep[0]), dtype=raw_data.dtype)
-            self._live_data[n].append(model.DataArray(da, md))
+            da = self._createLiveArray((spec_res, temp_res, 1, rep[1], rep[0]), raw_data.dtype, md)
+            self._live_data[n].append(da)
 
         # Detector image has a shape of (time, lambda)
         raw_data = raw_data.T  # transpose to (lambda, time)
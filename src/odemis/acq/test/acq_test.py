@@ -65,11 +65,88 @@ class Fake0DDataFlow(model.DataFlow):
         return da
 
 
+class FakeStream(object):
+    """
+    Just enough of a Stream to find out which hardware it uses
+    """
+    def __init__(self, name, emitter, detector):
+        self.name = model.StringVA(name)
+        self.emitter = emitter
+        self.detector = detector
+
+    def estimateAcquisitionTime(self):
+        return 1
+
+
 class TestNoBackend(unittest.TestCase):
     # No backend, and only fake streams that don't generate anything
 
-    # TODO
-    pass
+    def test_group_streams(self):
+        """
+        Check only the streams with independent hardware are acquired together
+        """
+        light = model.Emitter("light", "light", parent=None)
+        light.affects.value = ["ccd"]
+        ebeam = model.Emitter("ebeam", "e-beam", parent=None)
+        ebeam.affects.value = ["sed"]
+        ccd = Fake0DDetector("ccd")
+        sed = Fake0DDetector("sed")
+        ccd2 = Fake0DDetector("ccd2")
+
+        fluo1 = FakeStream("fluo1", light, ccd)
+        fluo2 = FakeStream("fluo2", light, ccd)
+        sem = FakeStream("sem", ebeam, sed)
+        cam2 = FakeStream("cam2", None, ccd2)
+
+        # Same hardware => one after another
+        groups = acqmng._groupIndependentStreams([fluo1, fluo2])
+        self.assertEqual(groups, [[fluo1], [fluo2]])
+
+        # Independent hardware => all together
+        groups = acqmng._groupIndependentStreams([fluo1, sem, cam2])
+        self.assertEqual(groups, [[fluo1, sem, cam2]])
+        self.assertEqual(acqmng.estimateTime([fluo1, sem, cam2]), 1)
+
+        # The e-beam affects the camera (eg, cathodoluminescence) => not together
+        ebeam.affects.value = ["sed", "ccd"]
+        groups = acqmng._groupIndependentStreams([fluo1, sem, fluo2])
+        self.assertEqual(groups, [[fluo1], [sem], [fluo2]])
+        self.assertEqual(acqmng.estimateTime([fluo1, sem, fluo2]), 3)
+
+        # Only consecutive streams are grouped
+        groups = acqmng._groupIndependentStreams([fluo1, cam2, fluo2])
+        self.assertEqual(groups, [[fluo1, cam2], [fluo2]])
+
+        for c in (light, ebeam, ccd, sed, ccd2):
+            c.terminate()
+
+    def test_settings_snapshot(self):
+        """
+        Check the settings are only copied when they change, and cannot be modified
+        """
+        light = model.Emitter("light", "light", parent=None)
+        light.power = model.FloatContinuous(0.1, (0, 1), unit="W")
+        ccd = Fake0DDetector("ccd")
+        ccd.gain = model.FloatContinuous(1, (0, 10))
+        settings_obs = SettingsObserver([light, ccd])
+
+        sett1 = settings_obs.get_all_settings()
+        self.assertEqual(sett1["light"]["power"], (0.1, "W"))
+        self.assertIs(settings_obs.get_all_settings(), sett1)
+        with self.assertRaises(TypeError):
+            sett1["light"]["power"] = (0.5, "W")
+        with self.assertRaises(TypeError):
+            del sett1["ccd"]
+
+        light.power.value = 0.5
+        sett2 = settings_obs.get_all_settings()
+        self.assertIsNot(sett2, sett1)
+        self.assertEqual(sett1["light"]["power"], (0.1, "W"))  # unchanged
+        self.assertEqual(sett2["light"]["power"], (0.5, "W"))
+        self.assertIs(sett2["ccd"], sett1["ccd"])  # only the light has changed
+
+        for c in (light, ccd):
+            c.terminate()
 
 # @skip("simple")
 class SECOMTestCase(unittest.TestCase):
@@ -17,8 +17,11 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 """
 import logging
 import os
+import threading
 import time
 import unittest
+from asyncio import CancelledError
+from concurrent import futures
 
 import odemis
 from odemis import model
@@ -26,6 +29,8 @@ from odemis import util
 from odemis.acq.move import ATOL_LINEAR_POS, ATOL_ROTATION_POS, RTOL_PROGRESS
 from odemis.acq.move import LOADING, IMAGING, MILLING, COATING, LOADING_PATH
 from odemis.acq.move import cryoTiltSample, cryoSwitchSamplePosition, getMovementProgress, getCurrentPositionLabel
+from odemis.acq import move
+from odemis.acq.move import _addSubMove, _cancelCryoMoveSample, _createCryoMoveFuture, run_sub_moves
 from odemis.util import test
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -190,6 +195,47 @@ class TestCryoMove(unittest.TestCase):
                                          match_all=False,
                                          atol=ATOL_ROTATION_POS)
 
+    def test_concurrent_sub_moves(self):
+        """
+        Test run_sub_moves runs independent sub moves at the same time, and in order the dependent ones
+        """
+        stage, focus = self.stage, self.focus
+        f = cryoSwitchSamplePosition(LOADING)
+        f.result()
+
+        # Move the focus and the stage x together, and only then the stage y
+        focus_pos = focus.position.value["z"] + 100e-6
+        stage_pos = stage.position.value
+        sub_moves = []
+        fm = _addSubMove(sub_moves, focus, {"z": focus_pos})
+        xm = _addSubMove(sub_moves, stage, {"x": stage_pos["x"] + 1e-3})
+        _addSubMove(sub_moves, stage, {"y": stage_pos["y"] + 1e-3}, [fm, xm])
+        f = _createCryoMoveFuture()
+        run_sub_moves(f, sub_moves)
+        self.assertAlmostEqual(focus.position.value["z"], focus_pos, delta=ATOL_LINEAR_POS)
+        self.assertAlmostEqual(stage.position.value["x"], stage_pos["x"] + 1e-3, delta=ATOL_LINEAR_POS)
+        self.assertAlmostEqual(stage.position.value["y"], stage_pos["y"] + 1e-3, delta=ATOL_LINEAR_POS)
+
+        # Cancelling the group stops all the concurrent sub moves, and the later ones are not started
+        sub_moves = []
+        fm = _addSubMove(sub_moves, focus, {"z": focus_pos + 1e-3})
+        xm = _addSubMove(sub_moves, stage, {"x": stage_pos["x"]})
+        _addSubMove(sub_moves, stage, {"y": stage_pos["y"]}, [fm, xm])
+        f = _createCryoMoveFuture()
+        threading.Timer(0.1, _cancelCryoMoveSample, args=(f,)).start()
+        with self.assertRaises(CancelledError):
+            run_sub_moves(f, sub_moves)
+        self.assertFalse(f._running_subfs)
+        self.assertAlmostEqual(stage.position.value["y"], stage_pos["y"] + 1e-3, delta=ATOL_LINEAR_POS)
+
+        # A cycle in the dependencies is refused
+        sub_moves = [(stage, {"x": stage_pos["x"]}, {1}), (stage, {"y": stage_pos["y"]}, {0})]
+        with self.assertRaises(ValueError):
+            run_sub_moves(_createCryoMoveFuture(), sub_moves)
+
+        f = cryoSwitchSamplePosition(LOADING)
+        f.result()
+
     def test_get_progress(self):
         """
         Test getMovementProgress function behaves as expected
@@ -260,5 +306,78 @@ class TestCryoMove(unittest.TestCase):
         self.assertEqual(pos_label, LOADING_PATH)
 
 
+class FakeActuator(object):
+    """
+    Minimal actuator, whose moves and referencing take a given time, or fail
+    """
+
+    def __init__(self, name, duration, error=None):
+        self.name = name
+        self.axes = {"z": None}
+        self._duration = duration
+        self._error = error
+        self.moves = []
+
+    def _run(self, mv):
+        f = futures.Future()
+
+        def finish():
+            if f.cancelled():
+                return
+            if self._error:
+                f.set_exception(self._error)
+            else:
+                self.moves.append(mv)
+                f.set_result(None)
+
+        threading.Timer(self._duration, finish).start()
+        return f
+
+    def moveAbs(self, pos):
+        return self._run(pos)
+
+    def reference(self, axes):
+        return self._run(None)
+
+
+class TestRunSubMoves(unittest.TestCase):
+    """
+    Test run_sub_moves, with fake actuators (no backend needed)
+    """
+
+    def setUp(self):
+        self._orig_max_duration = move.MAX_SUBMOVE_DURATION
+        move.MAX_SUBMOVE_DURATION = 0.2  # s
+        self.addCleanup(setattr, move, "MAX_SUBMOVE_DURATION", self._orig_max_duration)
+
+    def test_long_reference(self):
+        """
+        A referencing can take longer than a sub move, but a sub move cannot
+        """
+        slow = FakeActuator("slow", duration=0.5)
+        fast = FakeActuator("fast", duration=0.01)
+        run_sub_moves(_createCryoMoveFuture(), [(slow, None, set()), (fast, {"z": 1}, {0})])
+        self.assertEqual(slow.moves, [None])
+        self.assertEqual(fast.moves, [{"z": 1}])
+
+        with self.assertRaises(TimeoutError):
+            run_sub_moves(_createCryoMoveFuture(), [(slow, {"z": 2}, set())])
+        time.sleep(0.5)
+        self.assertEqual(slow.moves, [None])  # The move was cancelled
+
+    def test_reference_failure(self):
+        """
+        A failed referencing is only logged, while a failed move stops the whole group
+        """
+        bad = FakeActuator("bad", duration=0.01, error=IOError("Referencing failed"))
+        good = FakeActuator("good", duration=0.01)
+        run_sub_moves(_createCryoMoveFuture(), [(bad, None, set()), (good, {"z": 1}, {0})])
+        self.assertEqual(good.moves, [{"z": 1}])
+
+        with self.assertRaises(IOError):
+            run_sub_moves(_createCryoMoveFuture(), [(bad, {"z": 1}, set()), (good, {"z": 2}, {0})])
+        self.assertEqual(good.moves, [{"z": 1}])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -495,6 +495,24 @@ class Sparc2PathTestCase(unittest.TestCase):
 
         self.assertLess(dur, 20, "Changing to CLI then AR mode took %s s > 20 s" % (dur,))
 
+    def test_set_same_path(self):
+        """
+        Test setting again the current mode only moves what is not in place
+        """
+        self.optmngr.setPath("ar").result()
+        self.assert_pos_as_in_mode(self.lenswitch, "ar")
+
+        # Everything is already in place => no selector to move
+        self.assertEqual(self.optmngr.selectorsToPath(self.ccd.name), [])
+
+        # Going to a mode with a different lens-switch position, and back
+        lenswitch_pos = self.lenswitch.position.value.copy()
+        self.optmngr.setPath("spectral").result()
+        self.assertNotEqual(self.lenswitch.position.value, lenswitch_pos)
+        self.optmngr.setPath("ar").result()
+        self.assert_pos_as_in_mode(self.lenswitch, "ar")
+        self.assertEqual(self.optmngr.selectorsToPath(self.ccd.name), [])
+
     # @skip("simple")
     def test_set_path(self):
         """
@@ -30,12 +30,12 @@ from odemis import model
 import odemis
 from odemis.acq import stream, calibration, path, leech
 from odemis.acq.leech import ProbeCurrentAcquirer
-from odemis.acq.stream import POL_POSITIONS
+from odemis.acq.stream import POL_POSITIONS, _sync, _projection
 from odemis.acq.stream import RGBSpatialSpectrumProjection, \
     SinglePointSpectrumProjection, SinglePointTemporalProjection, \
     LineSpectrumProjection, MeanSpectrumProjection
 from odemis.dataio import tiff
-from odemis.driver import simcam
+from odemis.driver import simcam, simsem
 from odemis.model import MD_POL_NONE, MD_POL_HORIZONTAL, MD_POL_VERTICAL, \
     MD_POL_POSDIAG, MD_POL_NEGDIAG, MD_POL_RHC, MD_POL_LHC, DataArrayShadow, TINT_FIT_TO_RGB
 from odemis.util import test, conversion, img, spectrum, find_closest
@@ -46,6 +46,7 @@ import threading
 import time
 import unittest
 from unittest.case import skip
+from unittest import mock
 import weakref
 
 logging.basicConfig(format="%(asctime)s  %(levelname)-7s %(module)-15s: %(message)s")
@@ -2177,6 +2178,229 @@ class SPARC2TestCase(unittest.TestCase):
         self.assertGreater(len(pcmd), 500 / 10)
 
 
+class CountingLeech(leech.LeechAcquirer):
+    """
+    Leech which does nothing, but counts how many times it is run
+    """
+
+    def __init__(self, period):
+        """
+        period (1<=int): number of pixels between each run
+        """
+        super(CountingLeech, self).__init__()
+        self._period = period
+        self.nexts = 0
+
+    def start(self, acq_t, shape):
+        self.nexts = 0
+        return self._period
+
+    def next(self, das):
+        self.nexts += 1
+        return self._period
+
+
+class VectorScanTestCase(unittest.TestCase):
+    """
+    Tests the SEM + CCD acquisition with an e-beam scanner which supports
+    vector scan, using directly the simulated SEM and camera.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sem = simsem.SimSEM(name="sem", role="sem", image="simsem-fake-output.h5",
+                                children={"detector0": {"name": "sed", "role": "se-detector"},
+                                          "detector1": {"name": "bsd", "role": "bs-detector"},
+                                          "scanner": {"name": "ebeam", "role": "e-beam"}})
+        for child in cls.sem.children.value:
+            if child.role == "se-detector":
+                cls.sed = child
+            elif child.role == "bs-detector":
+                cls.bsd = child
+            elif child.role == "e-beam":
+                cls.ebeam = child
+        cls.ccd = simcam.Camera(name="ccd", role="ccd", image="sparc-ar-mirror-align.h5")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ccd.terminate()
+        cls.sem.terminate()
+
+    def test_acq_ar(self):
+        """
+        Check all the positions are acquired, with the CCD triggered by the scanner
+        """
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        ars = stream.ARSettingsStream("test ar", self.ccd, self.ccd.data, self.ebeam,
+                                      detvas={"exposureTime"})
+        sas = stream.SEMARMDStream("test sem-ar", [sems, ars])
+        self.assertTrue(sas._canVectorScan(0.05))
+        # The e-beam cannot wait longer than the max dwell time => software synchronisation
+        self.assertFalse(sas._canVectorScan(self.ebeam.dwellTime.range[1]))
+
+        ars.detExposureTime.value = 0.05  # s
+        ars.roi.value = (0.1, 0.2, 0.3, 0.4)
+        ars.repetition.value = (4, 3)
+        rep = ars.repetition.value
+
+        timeout = 5 + 2 * sas.estimateAcquisitionTime()
+        start = time.time()
+        f = sas.acquire()
+        data = f.result(timeout)
+        dur = time.time() - start
+        logging.debug("Acquisition took %g s", dur)
+
+        # One SEM image + one AR image per position
+        self.assertEqual(len(data), 1 + numpy.prod(rep))
+        self.assertEqual(data[0].shape, rep[::-1])
+        # Each AR image is at a different position
+        ar_pos = set(d.metadata[model.MD_POS] for d in data[1:])
+        self.assertEqual(len(ar_pos), numpy.prod(rep))
+        # The scanner is back to standard scanning
+        self.assertEqual(self.ebeam.scanPath.value, [])
+
+    def test_vector_scan_two_sem(self):
+        """
+        Check the CCD is triggered once per position of the vector scan, also
+        with two e-beam detectors acquiring
+        Note: SEMCCDMDStream only supports one e-beam stream, so the hardware
+        is used directly.
+        """
+        self.ebeam.resolution.value = (1, 1)
+        self.ebeam.dwellTime.value = 0.1  # s
+        self.ccd.exposureTime.value = 0.01  # s
+        path = [(-10, -10), (0, 0), (10, 5), (20, 20), (-5, 30)]
+        self.ebeam.scanPath.value = path
+        self.addCleanup(setattr, self.ebeam.scanPath, "value", [])
+
+        self.events = 0
+        received = {self.sed: [], self.bsd: [], self.ccd: []}
+        done = threading.Event()
+
+        def on_data(df, da):
+            for comp, l in received.items():
+                if df is comp.data:
+                    l.append(da)
+            if all(len(l) >= len(path) for l in received.values()):
+                done.set()
+
+        self.ebeam.newPosition.subscribe(self)
+        self.addCleanup(self.ebeam.newPosition.unsubscribe, self)
+        self.ccd.data.synchronizedOn(self.ebeam.newPosition)
+        self.addCleanup(self.ccd.data.synchronizedOn, None)
+        for comp in (self.ccd, self.sed, self.bsd):
+            comp.data.subscribe(on_data)
+            self.addCleanup(comp.data.unsubscribe, on_data)
+
+        self.assertTrue(done.wait(5 + len(path) * 0.1 * 2), "Data not received: %s" %
+                        {c.name: len(l) for c, l in received.items()})
+        time.sleep(0.5)  # To catch any extra event or frame
+
+        # One event, and so one CCD frame, per position, whatever the number of e-beam detectors
+        self.assertEqual(self.events, len(path))
+        self.assertEqual(len(received[self.ccd]), len(path))
+        self.assertEqual(len(received[self.sed]), len(path))
+        self.assertEqual(len(received[self.bsd]), len(path))
+
+    def onEvent(self):
+        """
+        Called by the e-beam at each new position of the vector scan
+        """
+        self.events += 1
+
+    def test_acq_ar_leech(self):
+        """
+        Check the positions are acquired in several blocks when a leech has to
+        run in-between, with one CCD frame per position.
+        """
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        ars = stream.ARSettingsStream("test ar", self.ccd, self.ccd.data, self.ebeam,
+                                      detvas={"exposureTime"})
+        sas = stream.SEMARMDStream("test sem-ar", [sems, ars])
+        counter = CountingLeech(period=3)
+        sems.leeches.append(counter)
+
+        ars.detExposureTime.value = 0.05  # s
+        ars.roi.value = (0.1, 0.2, 0.3, 0.4)
+        ars.repetition.value = (4, 2)
+        rep = ars.repetition.value
+        self.ebeam.dwellTime.value = 10e-6
+        dt = self.ebeam.dwellTime.value
+
+        timeout = 5 + 2 * sas.estimateAcquisitionTime()
+        f = sas.acquire()
+        data = f.result(timeout)
+
+        # 8 positions, leech every 3 => 3 blocks, and the leech ran between them
+        self.assertEqual(counter.nexts, 2)
+        self.assertEqual(len(data), 1 + numpy.prod(rep))
+        ar_pos = [d.metadata[model.MD_POS] for d in data[1:]]
+        self.assertEqual(len(set(ar_pos)), numpy.prod(rep))
+        # Each frame was triggered by its own position: no frame acquired before
+        # the previous one (eg, an untriggered frame at the beginning of a block)
+        ar_dates = [d.metadata[model.MD_ACQ_DATE] for d in data[1:]]
+        for d0, d1 in zip(ar_dates[:-1], ar_dates[1:]):
+            self.assertGreater(d1, d0)
+        # The dwell time is restored after the acquisition
+        self.assertEqual(self.ebeam.dwellTime.value, dt)
+
+    def test_acq_memmap(self):
+        """
+        Check the data is stored in a temporary file if it's too big
+        """
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        ars = stream.ARSettingsStream("test ar", self.ccd, self.ccd.data, self.ebeam,
+                                      detvas={"exposureTime"})
+        sas = stream.SEMARMDStream("test sem-ar", [sems, ars])
+
+        ars.detExposureTime.value = 0.01  # s
+        ars.repetition.value = (3, 2)
+        rep = ars.repetition.value
+
+        orig_min_size = _sync.MEMMAP_MIN_SIZE
+        _sync.MEMMAP_MIN_SIZE = 0  # Any data is "big"
+        try:
+            f = sas.acquire()
+            data = f.result(5 + 2 * sas.estimateAcquisitionTime())
+        finally:
+            _sync.MEMMAP_MIN_SIZE = orig_min_size
+
+        sem_da = data[0]
+        self.assertEqual(sem_da.shape, rep[::-1])
+        base = sem_da
+        while base is not None and not isinstance(base, numpy.memmap):
+            base = base.base
+        self.assertIsInstance(base, numpy.memmap)
+        # The data is usable as any array
+        self.assertGreater(sem_da.max(), 0)
+
+    def test_mean_passes_memmap(self):
+        """
+        Check the average of several passes is computed in chunks, into a temporary file
+        """
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        ars = stream.ARSettingsStream("test ar", self.ccd, self.ccd.data, self.ebeam,
+                                      detvas={"exposureTime"})
+        sas = stream.SEMARMDStream("test sem-ar", [sems, ars])
+
+        passes = [model.DataArray(numpy.random.randint(0, 4096, (50, 40)).astype(numpy.uint16))
+                  for i in range(3)]
+        orig_min_size, orig_chunk_size = _sync.MEMMAP_MIN_SIZE, _sync.MEAN_CHUNK_SIZE
+        _sync.MEMMAP_MIN_SIZE = 0  # Any data is "big"
+        _sync.MEAN_CHUNK_SIZE = 40 * 8 * 7  # 7 rows at a time
+        try:
+            res = sas._meanPasses(passes, {model.MD_DIMS: "YX"})
+        finally:
+            _sync.MEMMAP_MIN_SIZE, _sync.MEAN_CHUNK_SIZE = orig_min_size, orig_chunk_size
+
+        base = res
+        while base is not None and not isinstance(base, numpy.memmap):
+            base = base.base
+        self.assertIsInstance(base, numpy.memmap)
+        self.assertEqual(res.dtype, numpy.uint16)
+        numpy.testing.assert_array_equal(res, numpy.mean(passes, axis=0).astype(numpy.uint16))
+
+
 class SPARC2StreakCameraTestCase(unittest.TestCase):
     """
     Tests to be run with a (simulated) SPARCv2 equipped with a streak camera
@@ -4488,6 +4712,12 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertIsInstance(sp0d.dtype.type(), numpy.floating)
         self.assertTrue(numpy.all(sp0d <= spec.max()))
 
+        # Compare with the mean of all the pixels within 6 px, taken one by one
+        spec2d = specs.calibrated.value[:, 0, 0]
+        pixels = [spec2d[:, py, px] for py in range(0, 8) for px in range(0, 8)
+                  if math.hypot(px - 1, py - 1) <= 6]
+        numpy.testing.assert_allclose(sp0d, numpy.mean(pixels, axis=0))
+
         # Check with very large width
         specs.selectionWidth.value = specs.selectionWidth.range[1]
         specs.selected_pixel.value = (55, 106)
@@ -4577,6 +4807,35 @@ class StaticStreamsTestCase(unittest.TestCase):
         sp1d_raw = proj_line_spectrum.projectAsRaw()
         self.assertIsInstance(sp1d_raw.dtype.type(), numpy.floating)
 
+        # On the border, only the points inside the data should be averaged
+        # (and the first wavelength is 1 everywhere on the left)
+        specs.selected_line.value = [(0, 50), (0, 100)]
+        specs.selectionWidth.value = 4
+        time.sleep(1.0)  # ensure that .image is updated
+        sp1d_raw = proj_line_spectrum.projectAsRaw()
+        self.assertEqual(sp1d_raw.shape, (51, spec.shape[0]))
+        numpy.testing.assert_allclose(sp1d_raw[:, 0], 1)
+
+    def test_mean_along_line_1px(self):
+        """
+        Check the mean along a line on data of just 1 px of height, with a width
+        which would put all the points outside of the data
+        """
+        # CYX, with each spectrum being X, X+100, X+200
+        data = numpy.empty((3, 1, 20), dtype=numpy.uint16)
+        data[:] = numpy.arange(20) + numpy.array([0, 100, 200])[:, None, None]
+        expected = data[:, 0, 2:16].T
+
+        for width in (1, 2, 3, 4, 8):
+            spec1d = _projection._meanAlongLine(data, (2, 0), (15, 0), 14, width)
+            numpy.testing.assert_allclose(spec1d, expected, err_msg="width = %d" % (width,))
+
+        # Same thing, with the data being 1 px wide (and a vertical line)
+        data_v = data.swapaxes(1, 2)
+        for width in (1, 2, 4):
+            spec1d = _projection._meanAlongLine(data_v, (0, 2), (0, 15), 14, width)
+            numpy.testing.assert_allclose(spec1d, expected, err_msg="width = %d" % (width,))
+
     def test_spectrum_calib_bg(self):
         """Test Static Spectrum Stream calibration and background image correction
         with spectrum data."""
@@ -4974,6 +5233,45 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 1)
 
+    def test_tiled_stream_settings_thread(self):
+        """
+        Check the projection settings are read only once per image update, and
+        not by the workers projecting the tiles
+        """
+        POS = (5.0, 7.0)
+        size = (2000, 1000)
+        md = {
+            model.MD_DIMS: 'YX',
+            model.MD_POS: POS,
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+        }
+        arr = numpy.arange(size[0] * size[1], dtype=numpy.uint16).reshape(size[::-1])
+        data = model.DataArray(arr, metadata=md)
+        tiff.export(FILENAME, data, pyramid=True)
+
+        acd = tiff.open_data(FILENAME)
+        ss = stream.StaticSEMStream("test", acd.content[0])
+        pj = stream.RGBSpatialProjection(ss)
+        pj.mpp.value = 1e-6  # first zoom level => 8 x 4 tiles
+        pj.rect.value = (POS[0] - 0.001, POS[1] - 0.0005, POS[0] + 0.001, POS[1] + 0.0005)
+        time.sleep(1)
+
+        # Record which threads read the display range
+        irange_threads = []
+        orig_get_irange = ss._getDisplayIRange
+
+        def get_irange():
+            irange_threads.append(threading.current_thread())
+            return orig_get_irange()
+
+        ss._getDisplayIRange = get_irange
+        self.addCleanup(delattr, ss, "_getDisplayIRange")
+        _projection._tile_cache.clear()
+        pj._updateImage()
+
+        self.assertEqual(len(pj.image.value), 8)
+        self.assertEqual(irange_threads, [threading.current_thread()])
+
     def test_rgb_tiled_stream(self):
         POS = (5.0, 7.0)
         size = (2000, 1000, 3)
@@ -5029,6 +5327,9 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         tiff.DataArrayShadowPyramidalTIFF._getTileOldSP = tiff.DataArrayShadowPyramidalTIFF.getTile
         tiff.DataArrayShadowPyramidalTIFF.getTile = getTileMock
+        # No prefetching, to only read the tiles displayed
+        stream.RGBSpatialProjection.prefetch_tiles = False
+        self.addCleanup(setattr, stream.RGBSpatialProjection, "prefetch_tiles", True)
 
         POS = (5.0, 7.0)
         size = (3000, 2000, 3)
@@ -5073,11 +5374,11 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(len(pj.image.value), 3)
         self.assertEqual(len(pj.image.value[0]), 4)
 
-        # half image (right side), only the center tiles will are cached
+        # half image (right side), all tiles are still cached
         pj.rect.value = (POS[0], POS[1] - 0.001, POS[0] + 0.0015, POS[1] + 0.001)
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        self.assertEqual(40, len(read_tiles))
+        self.assertEqual(28, len(read_tiles))
         self.assertEqual(len(pj.image.value), 4)
         self.assertEqual(len(pj.image.value[0]), 4)
 
@@ -5086,7 +5387,7 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        self.assertEqual(40, len(read_tiles))
+        self.assertEqual(28, len(read_tiles))
         self.assertEqual(len(pj.image.value), 1)
         self.assertEqual(len(pj.image.value[0]), 1)
 
@@ -5108,6 +5409,9 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         tiff.DataArrayShadowPyramidalTIFF._getTileOldSZ = tiff.DataArrayShadowPyramidalTIFF.getTile
         tiff.DataArrayShadowPyramidalTIFF.getTile = getTileMock
+        # No prefetching, to only read the tiles displayed
+        stream.RGBSpatialProjection.prefetch_tiles = False
+        self.addCleanup(setattr, stream.RGBSpatialProjection, "prefetch_tiles", True)
 
         POS = (5.0, 7.0)
         dtype = numpy.uint8
@@ -5215,14 +5519,15 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        # Only 2 tiles read from disk. It means that the loop inside _updateImage,
-        # triggered by the change on .rect was immediately stopped when .mpp changed
-        if len(read_tiles) == 8:
-            logging.warning("Two tiles read while expected to have just one, but "
+        # No tile read from disk, as the 2 tiles at max mpp are still cached.
+        # It means that the loop inside _updateImage, triggered by the change
+        # on .rect was immediately stopped when .mpp changed
+        if len(read_tiles) == 6:
+            logging.warning("One tile read while expected to have none, but "
                             "this is acceptable as updateImage thread might have "
                             "gone very fast.")
         else:
-            self.assertEqual(7, len(read_tiles))
+            self.assertEqual(5, len(read_tiles))
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 1)
 
@@ -5270,8 +5575,8 @@ class StaticStreamsTestCase(unittest.TestCase):
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
 
-        # reads 4 tiles from the disk, no tile is cached becase the zoom changed
-        self.assertEqual(10, len(read_tiles))
+        # reads 3 tiles from the disk, only the center tile was cached at this zoom level
+        self.assertEqual(9, len(read_tiles))
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 2)
         # top-left pixel of the top-left tile
@@ -5286,6 +5591,146 @@ class StaticStreamsTestCase(unittest.TestCase):
         # get the old function back to the class
         tiff.DataArrayShadowPyramidalTIFF.getTile = tiff.DataArrayShadowPyramidalTIFF._getTileOldSZ
 
+    def test_tile_rings(self):
+        """
+        Check the tiles are grouped in rings around the center of the area
+        """
+        rings = stream.RGBSpatialProjection._getTileRings((0, 0, 4, 2))
+        self.assertEqual(len(rings), 3)
+        self.assertEqual(rings[0], [(2, 1)])
+        all_tiles = [t for r in rings for t in r]
+        self.assertEqual(len(all_tiles), 5 * 3)
+        self.assertEqual(len(set(all_tiles)), 5 * 3)
+
+        # The tiles of the first N rings always form a rectangle
+        tiles = set()
+        for r in rings:
+            tiles.update(r)
+            xs = [x for x, y in tiles]
+            ys = [y for x, y in tiles]
+            self.assertEqual(len(tiles), (max(xs) - min(xs) + 1) * (max(ys) - min(ys) + 1))
+
+        # With an even number of tiles, the center is made of several tiles
+        rings = stream.RGBSpatialProjection._getTileRings((0, 0, 5, 3))
+        self.assertEqual(len(rings), 3)
+        self.assertEqual(sorted(rings[0]), [(2, 1), (2, 2), (3, 1), (3, 2)])
+
+    def test_rgb_tiled_stream_partial(self):
+        """
+        Check the tiles are published ring by ring, and the raw data always
+        corresponds to the image
+        """
+        POS = (5.0, 7.0)
+        md = {
+            model.MD_DIMS: 'YXC',
+            model.MD_POS: POS,
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+        }
+        arr = numpy.zeros((2000, 3000, 3), dtype=numpy.uint8)
+        data = model.DataArray(arr, metadata=md)
+        tiff.export(FILENAME, data, pyramid=True)
+
+        acd = tiff.open_data(FILENAME)
+        ss = stream.RGBStream("test", acd.content[0])
+        pj = stream.RGBSpatialProjection(ss)
+        pj.mpp.value = 2e-6  # second zoom level => 6 x 4 tiles
+        pj.rect.value = (POS[0] - 0.0015, POS[1] - 0.001, POS[0] + 0.0015, POS[1] + 0.001)
+        time.sleep(1)
+        self.assertEqual(len(pj.image.value), 6)
+        self.assertEqual(len(pj.image.value[0]), 4)
+
+        # Compute the image again, directly, to receive all the updates
+        updates = []  # size of the image and of the raw data, at each update
+
+        def on_image(im):
+            updates.append(((len(im), len(im[0])), (len(pj._raw), len(pj._raw[0]))))
+
+        pj.image.subscribe(on_image)
+        pj._updateImage()
+        pj.image.unsubscribe(on_image)
+
+        # The 2 x 2 tiles of the center, then 4 x 4, and finally all the tiles
+        self.assertEqual([im_size for im_size, _ in updates], [(2, 2), (4, 4), (6, 4)])
+        for im_size, raw_size in updates:
+            self.assertEqual(im_size, raw_size)
+
+    def test_tile_cache_source_deleted(self):
+        """
+        Check the tiles of a data source are dropped from the cache when it's garbage collected
+        """
+        data = model.DataArray(numpy.zeros((600, 500), dtype=numpy.uint16),
+                               metadata={model.MD_DIMS: "YX", model.MD_PIXEL_SIZE: (1e-6, 1e-6)})
+        tiff.export(FILENAME, data, pyramid=True)
+
+        # The data sources are DataArrayShadows, as in the projections.
+        # Opening twice the same file gives two different data sources.
+        cache = _projection.TileCache(10 * 2 ** 20)
+        das1 = tiff.open_data(FILENAME).content[0]
+        das2 = tiff.open_data(FILENAME).content[0]
+        sid1 = cache.get_source_id(das1)
+        sid2 = cache.get_source_id(das2)
+        self.assertNotEqual(sid1, sid2)
+        self.assertEqual(cache.get_source_id(das1), sid1)
+
+        cache.put(("raw", sid1, 0, 0, 0), das1.getTile(0, 0, 0))
+        cache.put(("raw", sid2, 0, 0, 0), das2.getTile(0, 0, 0))
+        self.assertEqual(len(cache), 2)
+
+        del das1
+        gc.collect()
+        self.assertNotIn(("raw", sid1, 0, 0, 0), cache)
+        self.assertEqual(len(cache), 1)
+        self.assertIn(("raw", sid2, 0, 0, 0), cache)
+
+    def test_rgb_tiled_stream_prefetch(self):
+        """
+        Check the tiles around the displayed area are read in advance
+        """
+        read_tiles = []
+        orig_get_tile = tiff.DataArrayShadowPyramidalTIFF.getTile
+
+        def getTileMock(self, x, y, zoom):
+            read_tiles.append((x, y, zoom))
+            return orig_get_tile(self, x, y, zoom)
+
+        patcher = mock.patch.object(tiff.DataArrayShadowPyramidalTIFF, "getTile", getTileMock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        POS = (5.0, 7.0)
+        md = {
+            model.MD_DIMS: 'YXC',
+            model.MD_POS: POS,
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+        }
+        arr = numpy.zeros((2000, 3000, 3), dtype=numpy.uint8)
+        data = model.DataArray(arr, metadata=md)
+        tiff.export(FILENAME, data, pyramid=True)
+
+        acd = tiff.open_data(FILENAME)
+        ss = stream.RGBStream("test", acd.content[0])
+        pj = stream.RGBSpatialProjection(ss)
+
+        # really small rect on the center, at the second zoom level => tile (2, 1)
+        pj.rect.value = (POS[0], POS[1] - 0.00001, POS[0] + 0.00001, POS[1])
+        pj.mpp.value = 2e-6
+        time.sleep(1)
+        self.assertEqual(len(pj.image.value), 1)
+        self.assertEqual(len(pj.image.value[0]), 1)
+        self.assertIn((2, 1, 1), read_tiles)
+        # The ring around the tile, and the other zoom levels have been read
+        self.assertIn((3, 1, 1), read_tiles)
+        self.assertIn((1, 2, 1), read_tiles)
+        self.assertIn((5, 3, 0), read_tiles)
+        self.assertIn((1, 0, 2), read_tiles)
+
+        # Pan by one tile (256 px at zoom level 1) => already read
+        pj.rect.value = (POS[0] + 512e-6, POS[1] - 0.00001, POS[0] + 512e-6 + 0.00001, POS[1])
+        time.sleep(0.5)
+        self.assertEqual(len(pj.image.value), 1)
+        self.assertEqual(len(pj.image.value[0]), 1)
+        self.assertEqual(read_tiles.count((3, 1, 1)), 1)
+
     def test_rgb_updatable_stream(self):
         """Test RGBUpdatableStream """
 
@@ -33,14 +33,17 @@ import importlib
 import inspect
 import logging
 import numbers
-from odemis import model, dataio, util
+from odemis import model, util
 import odemis
 from odemis.util import units, inspect_getmembers
 from odemis.util.conversion import convert_to_object
 from odemis.util.driver import BACKEND_RUNNING, \
     BACKEND_DEAD, BACKEND_STOPPED, get_backend_status, BACKEND_STARTING
+import os
+import queue
 import sys
 import threading
+import time
 
 
 status_to_xtcode = {BACKEND_RUNNING: 0,
@@ -694,24 +697,6 @@ def stop_move():
     if error:
         raise IOError("Failed to stop all the actuators")
 
-def _get_big_image(df):
-    """
-    Same as df.get(), but avoids "out of memory" errors more often in case of
-    really big images (>100 Mb)
-    df (Dataflow)
-    """
-    evt = threading.Event()
-    images = []
-
-    def get_data(dflow, da):
-        dflow.unsubscribe(get_data)
-        images.append(da)
-        evt.set()
-
-    df.subscribe(get_data)
-    evt.wait()
-    return images[-1]
-
 def acquire(comp_name, dataflow_names, filename):
     """
     Acquire an image from one (or more) dataflow
@@ -737,9 +722,8 @@ def acquire(comp_name, dataflow_names, filename):
     images = []
     for df in dataflows:
         try:
-            # Note: currently, get() uses Pyro, which is not as memory efficient
-            # as .subscribe(), which uses ZMQ. So would need to use
-            # _get_big_image() if very large image is requested.
+            # Note: get() receives the data via ZMQ, so even very large
+            # images don't need to be copied.
             image = df.get()
         except Exception as exc:
             raise IOError("Failed to acquire image from component %s: %s" % (comp_name, exc))
@@ -764,12 +748,147 @@ def acquire(comp_name, dataflow_names, filename):
         except Exception as exc:
             logging.exception("Failed to read image information.")
 
+    # Only imported now, as it's slow to load (and rarely needed by the CLI)
+    from odemis import dataio
     exporter = dataio.find_fittest_converter(filename)
     try:
         exporter.export(filename, images)
     except IOError as exc:
         raise IOError(u"Failed to save to '%s': %s" % (filename, exc))
 
+# Maximum number of frames waiting to be stored during a burst acquisition.
+# If the disk is slower than the detector, the extra frames are dropped.
+BURST_QUEUE_SIZE = 64
+# The burst acquisition is aborted if no frame is received for that long, or
+# 10x the previous frame interval if it's longer.
+BURST_STALL_TIMEOUT = 10  # s
+
+def acquire_burst(comp_name, df_name, filename, frames):
+    """
+    Acquire a series of images from a dataflow, as fast as the detector goes,
+    and save them all in one file.
+    While the acquisition runs, each image is written to the file as soon as it
+    is received (by a separate thread), so the number of images is not limited
+    by the memory.
+    comp_name (string): name of the detector to find
+    df_name (string): name of the dataflow to access
+    filename (unicode): name of the output file (format depends on the extension,
+      only TIFF and HDF5 are supported).
+    frames (1 <= int): number of images to acquire
+    raises IOError: if the detector stopped sending frames, or some frames could
+      not be stored. The frames received are still saved.
+    """
+    component = get_detector(comp_name)
+
+    # check the dataflow exists
+    try:
+        df = getattr(component, df_name)
+    except AttributeError:
+        raise ValueError("Failed to find data-flow '%s' on component %s" % (df_name, comp_name))
+
+    if not isinstance(df, model.DataFlowBase):
+        raise ValueError("%s.%s is not a data-flow" % (comp_name, df_name))
+
+    # Only imported now, as it's slow to load (and rarely needed by the CLI)
+    from odemis import dataio
+    exporter = dataio.find_fittest_converter(filename)
+    if not hasattr(exporter, "SeriesWriter"):
+        raise ValueError("Format %s cannot be used to save a burst of images" % (exporter.FORMAT,))
+
+    to_store = queue.Queue(maxsize=BURST_QUEUE_SIZE)  # (int, DataArray) or None to stop
+    received = []  # time of reception of each frame
+    dropped = [0]  # in python2 we need to create a new container object
+    saved = [0]
+    errors = []
+    done = threading.Event()
+
+    def on_image(dflow, da):
+        if done.is_set():  # Extra frame received just before unsubscribing
+            return
+        received.append(time.time())
+        n = len(received)
+        # Queue the frame before reporting the end, so that it's always
+        # queued before the end of the storing is requested.
+        try:
+            to_store.put_nowait((n, da))
+        except queue.Full:
+            dropped[0] += 1
+        if n >= frames:
+            dflow.unsubscribe(on_image)
+            done.set()
+
+    def store_images(writer):
+        while True:
+            item = to_store.get()
+            if item is None:
+                return
+            n, da = item
+            try:
+                writer.append(da)
+                saved[0] += 1
+            except Exception as exc:
+                logging.error("Failed to store frame %d: %s", n, exc)
+                errors.append(n)
+
+    try:
+        writer = exporter.SeriesWriter(filename)
+    except Exception as exc:
+        raise IOError(u"Failed to save to '%s': %s" % (filename, exc))
+
+    try:
+        storer = threading.Thread(target=store_images, args=(writer,),
+                                  name="Burst image storer")
+        storer.start()
+        # All the frames should reach the callback: the only drops are due to the queue
+        orig_max_discard = df.max_discard
+        df.max_discard = 0
+        # Expected time for the first frame, if the detector tells it
+        try:
+            first_interval = component.exposureTime.value
+        except AttributeError:
+            first_interval = 0
+        stalled = False
+        try:
+            tstart = time.time()
+            df.subscribe(on_image)
+            while not done.wait(1):
+                nrec = len(received)
+                if nrec >= 2:
+                    interval = received[-1] - received[-2]
+                else:
+                    interval = first_interval
+                tlast = received[-1] if nrec else tstart
+                if time.time() - tlast > max(BURST_STALL_TIMEOUT, 10 * interval):
+                    logging.error("No frame received for %g s, stopping the acquisition",
+                                  time.time() - tlast)
+                    stalled = True
+                    break
+        finally:
+            if not done.is_set():
+                done.set()  # Ignore any frame still coming
+                df.unsubscribe(on_image)
+            df.max_discard = orig_max_discard
+            # Wait for all the images to be stored
+            to_store.put(None)
+            storer.join()
+    finally:
+        try:
+            writer.close()
+        except Exception as exc:
+            raise IOError(u"Failed to save to '%s': %s" % (filename, exc))
+
+    if len(received) > 1:
+        fps = (len(received) - 1) / (received[-1] - received[0])
+    else:
+        fps = 0
+    print(u"Acquired %d frames at %.1f fps, %d dropped, %d saved in %s" %
+          (len(received), fps, dropped[0], saved[0], filename))
+    if stalled:
+        raise IOError(u"Detector stopped sending frames, %d frames missing" %
+                      (frames - len(received),))
+    if errors:
+        raise IOError(u"Failed to store %d frames" % (len(errors),))
+
 def live_display(comp_name, df_name):
     """
     Acquire an image from one (or more) dataflow
@@ -897,6 +1016,10 @@ def main(args):
                         help="name of the file where the image should be saved "
                         "after acquisition. The file format is derived from the extension "
                         "(TIFF and HDF5 are supported).")
+    dm_grp.add_argument("--frames", "-n", dest="frames", type=int, default=1,
+                        metavar="<number>",
+                        help="number of images to acquire in a burst. All the images "
+                        "are saved in the output file (default is 1).")
     dm_grpe.add_argument("--live", dest="live", nargs="+",
                          metavar=("<component>", "data-flow"),
                          help="display and update an image on the screen (default data-flow is \"data\")")
@@ -944,6 +1067,9 @@ def main(args):
     if options.acquire is not None and options.output is None:
         logging.error("Name of the output file must be specified.")
         return 127
+    if options.frames < 1:
+        logging.error("Number of frames must be at least 1.")
+        return 127
     if options.setattr:
         for l in options.setattr:
             if len(l) < 3 or (len(l) - 1) % 2 == 1:
@@ -1021,7 +1147,12 @@ def main(args):
                 filename = options.output
             else:  # python2
                 filename = options.output.decode(sys.getfilesystemencoding())
-            acquire(component, dataflows, filename)
+            if options.frames > 1:
+                if len(dataflows) > 1:
+                    raise ValueError("Burst acquisition accepts only one data-flow")
+                acquire_burst(component, dataflows[0], filename, options.frames)
+            else:
+                acquire(component, dataflows, filename)
         elif options.live is not None:
             component = options.live[0]
             if len(options.live) == 1:
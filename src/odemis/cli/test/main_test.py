@@ -26,16 +26,20 @@ from __future__ import division
 from PIL import Image
 from io import BytesIO
 import logging
+import numpy
 from odemis import model
 import odemis
+from odemis import dataio
 from odemis.cli import main
 from odemis.util import test
 import os
 import re
 import subprocess
 import sys
+import threading
 import time
 import unittest
+from unittest import mock
 from unittest.case import skip
 
 
@@ -45,6 +49,27 @@ ODEMISCLI_CMD = [sys.executable, "-m", "odemis.cli.main"]
 CONFIG_PATH = os.path.dirname(odemis.__file__) + "/../../install/linux/usr/share/odemis/"
 SECOM_CONFIG = CONFIG_PATH + "sim/secom-sim.odm.yaml"
 
+
+class StallingDataFlow(model.DataFlow):
+    """
+    DataFlow which sends a few images, and then stops sending anything, as a
+    detector which would stop working.
+    """
+
+    def __init__(self, nframes):
+        model.DataFlow.__init__(self)
+        self._nframes = nframes
+
+    def start_generate(self):
+        threading.Thread(target=self._generate).start()
+
+    def _generate(self):
+        for i in range(self._nframes):
+            time.sleep(0.01)
+            self.notify(model.DataArray(numpy.full((16, 32), i, dtype=numpy.uint16),
+                                        {model.MD_ACQ_DATE: time.time()}))
+
+
 class TestWithoutBackend(unittest.TestCase):
     # all the test cases which don't need a backend running
 
@@ -110,6 +135,47 @@ class TestWithoutBackend(unittest.TestCase):
             ret = exc.code
         self.assertNotEqual(ret, 0, "Wrongly succeeded trying to run scan with unknown class: '%s'" % cmdline)
 
+    def test_import_time(self):
+        """
+        Check the CLI doesn't load the libraries which are slow to import
+        """
+        # Must be run in a separate process, as the modules are already loaded here
+        heavy_mods = ("cv2", "matplotlib", "scipy", "h5py", "libtiff", "odemis.dataio")
+        code = ("import sys, time; s = time.time(); import odemis.cli.main; d = time.time() - s; "
+                "print(d); print(','.join(m for m in %r if m in sys.modules))" % (heavy_mods,))
+        out = subprocess.check_output([sys.executable, "-c", code]).decode("utf-8")
+        lines = out.splitlines()
+        dur, loaded = float(lines[-2]), lines[-1]
+        logging.debug("Import of odemis.cli.main took %g s", dur)
+        self.assertEqual(loaded, "", "Heavy modules loaded: %s" % (loaded,))
+
+    def _acquire_burst_stalled(self, filename):
+        """
+        Run a burst acquisition with a detector stopping after 3 frames, and
+        check the frames received are still saved.
+        """
+        # A fake detector
+        det = mock.Mock()
+        det.exposureTime.value = 0.01
+        det.data = StallingDataFlow(3)
+        with mock.patch.object(main, "get_detector", return_value=det), \
+             mock.patch.object(main, "BURST_STALL_TIMEOUT", 0.5):
+            with self.assertRaises(IOError):
+                main.acquire_burst("Camera", "data", filename, 10)
+
+        data = dataio.find_fittest_converter(filename).read_data(filename)
+        self.assertEqual(len(data), 3)
+        for i, da in enumerate(data):
+            self.assertEqual(da.shape[-2:], (16, 32))
+            self.assertEqual(da.max(), i)
+        os.remove(filename)
+
+    def test_acquire_burst_stalled_tiff(self):
+        self._acquire_burst_stalled("burst-stalled.tiff")
+
+    def test_acquire_burst_stalled_h5(self):
+        self._acquire_burst_stalled("burst-stalled.h5")
+
 #@skip("Simple")
 class TestWithBackend(unittest.TestCase):
     backend_was_running = False
@@ -342,6 +408,23 @@ class TestWithBackend(unittest.TestCase):
         im = Image.open(picture_name)
         self.assertEqual(im.format, "TIFF")
         self.assertEqual(im.size, size)
-    
+
+    def test_acquire_burst(self):
+        nframes = 5
+        try:
+            cmdline = ["cli", "--acquire", "Camera", "--frames", "%d" % nframes,
+                       "--output=burst.tiff"]
+            ret = main.main(cmdline)
+        except SystemExit as exc:
+            ret = exc.code
+        self.assertEqual(ret, 0, "trying to run '%s'" % cmdline)
+
+        # All the frames in one file (as the camera is simulated, no frame is dropped)
+        im = Image.open("burst.tiff")
+        self.assertEqual(im.format, "TIFF")
+        self.assertEqual(im.n_frames, nframes)
+        im.close()
+        os.remove("burst.tiff")
+
 if __name__ == "__main__":
     unittest.main()
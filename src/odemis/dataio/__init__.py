@@ -26,9 +26,9 @@ from __future__ import division
 import importlib
 import logging
 import os
+import sys
 
 from ._base import *
-from odemis.dataio import tiff
 
 # The interface of a "format manager" is as follows:
 #  * one module
@@ -43,6 +43,17 @@ _iomodules = ["tiff", "stiff", "hdf5", "png", "csv", "catmaid"]
 __all__ = _iomodules + ["get_available_formats", "get_converter", "find_fittest_converter"]
 
 
+def __getattr__(name):
+    """
+    Load the format modules only when they are first accessed (eg, dataio.tiff),
+    as some of them depend on libraries which are slow to load.
+    Only used on Python 3.7+. On older versions, they are all loaded at init.
+    """
+    if name in _iomodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 def get_available_formats(mode=os.O_RDWR, allowlossy=False):
     """
     Find the available file formats
@@ -101,12 +112,13 @@ def get_converter(fmt):
     raise ValueError("No converter for format %s found" % fmt)
 
 
-def find_fittest_converter(filename, default=tiff, mode=os.O_WRONLY, allowlossy=False):
+def find_fittest_converter(filename, default="tiff", mode=os.O_WRONLY, allowlossy=False):
     """
     Find the most fitting exporter according to a filename (actually, its extension)
     filename (string): (path +) filename with extension
-    default (dataio. Module): default exporter to pick if no really fitting
-      exporter is found
+    default (dataio. Module, str or None): default exporter to pick if no really
+      fitting exporter is found. If it's a string, it's the name of the module
+      (eg, "tiff"), which is only loaded if needed.
     mode: cf get_available_formats()
     allowlossy: cf get_available_formats()
     returns (dataio. Module): the right exporter
@@ -143,7 +155,18 @@ def find_fittest_converter(filename, default=tiff, mode=os.O_WRONLY, allowlossy=
         logging.debug("Determined that '%s' corresponds to %s format",
                       basename, best_fmt)
         conv = get_converter(best_fmt)
+    elif isinstance(default, str):
+        conv = importlib.import_module("." + default, __name__)
     else:
         conv = default
 
     return conv
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__() is not supported => load all the format modules now
+    for _name in _iomodules:
+        try:
+            importlib.import_module("." + _name, __name__)
+        except Exception:
+            logging.info("Skipping format %s, which failed to load", _name)
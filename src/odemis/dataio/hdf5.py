@@ -1511,8 +1511,56 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     f.close()
 
 
+class SeriesWriter(object):
+    """
+    Writes a series of images to an HDF5 file, one image at a time, so that they
+    don't all need to be in memory simultaneously. Each image is stored as a
+    separate acquisition, so the file is the same as the one written by export()
+    with all the images, as long as they are not fluorescence images (which
+    export() would merge along C).
+    """
+
+    def __init__(self, filename, compressed=True):
+        """
+        filename (unicode): filename of the file to create (including path)
+        compressed (boolean): whether the file is compressed or not.
+        """
+        # h5py will extend the current file by default, so we want to make sure
+        # there is no file at all.
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        self._file = h5py.File(filename, "w")  # w will fail if file exists
+        self._compression = "gzip" if compressed else None
+        self._nacq = 0  # number of acquisitions written
+
+    def append(self, data):
+        """
+        Write an image as a new acquisition at the end of the file
+        data (model.DataArray): the image, 2D or more of int or float (as for
+          export())
+        """
+        data = _mergeCorrectionMetadata(data)
+        acq, mds = _groupImages([data])
+        ga = self._file.create_group("Acquisition%d" % self._nacq)
+        _add_acquistion_svi(ga, acq[0], mds[0], compression=self._compression)
+        self._nacq += 1
+        # Ensure the image is on the disk, so that it's not lost if the program stops
+        self._file.flush()
+
+    def close(self):
+        """
+        Close the file. No more image can be written afterwards.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
 # TODO: allow to append data to a file, or any other way to allow saving large
 # data without having everything in memory simultaneously.
+# (SeriesWriter allows to write the images one at a time.)
 def export(filename, data, thumbnail=None):
     '''
     Write an HDF5 file with the given image and metadata
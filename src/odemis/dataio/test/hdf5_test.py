@@ -102,6 +102,31 @@ class TestHDF5IO(unittest.TestCase):
 
         os.remove(fn)
 
+    def testSeriesWriter(self):
+        """
+        Write images one at a time, and check they are read back as if exported at once
+        """
+        size = (512, 256)
+        dtype = numpy.uint16
+        num = 3
+        writer = hdf5.SeriesWriter(FILENAME)
+        for i in range(num):
+            md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                  model.MD_POS: (1e-3, -30e-3),
+                  model.MD_ACQ_DATE: time.time() + i,
+                  model.MD_EXP_TIME: 0.1}
+            a = model.DataArray(numpy.full(size[::-1], i, dtype), md)
+            writer.append(a)
+        writer.close()
+
+        rdata = hdf5.read_data(FILENAME)
+        self.assertEqual(len(rdata), num)
+        for i, im in enumerate(rdata):
+            self.assertEqual(im.shape[-2:], size[::-1])
+            self.assertEqual(im.max(), i)
+            self.assertEqual(im.metadata[model.MD_PIXEL_SIZE], (1e-6, 1e-6))
+            self.assertEqual(im.metadata[model.MD_POS], (1e-3, -30e-3))
+
 #    @skip("Doesn't work")
     def testExportMultiPage(self):
         # create two greyscale images corresponding to two fluorescence images
@@ -1777,39 +1777,51 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
     # TODO: to keep the code simple, we should just first convert the DAs into
     # 2D or 3D DAs and put it in an dict original DA -> DAs
     for data in ldata:
-        # TODO: see if we need to set FILETYPE_PAGE + Page number for each image? data?
-        tags = _convertToTiffTag(data.metadata)
         if ometxt: # save OME tags if not yet done
             f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, ometxt)
             ometxt = None
+        _writeImagePages(f, data, compression, pyramid)
 
-        # if metadata indicates YXC format just handle it as RGB
-        if data.metadata.get(model.MD_DIMS) == 'YXC' and data.shape[-1] in (3, 4):
-            write_rgb = True
-            hdim = data.shape[:-3]
-        # TODO: handle RGB for C at any position before and after XY, but iif TZ=11
-        # for data > 2D: write as a sequence of 2D images or RGB images
-        elif data.ndim == 5 and data.shape[0] == 3:  # RGB
-            # Write an RGB image, instead of 3 images along C
-            write_rgb = True
-            hdim = data.shape[1:3]
-            data = numpy.rollaxis(data, 0, -2) # move C axis near YX
-        else:
-            write_rgb = False
-            hdim = data.shape[:-2]
 
-        for i in numpy.ndindex(*hdim):
-            # Save metadata (before the image)
-            for key, val in tags.items():
-                try:
-                    f.SetField(key, val)
-                except Exception:
-                    logging.exception("Failed to store tag %s with value '%s'", key, val)
-            if data[i].dtype in [numpy.int64, numpy.uint64]:
-                c = None # libtiff doesn't support compression on these types
-            else:
-                c = compression
-            write_image(f, data[i], write_rgb=write_rgb, compression=c, pyramid=pyramid)
+def _writeImagePages(f, data, compression=None, pyramid=False):
+    """
+    Write one DataArray as a sequence of TIFF pages (2D or RGB images), with
+    its metadata as TIFF tags.
+    f (libtiff file handle): Handle of a TIFF file
+    data (DataArray): the image to write, with dimensions ordered ...CTZYX
+    compression (None or str): Compression type to be used on the TIFF file
+    pyramid (boolean): whether the file should be saved in the pyramid format or not.
+    """
+    # TODO: see if we need to set FILETYPE_PAGE + Page number for each image? data?
+    tags = _convertToTiffTag(data.metadata)
+
+    # if metadata indicates YXC format just handle it as RGB
+    if data.metadata.get(model.MD_DIMS) == 'YXC' and data.shape[-1] in (3, 4):
+        write_rgb = True
+        hdim = data.shape[:-3]
+    # TODO: handle RGB for C at any position before and after XY, but iif TZ=11
+    # for data > 2D: write as a sequence of 2D images or RGB images
+    elif data.ndim == 5 and data.shape[0] == 3:  # RGB
+        # Write an RGB image, instead of 3 images along C
+        write_rgb = True
+        hdim = data.shape[1:3]
+        data = numpy.rollaxis(data, 0, -2) # move C axis near YX
+    else:
+        write_rgb = False
+        hdim = data.shape[:-2]
+
+    for i in numpy.ndindex(*hdim):
+        # Save metadata (before the image)
+        for key, val in tags.items():
+            try:
+                f.SetField(key, val)
+            except Exception:
+                logging.exception("Failed to store tag %s with value '%s'", key, val)
+        if data[i].dtype in [numpy.int64, numpy.uint64]:
+            c = None # libtiff doesn't support compression on these types
+        else:
+            c = compression
+        write_image(f, data[i], write_rgb=write_rgb, compression=c, pyramid=pyramid)
 
 
 def _genResizedShapes(data):
@@ -1914,6 +1926,65 @@ def export(filename, data, thumbnail=None, compressed=True, multiple_files=False
         _saveAsMultiTiffLT(filename, [data], thumbnail, compressed, pyramid=pyramid)
 
 
+class SeriesWriter(object):
+    """
+    Writes a series of images to a TIFF file, one image at a time, so that they
+    don't all need to be in memory simultaneously. The file is the same as the
+    one written by export() with all the images.
+    The OME-XML metadata, which describes all the images, is only known at the
+    end. So it's added to the first page when closing the file.
+    """
+
+    def __init__(self, filename, compressed=True):
+        """
+        filename (unicode): filename of the file to create (including path)
+        compressed (boolean): whether the file is compressed or not.
+        """
+        self._filename = filename
+        self._file = TIFF.open(filename, mode='w')
+        self._compression = "lzw" if compressed else None
+        # For each image written, a DataArray with the same shape and metadata,
+        # but without data, to generate the OME-XML
+        self._das = []
+
+    def append(self, data):
+        """
+        Write an image at the end of the file
+        data (model.DataArray): the image, with dimensions ordered ...CTZYX
+          (as for export())
+        """
+        data = _mergeCorrectionMetadata(data)
+        _writeImagePages(self._file, data, self._compression)
+        # Broadcasting a single value uses no memory
+        empty = numpy.broadcast_to(numpy.zeros((), dtype=data.dtype), data.shape)
+        self._das.append(model.DataArray(empty, data.metadata))
+
+    def close(self):
+        """
+        Write the OME-XML metadata, and close the file.
+        No more image can be written afterwards.
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if not self._das:
+            return
+
+        ometxt = _convertToOMEMD(self._das)
+        self._das = []
+        # Reopen the file, to update the description of the first page. The
+        # updated directory is written at the end of the file.
+        f = TIFF.open(self._filename, mode='r+')
+        try:
+            f.SetDirectory(0)
+            f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, ometxt)
+            if not T.libtiff.TIFFRewriteDirectory(f):
+                raise IOError("Failed to write the OME-XML metadata to %s" % (self._filename,))
+        finally:
+            f.close()
+
+
 def read_data(filename):
     """
     Read an TIFF file and return its content (skipping the thumbnail).
@@ -32,6 +32,7 @@ import numpy
 from odemis import model, util, dataio
 from odemis.model import HwError, oneway
 from odemis.util import img
+from odemis.util.driver import BufferPool
 import os
 import random
 import sys
@@ -740,6 +741,8 @@ class AndorCam2(model.DigitalCamera):
         self.acquisition_lock = threading.Lock()
         self.acquire_must_stop = threading.Event()
         self.acquire_thread = None
+        # Frame buffers, reused once the DataArrays on top of them are dropped
+        self._buffer_pool = BufferPool(max_buffers=8)
 
         # For temporary stopping the acquisition (kludge for the andorshrk
         # SR303i which cannot communicate during acquisition)
@@ -1858,8 +1861,8 @@ class AndorCam2(model.DigitalCamera):
         """
         returns a cbuffer of the right size for an image
         """
-        cbuffer = (c_uint16 * (size[0] * size[1]))() # empty array
-        return cbuffer
+        # Content is undefined, but it will be entirely overwritten by the SDK
+        return self._buffer_pool.get(c_uint16, size[0] * size[1])
 
     def _buffer_as_array(self, cbuffer, size, metadata=None):
         """
@@ -1867,8 +1870,9 @@ class AndorCam2(model.DigitalCamera):
         size (2-tuple of int): width, height
         return an ndarray
         """
-        p = cast(cbuffer, POINTER(c_uint16))
-        ndbuffer = numpy.ctypeslib.as_array(p, (size[1], size[0])) # numpy shape is H, W
+        # Note: no cast(), so that the buffer is not kept in a reference cycle,
+        # and can go back to the pool as soon as the DataArray is dropped.
+        ndbuffer = numpy.ctypeslib.as_array(cbuffer).reshape(size[1], size[0]) # numpy shape is H, W
         dataarray = model.DataArray(ndbuffer, metadata)
         return dataarray
 
@@ -2041,10 +2045,6 @@ class AndorCam2(model.DigitalCamera):
                 logging.debug("image acquired successfully after %g s", time.time() - tstart)
                 callback(self._transposeDAToUser(array))
                 del cbuffer, array
-
-                # force the GC to non-used buffers, for some reason, without this
-                # the GC runs only after we've managed to fill up the memory
-                gc.collect()
         except CancelledError:
             # received a must-stop event
             pass
@@ -2065,6 +2065,7 @@ class AndorCam2(model.DigitalCamera):
             if has_hw_lock:
                 self.hw_lock.release()
             self.atcore.FreeInternalMemory() # TODO not sure it's needed
+            self._buffer_pool.clear()
             self.acquisition_lock.release()
             gc.collect()
             # TODO: close the shutter if it was opened?
@@ -2179,10 +2180,6 @@ class AndorCam2(model.DigitalCamera):
                 logging.debug("image acquired successfully after %g s", time.time() - tstart)
                 callback(self._transposeDAToUser(array))
                 del cbuffer, array
-
-                # force the GC to non-used buffers, for some reason, without this
-                # the GC runs only after we've managed to fill up the memory
-                gc.collect()
         except CancelledError:
             # received a must-stop event
             pass
@@ -2201,6 +2198,7 @@ class AndorCam2(model.DigitalCamera):
                     self.acquire_must_stop.clear()
                     raise
             self.atcore.FreeInternalMemory() # TODO not sure it's needed
+            self._buffer_pool.clear()
             self.acquisition_lock.release()
             gc.collect()
             logging.debug("Acquisition thread closed")
@@ -2950,13 +2948,12 @@ class FakeAndorV2DLL(object):
         self.acq_aborted.set()
 
     def GetMostRecentImage16(self, cbuffer, size):
-        p = cast(cbuffer, POINTER(c_uint16))
         res = ((self.roi[1] - self.roi[0] + 1) // self.binning[0],
                (self.roi[3] - self.roi[2] + 1) // self.binning[1])
         if res[0] * res[1] != size.value:
             raise ValueError("res %s != size %d" % (res, size.value))
         # TODO: simulate binning by summing data and clipping
-        ndbuffer = numpy.ctypeslib.as_array(p, (res[1], res[0]))
+        ndbuffer = numpy.ctypeslib.as_array(cbuffer).reshape(res[1], res[0])
         ndbuffer[...] = self._data[self.roi[2] - 1:self.roi[3]:self.binning[1],
                                    self.roi[0] - 1:self.roi[1]:self.binning[0]]
 
@@ -37,6 +37,7 @@ import logging
 import numpy
 from odemis import model, util
 from odemis.model import HwError, oneway
+from odemis.util.driver import BufferPool
 import os
 import re
 import threading
@@ -377,6 +378,9 @@ class AndorCam3(model.DigitalCamera):
         self.acquisition_lock = threading.Lock()
         self.acquire_must_stop = threading.Event()
         self.acquire_thread = None
+        # Frame buffers, reused once the DataArrays on top of them are dropped
+        # (and not queued anymore in the SDK)
+        self._buffer_pool = BufferPool(max_buffers=16)
         # for synchronized acquisition
         self._got_event = threading.Event()
         self._late_events = collections.deque() # events which haven't been handled yet
@@ -1448,7 +1452,7 @@ class AndorCam3(model.DigitalCamera):
         # allocating directly a numpy array doesn't work if there is metadata:
         # ndbuffer = numpy.empty(shape=(stride / 2, size[1]), dtype="uint16")
         # cbuffer = numpy.ctypeslib.as_ctypes(ndbuffer)
-        cbuffer = (c_byte * image_size)() # empty array
+        cbuffer = self._buffer_pool.get(c_byte, image_size)
         assert(addressof(cbuffer) % 8 == 0) # the SDK wants it aligned
 
         return cbuffer
@@ -1473,8 +1477,10 @@ class AndorCam3(model.DigitalCamera):
             # SimCam doesn't support stride
             stride = self.GetInt(u"AOIWidth")
 
-        p = cast(cbuffer, POINTER(ityp))
-        ndbuffer = numpy.ctypeslib.as_array(p, (size[1], stride))  # numpy shape is H, W
+        # Note: no cast(), so that the buffer is not kept in a reference cycle,
+        # and can go back to the pool as soon as the DataArray is dropped.
+        ndbuffer = numpy.frombuffer(cbuffer, dtype=ityp, count=size[1] * stride)
+        ndbuffer.shape = (size[1], stride)  # numpy shape is H, W
         dataarray = model.DataArray(ndbuffer, metadata)
         # crop the array in case of stride (should not cause copy)
         return dataarray[:, :size[0]]
@@ -1680,6 +1686,7 @@ class AndorCam3(model.DigitalCamera):
                     self.Flush()
                 except ATError:
                     pass
+            self._buffer_pool.clear()
             self.acquisition_lock.release()
             gc.collect()
             logging.debug("Acquisition thread closed")
@@ -1698,8 +1705,8 @@ class AndorCam3(model.DigitalCamera):
             CancelledError: In case tha acquisition was cancelled
         """
         # We have (probably) time now, let's queue next buffer here
-        # Note we cannot reuse the buffer because we don't know if
-        # the callee still needs it or not
+        # Note the pool only gives back a buffer once the callee doesn't use
+        # it anymore
         logging.debug("Queuing a new buffer (queue len = %d)", len(buffers))
         cbuffer = self._allocate_buffer(size)
         self.QueueBuffer(cbuffer)
@@ -28,6 +28,7 @@ import time
 import socket
 import numpy
 import collections
+from concurrent import futures
 import numbers
 from odemis.util import to_str_escape
 
@@ -51,6 +52,11 @@ PARAM_TYPE_STRING = 3
 PARAM_TYPE_EXPTIME = 4
 PARAM_TYPE_DISPLAY = 5
 
+# Delays (in s) before retrying to start a synchronized acquisition, while the
+# previous one is still running. It's doubled at each retry, up to the maximum.
+SYNC_RETRY_DELAY_MIN = 1e-3
+SYNC_RETRY_DELAY_MAX = 0.1
+
 
 class RemoteExError(IOError):
 
@@ -393,6 +399,43 @@ class ReadoutCamera(model.DigitalCamera):
         self.queue_events.append(time.time())
         self.parent.queue_img.put("start")
 
+    def _startSyncAcquisition(self):
+        """
+        Start a synchronized acquisition, without waiting for the response of
+        RemoteEx, so that the image thread is immediately ready to receive the
+        image. If the acquisition fails to start, a message is sent to the image
+        thread: "busy" if an acquisition is still running, or "failed".
+        Note: the acquisition cannot be armed in advance, before the event. The
+        readout camera runs in "Internal timing" mode, so AcqStart("SingleLive")
+        immediately starts the exposure. Starting it before the event would
+        integrate the signal preceding the event (eg, from the previous e-beam
+        position). Pre-arming would require an external hardware trigger on the
+        readout camera (TriggerMode "Edge trigger"), which the software event
+        cannot provide. So the remaining latency is the time for RemoteEx to
+        start the exposure after receiving the command.
+        """
+        f = self.parent.sendCommandAsync("AcqStart", "SingleLive")  # should never be a different
+        f.add_done_callback(self._onSyncAcquisitionStarted)
+
+    def _onSyncAcquisitionStarted(self, f):
+        """
+        Called when the response to the AcqStart command of a synchronized
+        acquisition is received.
+        :parameter f: (Future) the AcqStart command
+        """
+        try:
+            f.result()
+        except RemoteExError as ex:
+            if ex.errno == 7:  # 7 = command already running
+                logging.debug("Asynchronous RemoteEx command still in process. Will try again.")
+                self.parent.queue_img.put("busy")
+            else:
+                logging.error("Failed to start synchronized acquisition: %s", ex)
+                self.parent.queue_img.put("failed")
+        except Exception as ex:
+            logging.error("Failed to start synchronized acquisition: %s", ex)
+            self.parent.queue_img.put("failed")
+
     # override
     def updateMetadata(self, md):
         """
@@ -430,26 +473,23 @@ class ReadoutCamera(model.DigitalCamera):
         time.sleep(1)  # TODO: why? => Document.
 
         is_receiving_image = False  # used during synchronised acquisition
+        acq_start_time = None  # time of the first attempt to start the current synchronised acquisition
+        retry_delay = SYNC_RETRY_DELAY_MIN  # delay before retrying to start the synchronised acquisition
 
         try:
             while True:
                 if self._sync_event and not is_receiving_image:
-                    timeout = 2
-                    start = time.time()
-                    while int(self.parent.AsyncCommandStatus()[0]):
-                        time.sleep(0)
-                        logging.debug("Asynchronous RemoteEx command still in process. Wait until finished.")
-                        if time.time() > start + timeout:  # most likely camera is in live-mode, so stop camera
-                            self.parent.AcqStop()
-                            start = time.time()
                     try:
                         event_time = self.queue_events.popleft()
-                        logging.warning("Starting acquisition delayed by %g s.", time.time() - event_time)
-                        self.parent.AcqStart("SingleLive")  # should never be a different
-                        is_receiving_image = True
                     except IndexError:
                         # No event (yet) => fine
                         pass
+                    else:
+                        logging.debug("Starting acquisition %g s after the event.", time.time() - event_time)
+                        acq_start_time = time.time()
+                        retry_delay = SYNC_RETRY_DELAY_MIN
+                        self._startSyncAcquisition()
+                        is_receiving_image = True
 
                 if self._sync_event:
                     timeout = max(self.exposureTime.value * 2, 1)  # wait at least 1s
@@ -459,8 +499,9 @@ class ReadoutCamera(model.DigitalCamera):
                 try:
                     rargs = self.parent.queue_img.get(block=True, timeout=timeout)  # block until receive something
                 except queue.Empty:
-                    logging.warning("Failed to receive image from streak ccd. Timed out after %f s. Will try again.",
-                                    timeout)
+                    if is_receiving_image:
+                        logging.warning("Failed to receive image from streak ccd. Timed out after %f s. "
+                                        "Will try again.", timeout)
                     is_receiving_image = False
                     continue
 
@@ -473,6 +514,23 @@ class ReadoutCamera(model.DigitalCamera):
                     if rargs == "start":
                         logging.info("Received event trigger")
                         continue
+                    elif rargs == "busy":
+                        # The previous acquisition is not yet finished => try again
+                        if time.time() > acq_start_time + 2:
+                            # most likely camera is in live-mode, so stop camera
+                            logging.debug("Acquisition still running after 2 s, will stop it.")
+                            self.parent.AcqStop()
+                            acq_start_time = time.time()
+                            retry_delay = SYNC_RETRY_DELAY_MIN
+                        else:
+                            # Wait longer at each retry, to not flood RemoteEx with commands
+                            time.sleep(retry_delay)
+                            retry_delay = min(retry_delay * 2, SYNC_RETRY_DELAY_MAX)
+                        self._startSyncAcquisition()
+                        continue
+                    elif rargs == "failed":
+                        is_receiving_image = False
+                        continue
                     else:
                         logging.info("Get the synchronized image.")
                 else:  # non-sync mode
@@ -488,6 +546,9 @@ class ReadoutCamera(model.DigitalCamera):
                 if rargs == "F":  # Flush => the previous images are from the previous acquisition
                     logging.debug("Acquisition was stopped so flush previous images.")
                     continue
+                elif isinstance(rargs, str):  # Message about a synchronized acquisition
+                    logging.debug("Skipping message %s, as not synchronized anymore.", rargs)
+                    continue
 
                 reception_time_image = time.time()
 
@@ -901,7 +962,12 @@ class StreakCamera(model.HwComponent):
         self.port = port
         self.port_d = port_d
 
+        # Lock to send the commands in the same order as they are queued
         self._lock_command = threading.Lock()
+        # Commands sent and waiting for a response: (lower case function name, Future)
+        # The responses arrive in the same order as the commands are sent.
+        self._pending_commands = collections.deque()
+        self._lock_pending = threading.Lock()
 
         # TODO start RemoteEx via SSH
         # or TODO autostart of RemoteEx when turning on hamamatsu pc?
@@ -914,8 +980,6 @@ class StreakCamera(model.HwComponent):
             logging.exception("Failed to initialise Hamamatsu readout camera.")
             raise
 
-        # collect responses (error_code = 0-3,6-10) from commandport
-        self.queue_command_responses = queue.Queue(maxsize=0)
         # save messages (error_code = 4,5) from commandport
         self.queue_img = queue.Queue(maxsize=0)
 
@@ -1046,7 +1110,7 @@ class StreakCamera(model.HwComponent):
 
     def sendCommand(self, func, *args, **kwargs):
         """
-        Sends a command to RemoteEx.
+        Sends a command to RemoteEx, and waits for its response.
         :parameter func: (str) command or function, which should be send to RemoteEx
         :parameter args: (str) optional parameters allowed for function
         :parameter kwargs: optional arguments not defined in advance
@@ -1060,10 +1124,46 @@ class StreakCamera(model.HwComponent):
         """
         # set timeout for waiting for command response
         timeout = kwargs.pop("timeout", 5)  # default = 5s
+        f = self.sendCommandAsync(func, *args)
+        try:
+            return f.result(timeout)
+        except futures.TimeoutError:
+            # Stop waiting for the response, so that it doesn't get matched with
+            # a later command.
+            # TODO: try to close/reopen the connection. However, not re-send
+            # the command as we don't know whether it was received, and
+            # whether it's safe to send twice the same command. So still
+            # report a timeout, but hopefully the next command works again.
+            self._discardPendingCommand(f)
+            raise util.TimeoutError("No answer received after %s s for command %s(%s)."
+                                    % (timeout, func, ",".join(args)))
+        except RemoteExError as ex:
+            logging.error(ex)
+            raise
+
+    def sendCommandAsync(self, func, *args):
+        """
+        Sends a command to RemoteEx, without waiting for its response. Multiple
+        commands can be pending at the same time, the receiver thread matches
+        each response to the oldest pending command with the same name.
+        :parameter func: (str) command or function, which should be send to RemoteEx
+        :parameter args: (str) optional parameters allowed for function
+        :return: (Future) its result is the list of str returned by the function.
+          It raises a RemoteExError if the command failed.
+        :raise:
+           HwError: if error communicating with the hardware, probably due to
+              the hardware not being in a good state (or connected)
+        """
         command = "%s(%s)\r" % (func, ",".join(args))
         command = command.encode("ascii")
+        f = futures.Future()
 
         with self._lock_command:  # lock this code, when finished lock is automatically released
+            # Register the command before sending it, so that the response can
+            # always be matched.
+            with self._lock_pending:
+                self._pending_commands.append((func.lower(), f))
+
             # send command to socket
             try:
                 logging.debug("Sending: '%s'", to_str_escape(command))
@@ -1073,58 +1173,75 @@ class StreakCamera(model.HwComponent):
                     logging.exception("Failed to send the command %s, will try to reconnect to RemoteEx."
                                       % to_str_escape(command))
                     self._commandport, self._dataport = self._openConnection()
+                    # The commands sent on the previous connection will never be answered
+                    self._failPendingCommands(IOError("Connection to RemoteEx lost"), keep=f)
                     # restart receiver thread, which keeps reading the commandport response continuously
                     self._start_receiverThread()
                     logging.debug("Sending: '%s'", to_str_escape(command))
                     self._commandport.send(command)
                 except (socket.error, socket.timeout) as err:
+                    self._discardPendingCommand(f)
                     raise model.HwError(err, "Could not connect to RemoteEx.")
 
-            latest_response = None  # None or tuple of str
-            while True:  # wait for correct response until Timeout
-                try:
-                    # if not receive something after timeout
-                    response = self.queue_command_responses.get(timeout=timeout)
-                except queue.Empty:
-                    if latest_response:
-                        # log the last error code received before timeout
-                        logging.error("Latest response before timeout was '%s'",
-                                      latest_response)
-                    # TODO: try to close/reopen the connection. However, not re-send
-                    # the command as we don't know whether it was received, and
-                    # whether it's safe to send twice the same command. So still
-                    # report a timeout, but hopefully the next command works again.
-                    raise util.TimeoutError("No answer received after %s s for command %s."
-                                            % (timeout, to_str_escape(command)))
-
-                # save the latest response in case we don't receive any other response before timeout
-                latest_response = response
-
-                # TODO: also check the timeout here, in case a lot of messages arrive, but never the right one.
-                try:
-                    error_code, rfunc, rargs = int(response[0]), response[1], response[2:]
-                except Exception as ex:
-                    raise IOError("Unexpected response %s: %s" % (response, ex))
-
-                # check if the response corresponds to the command sent before
-                # the response corresponding to a command always also includes the command name
-                if rfunc.lower() != func.lower():  # fct name not case sensitive
-                    logging.debug("Response not about function %s, will wait some more time.", func)
-                    continue  # continue listening to receive the correct response for the sent command or timeout
-
-                logging.debug("Interpreted response: %s.", response)
-                if error_code:  # != 0, response corresponds to command, but an error occurred
-                    logging.error(RemoteExError(error_code))
-                    raise RemoteExError(error_code)
-                else:  # successfully executed command and return message
-                    return rargs
+        return f
+
+    def _discardPendingCommand(self, f):
+        """
+        Stop waiting for the response of a command.
+        :parameter f: (Future) as returned by sendCommandAsync()
+        """
+        with self._lock_pending:
+            for i, (_, pf) in enumerate(self._pending_commands):
+                if pf is f:
+                    del self._pending_commands[i]
+                    break
+
+    def _failPendingCommands(self, ex, keep=None):
+        """
+        Report an error on all the commands waiting for a response.
+        :parameter ex: (Exception) the exception to pass to the commands
+        :parameter keep: (Future or None) command which should not be failed
+        """
+        with self._lock_pending:
+            pending = list(self._pending_commands)
+            self._pending_commands.clear()
+            for func, f in pending:
+                if f is keep:
+                    self._pending_commands.append((func, f))
+                else:
+                    f.set_exception(ex)
+
+    def _dispatchResponse(self, response):
+        """
+        Pass a response to the pending command it corresponds to.
+        :parameter response: (list of str) error code, function name, and returned values
+        """
+        error_code, rfunc, rargs = int(response[0]), response[1], response[2:]
+
+        # The response corresponding to a command always also includes the command name
+        # (not case sensitive)
+        rfunc = rfunc.lower()
+        with self._lock_pending:
+            for i, (func, f) in enumerate(self._pending_commands):
+                if func == rfunc:
+                    del self._pending_commands[i]
+                    break
+            else:
+                logging.debug("Response %s not about any pending command, will discard it.", response)
+                return
+
+        logging.debug("Interpreted response: %s.", response)
+        if error_code:  # != 0, response corresponds to command, but an error occurred
+            f.set_exception(RemoteExError(error_code))
+        else:  # successfully executed command and return message
+            f.set_result(rargs)
 
     def readCommandResponse(self):
         """
         This method runs in a separate thread and continuously listens for messages returned from
         the device via the commandport IP socket.
-        The messages are made available either on .queue_command_responses (for the standard responses)
-        or .queue_img (for messages related to the images).
+        The standard responses are passed to the command waiting for them, and
+        the messages related to the images are made available on .queue_img.
         """
         try:
             responses = b""  # received data not yet processed
@@ -1202,8 +1319,8 @@ class StreakCamera(model.HwComponent):
                             self.queue_img.put(rargs)
                         # Note: all other messages with error_code 4 or 5 are currently discarded
                         # as not of interest for now
-                    else:  # send response including error_code to queue
-                        self.queue_command_responses.put(msg_splitted)
+                    else:  # pass response to the corresponding command
+                        self._dispatchResponse(msg_splitted)
 
         except Exception:
             logging.exception("Hamamatsu streak camera TCP/IP receiver thread failed.")
@@ -24,7 +24,7 @@ import logging
 import math
 import numpy
 from odemis import model, util
-from odemis.model import HwError
+from odemis.model import HwError, oneway
 from odemis.util import TimeoutError
 import queue
 import random
@@ -79,6 +79,12 @@ PHR800LVMAX = 2400  # mV
 
 HOLDOFFMAX = 210480  # ns
 
+# T3 records format (cf ReadFiFo())
+T3HISTCHAN = 4096  # number of start-stop time bins (12 bits)
+T3WRAPAROUND = 65536  # the sync counter is 16 bits
+SPECIAL_CHANNEL = 15  # channel of the marker and overflow records
+TTTR_READ_COUNT = 32768  # number of records read at once from the FIFO (multiple of 512)
+
 
 class PHError(Exception):
     def __init__(self, errno, strerror, *args, **kwargs):
@@ -185,8 +191,10 @@ class PHDLL(CDLL):
 
 # Acquisition control messages
 GEN_START = "S"  # Start acquisition
+GEN_START_TTTR = "R"  # Start acquisition in T3 mode
 GEN_STOP = "E"  # Don't acquire image anymore
 GEN_TERM = "T"  # Stop the generator
+GEN_UNSYNC = "U"  # Synchronisation stopped
 
 
 class TerminationRequested(Exception):
@@ -257,7 +265,6 @@ class PH300(model.Detector):
 
         # TODO: metadata for indicating the range? cf WL_LIST?
 
-        # TODO: do we need TTTR mode?
         self.Initialise(MODE_HIST)
         self._swVersion = self.GetLibraryVersion()
         self._metadata[model.MD_SW_VERSION] = self._swVersion
@@ -320,6 +327,7 @@ class PH300(model.Detector):
         # Set the CFD parameters (in mV)
         for i, (dv, zc) in enumerate(zip(disc_volt, zero_cross)):
             self.SetInputCFD(i, int(dv * 1000), int(zc * 1000))
+        self._cfd = list(zip(disc_volt, zero_cross))  # to set them again when changing mode
 
         tresbase, bs = self.GetBaseResolution()
         tres = self.GetResolution()
@@ -341,7 +349,8 @@ class PH300(model.Detector):
         self._setSyncOffset(self.syncOffset.value)
 
         # Wrapper for the dataflow
-        self.data = BasicDataFlow(self)
+        self.data = PH300DataFlow(self)
+        self.softwareTrigger = model.Event()
         # Note: Apparently, the hardware supports reading the data, while it's
         # still accumulating (ie, the acquisition is still running).
         # We don't support this feature for now, and if the user needs to see
@@ -351,8 +360,16 @@ class PH300(model.Detector):
         # Alternatively, we could provide a second dataflow that sends the data
         # while it's building up.
 
+        # Histogram of each pixel of a scan, acquired in T3 mode (time-tagged).
+        # The pixels are delimited by the marker events, and sent in batches,
+        # as soon as they are complete.
+        # Note: it cannot be used simultaneously with .data.
+        self.tttr = TTTRDataFlow(self)
+
         # Queue to control the acquisition thread:
         self._genmsg = queue.Queue()
+        # Queue of all synchronization events received (typically max len 1)
+        self._old_triggers = []
         self._generator = threading.Thread(target=self._acquire,
                                            name="PicoHarp300 acquisition thread")
         self._generator.start()
@@ -575,6 +592,26 @@ class PH300(model.Detector):
         self._dll.PH_GetElapsedMeasTime(self._idx, byref(elapsed))
         return elapsed.value * 1e-3
 
+    def GetFlags(self):
+        """
+        return (int): the status flags (FLAG_*)
+        """
+        flags = c_int()
+        self._dll.PH_GetFlags(self._idx, byref(flags))
+        return flags.value
+
+    def SetMarkerEdges(self, edges):
+        """
+        edges (4 ints): for each marker input, 0 for falling edge, 1 for rising edge
+        """
+        self._dll.PH_SetMarkerEdges(self._idx, *edges)
+
+    def SetMarkerEnable(self, enable):
+        """
+        enable (4 bools): for each marker input, whether it's recorded
+        """
+        self._dll.PH_SetMarkerEnable(self._idx, *[int(e) for e in enable])
+
     def ReadFiFo(self, count):
         """
         Warning, the device must be initialised in a special mode (T2 or T3)
@@ -604,8 +641,29 @@ class PH300(model.Detector):
         self._dll.PH_ReadFiFo(self._idx, buf_ct, count, byref(nactual))
 
         # only return the values which were read
-        # TODO: if it's really smaller (eg, 0), copy the data to avoid holding all the mem
-        return buf[:nactual.value]
+        if nactual.value < count:
+            # copy the data to avoid holding all the memory
+            return buf[:nactual.value].copy()
+        return buf
+
+    def _set_mode(self, mode):
+        """
+        Initialise the device in the given measurement mode. As this resets
+        all the settings, they are set again afterwards.
+        mode (MODE_*)
+        """
+        self.Initialise(mode)
+        self.Calibrate()
+        self.SetOffset(0)
+        for i, (dv, zc) in enumerate(self._cfd):
+            self.SetInputCFD(i, int(dv * 1000), int(zc * 1000))
+        self._setPixelDuration(self.pixelDuration.value)
+        self._setSyncDiv(self.syncDiv.value)
+        self._setSyncOffset(self.syncOffset.value)
+        if mode in (MODE_T2, MODE_T3):
+            # The markers are used as pixel clock: record the rising edges
+            self.SetMarkerEdges((1, 1, 1, 1))
+            self.SetMarkerEnable((True, True, True, True))
 
     def _setPixelDuration(self, pxd):
         # TODO: delay until the end of an acquisition
@@ -637,7 +695,16 @@ class PH300(model.Detector):
 
     # Acquisition methods
     def start_generate(self):
-        self._genmsg.put(GEN_START)
+        self._start_acquisition(GEN_START)
+
+    def start_tttr(self):
+        self._start_acquisition(GEN_START_TTTR)
+
+    def _start_acquisition(self, msg):
+        """
+        msg (GEN_START or GEN_START_TTTR): the type of acquisition to start
+        """
+        self._genmsg.put(msg)
         if not self._generator.is_alive():
             logging.warning("Restarting acquisition thread")
             self._generator = threading.Thread(target=self._acquire,
@@ -647,43 +714,95 @@ class PH300(model.Detector):
     def stop_generate(self):
         self._genmsg.put(GEN_STOP)
 
+    def set_trigger(self, sync):
+        """
+        sync (bool): True if should be triggered
+        """
+        if sync:
+            logging.debug("Now set to software trigger")
+        else:
+            # Just to make sure to not wait forever for it
+            logging.debug("Sending unsynchronisation event")
+            self._genmsg.put(GEN_UNSYNC)
+
+    @oneway
+    def onEvent(self):
+        """
+        Called by the Event when it is triggered
+        """
+        self._genmsg.put(time.time())
+
+    # The histogram acquisition is based on a FSM that roughly looks like this:
+    # Event\State |   Stopped   |Ready for acq|  Acquiring |
+    #  START      |Ready for acq|     .       |     .      |
+    #  Trigger    |      .      | Acquiring   | (buffered) |
+    #  UNSYNC     |      .      | Acquiring   |     .      |
+    #  STOP       |      .      |  Stopped    | Stopped    |
+    #  TERM       |    Final    |   Final     |  Final     |
+    # If the acquisition is not synchronised, then the Trigger event in Ready for
+    # acq is considered as a "null" event: it's immediately switched to acquiring.
+    # The shutters are kept open and the histogram memory is cleared while
+    # ready for acq, so that each histogram starts immediately on the trigger.
+
     def _get_acq_msg(self, **kwargs):
         """
         Read one message from the acquisition queue
-        return (str): message
+        return (str or float): message
         raises queue.Empty: if no message on the queue
         """
         msg = self._genmsg.get(**kwargs)
-        if msg not in (GEN_START, GEN_STOP, GEN_TERM):
-            logging.warning("Acq received unexpected message %s", msg)
-        else:
+        if (msg in (GEN_START, GEN_START_TTTR, GEN_STOP, GEN_TERM, GEN_UNSYNC) or
+              isinstance(msg, float)):
             logging.debug("Acq received message %s", msg)
+        else:
+            logging.warning("Acq received unexpected message %s", msg)
         return msg
 
     def _acq_wait_start(self):
         """
         Blocks until the acquisition should start.
         Note: it expects that the acquisition is stopped.
+        return (GEN_START or GEN_START_TTTR): the type of acquisition to start
         raise TerminationRequested: if a terminate message was received
         """
         while True:
+            # Process all the messages already queued: only a later START/STOP
+            # supersedes a START, and the triggers are kept for the acquisition.
+            ctrl = None
             msg = self._get_acq_msg(block=True)
-            if msg == GEN_TERM:
-                raise TerminationRequested()
-
-            # Check if there are already more messages on the queue
-            try:
-                msg = self._get_acq_msg(block=False)
+            while True:
                 if msg == GEN_TERM:
                     raise TerminationRequested()
-            except queue.Empty:
-                pass
+                elif msg in (GEN_START, GEN_START_TTTR, GEN_STOP):
+                    ctrl = msg
+                else:
+                    self._acq_store_trigger(msg)
 
-            if msg == GEN_START:
-                return
+                try:
+                    msg = self._get_acq_msg(block=False)
+                except queue.Empty:
+                    break
+
+            if ctrl in (GEN_START, GEN_START_TTTR):
+                return ctrl
+
+            # Duplicate Stop
+            logging.debug("Skipped message %s as acquisition is stopped", ctrl)
 
-            # Duplicate Stop or trigger
-            logging.debug("Skipped message %s as acquisition is stopped", msg)
+    def _acq_store_trigger(self, msg):
+        """
+        Handle a trigger, or the end of the synchronisation, received while not
+        waiting for it.
+        msg (float or GEN_UNSYNC): the message
+        """
+        if isinstance(msg, float):  # trigger
+            # received trigger too early => store it for later
+            self._old_triggers.insert(0, msg)
+        elif msg == GEN_UNSYNC:
+            # Not synchronized anymore => the early triggers are not needed
+            self._old_triggers = []
+        else:
+            logging.warning("Skipped unexpected message %s", msg)
 
     def _acq_should_stop(self, timeout=None):
         """
@@ -702,10 +821,53 @@ class PH300(model.Detector):
                 return True
             elif msg == GEN_TERM:
                 raise TerminationRequested()
+            elif msg in (GEN_START, GEN_START_TTTR):
+                # Should not happen, as the dataflows refuse to subscribe while
+                # the other one is acquiring
+                logging.warning("Skipped message %s as acquisition is already running", msg)
+            else:
+                self._acq_store_trigger(msg)
         except queue.Empty:
             pass
         return False
 
+    def _acq_wait_trigger(self):
+        """
+        Block until a trigger is received, or a stop message.
+        Note: it expects that the acquisition is running.
+        If the acquisition is not synchronised, it will immediately return
+        return (bool): True if needs to stop, False if a trigger is received
+        raise TerminationRequested: if a terminate message was received
+        """
+        if not self.data._sync_event:
+            # No synchronisation -> just check it shouldn't stop
+            return self._acq_should_stop()
+
+        try:
+            # Already some trigger received before?
+            trigger = self._old_triggers.pop()
+            logging.debug("Using late trigger")
+        except IndexError:
+            # Let's really wait
+            while True:
+                msg = self._get_acq_msg(block=True)
+                if msg == GEN_TERM:
+                    raise TerminationRequested()
+                elif msg == GEN_STOP:
+                    return True
+                elif msg == GEN_UNSYNC or isinstance(msg, float):  # trigger
+                    trigger = msg
+                    break
+                else:  # Anything else shouldn't really happen
+                    logging.warning("Skipped message %s as acquisition is waiting for trigger", msg)
+
+        if trigger == GEN_UNSYNC:
+            logging.debug("End of synchronisation")
+            self._old_triggers = []
+        else:
+            logging.debug("Received trigger after %s s", time.time() - trigger)
+        return False
+
     def _acq_wait_data(self, exp_tend, timeout=0):
         """
         Block until a data is received, or a stop message.
@@ -729,7 +891,7 @@ class PH300(model.Detector):
                 return False
             now = time.time()
 
-        raise TimeoutError("Acquisition timeout after %g s")
+        raise TimeoutError("Acquisition timeout after %g s" % (timeout,))
 
     def _toggle_shutters(self, shutters, open):
         """
@@ -759,54 +921,18 @@ class PH300(model.Detector):
         Acquisition thread
         Managed via the .genmsg Queue
         """
-        # TODO: support synchronized acquisition, so that it's possible to acquire
-        #   one image at a time, without opening/closing the shutters in-between.
-        #   See avantes for an example.
         try:
             while True:
                 # Wait until we have a start (or terminate) message
-                self._acq_wait_start()
+                msg = self._acq_wait_start()
 
                 # Open protection shutters
                 self._toggle_shutters(self._shutters.keys(), True)
 
-                # Keep acquiring
-                while True:
-                    tacq = self.dwellTime.value
-                    tstart = time.time()
-
-                    # TODO: only allow to update the setting here (not during acq)
-                    md = self._metadata.copy()
-                    md[model.MD_ACQ_DATE] = tstart
-                    md[model.MD_DWELL_TIME] = tacq
-
-                    # check if any message received before starting again
-                    if self._acq_should_stop():
-                        break
-
-                    logging.debug("Starting new acquisition")
-                    self.ClearHistMem()
-                    self.StartMeas(int(tacq * 1e3))
-
-                    # Wait for the acquisition to be done or until a stop or
-                    # terminate message comes
-                    try:
-                        if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
-                            # Stop message received
-                            break
-                        logging.debug("Acq complete")
-                    except TimeoutError as ex:
-                        logging.error(ex)
-                        # TODO: try to reset the hardware?
-                        continue
-                    finally:
-                        # Must always be called, whether the measurement finished or not
-                        self.StopMeas()
-
-                    # Read data and pass it
-                    data = self.GetHistogram()
-                    da = model.DataArray(data, md)
-                    self.data.notify(da)
+                if msg == GEN_START_TTTR:
+                    self._acquire_tttr()
+                else:
+                    self._acquire_histograms()
 
                 logging.debug("Acquisition stopped")
                 self._toggle_shutters(self._shutters.keys(), False)
@@ -822,6 +948,126 @@ class PH300(model.Detector):
 
         logging.debug("Acquisition thread ended")
 
+    def _acquire_histograms(self):
+        """
+        Acquire one histogram per dwell time, until a stop message is received.
+        If the dataflow is synchronized, each histogram is started by a trigger.
+        raise TerminationRequested: if a terminate message was received
+        """
+        # Note: the triggers received before the start are kept, they are only
+        # discarded when the synchronisation is stopped.
+        while True:
+            # Get ready, so that the acquisition can start as soon as triggered
+            self.ClearHistMem()
+
+            # Wait for trigger (if synchronized), or check if any message
+            # received before starting again
+            if self._acq_wait_trigger():
+                return
+
+            tacq = self.dwellTime.value
+            tstart = time.time()
+            logging.debug("Starting new acquisition")
+            self.StartMeas(int(tacq * 1e3))
+
+            # TODO: only allow to update the setting here (not during acq)
+            md = self._metadata.copy()
+            md[model.MD_ACQ_DATE] = tstart
+            md[model.MD_DWELL_TIME] = tacq
+
+            # Wait for the acquisition to be done or until a stop or
+            # terminate message comes
+            try:
+                if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
+                    # Stop message received
+                    return
+                logging.debug("Acq complete")
+            except TimeoutError as ex:
+                logging.error(ex)
+                # TODO: try to reset the hardware?
+                continue
+            finally:
+                # Must always be called, whether the measurement finished or not
+                self.StopMeas()
+
+            # Read data and pass it
+            data = self.GetHistogram()
+            da = model.DataArray(data, md)
+            self.data.notify(da)
+
+    def _acquire_tttr(self):
+        """
+        Acquire continuously in T3 mode, until a stop message is received.
+        The FIFO is drained by a separate thread, while this thread decodes the
+        records and sends the histogram of each pixel, as soon as it is complete.
+        raise TerminationRequested: if a terminate message was received
+        """
+        try:
+            self._set_mode(MODE_T3)
+            md = self._metadata.copy()
+            md[model.MD_TIME_LIST] = (numpy.arange(T3HISTCHAN) * self.pixelDuration.value +
+                                      self.syncOffset.value)
+
+            records_q = queue.Queue()
+            stop = threading.Event()
+            reader = threading.Thread(target=self._read_fifo, args=(records_q, stop),
+                                      name="PicoHarp300 FIFO reader thread")
+            binner = T3PixelBinner()
+
+            logging.debug("Starting T3 acquisition")
+            self.StartMeas(ACQTMAX)
+            reader.start()
+            try:
+                while not self._acq_should_stop():
+                    try:
+                        records = records_q.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if isinstance(records, Exception):
+                        logging.error("Stopping T3 acquisition after failure: %s", records)
+                        return
+
+                    hists = binner.add(records)
+                    if hists.shape[0]:
+                        md[model.MD_ACQ_DATE] = time.time()
+                        self.tttr.notify(model.DataArray(hists, md.copy()))
+            finally:
+                stop.set()
+                reader.join(5)
+                if reader.is_alive():
+                    # Most likely blocked on the device: stopping the measurement
+                    # is the only way left to release it
+                    logging.error("FIFO reader thread still running after 5 s, "
+                                  "stopping the measurement anyway")
+                self.StopMeas()
+                reader.join(1)
+                if reader.is_alive():
+                    raise IOError("FIFO reader thread failed to stop")
+        finally:
+            self._set_mode(MODE_HIST)
+
+    def _read_fifo(self, records_q, stop):
+        """
+        FIFO reader thread. Continuously reads the records, so that the FIFO
+        never overflows, and passes them to the acquisition thread.
+        records_q (Queue): receives the arrays of records, or the exception
+          which stopped the reading
+        stop (threading.Event): set to request the reading to stop
+        """
+        try:
+            while not stop.is_set():
+                with self._hw_access:
+                    if self.GetFlags() & FLAG_FIFOFULL:
+                        raise IOError("FIFO overrun, some records have been lost")
+                    records = self.ReadFiFo(TTTR_READ_COUNT)
+                if records.size:
+                    records_q.put(records)
+                else:
+                    time.sleep(1e-3)
+        except Exception as ex:
+            logging.exception("Failure while reading the FIFO")
+            records_q.put(ex)
+
     @classmethod
     def scan(cls):
         """
@@ -909,6 +1155,88 @@ class PH300RawDetector(model.Detector):
         self.data.notify(img)
 
 
+def decode_t3_records(records, ofl_offset=0):
+    """
+    Decode the records of a PicoHarp 300 in T3 mode.
+    Each record is 32 bits: 4 bits for the channel, 12 bits for the start-stop
+    time and 16 bits for the sync counter. The special records (channel 15)
+    contain either the marker bits in the lower 4 bits of the start-stop time,
+    or nothing, in which case they indicate an overflow of the sync counter.
+    records (ndarray of uint32): records as read from the FIFO
+    ofl_offset (0<=int): value to add to the sync counter, due to the
+      overflows in the previous records
+    return:
+      channel (ndarray of uint8): channel of each record
+      dtime (ndarray of uint16): start-stop time of each record (in bins)
+      nsync (ndarray of uint64): sync counter of each record, including the overflows
+      markers (ndarray of uint8): marker bits of each record (0 if not a marker)
+      ofl_offset (int): value to pass for decoding the next records
+    """
+    records = numpy.asarray(records, dtype=numpy.uint32)
+    channel = (records >> 28).astype(numpy.uint8)
+    dtime = ((records >> 16) & 0xfff).astype(numpy.uint16)
+    nsync = (records & 0xffff).astype(numpy.uint64)
+
+    special = (channel == SPECIAL_CHANNEL)
+    markers = numpy.where(special, dtime & 0xf, 0).astype(numpy.uint8)
+    overflow = special & (markers == 0)
+    novfl = numpy.cumsum(overflow, dtype=numpy.uint64)
+    nsync += novfl * T3WRAPAROUND + ofl_offset
+
+    if novfl.size:
+        ofl_offset += int(novfl[-1]) * T3WRAPAROUND
+    return channel, dtime, nsync, markers, ofl_offset
+
+
+class T3PixelBinner(object):
+    """
+    Sorts the photons of a stream of T3 records into one start-stop time
+    histogram per pixel. Each marker indicates the boundary between two pixels.
+    So the first pixel starts at the first marker (the photons before are
+    discarded), and a pixel is complete when the next marker is received.
+    """
+
+    def __init__(self, nbins=T3HISTCHAN):
+        """
+        nbins (0<int): number of bins of the histogram
+        """
+        self._nbins = nbins
+        self._ofl_offset = 0
+        self._started = False  # True once the first marker has been received
+        # Histogram of the current (incomplete) pixel
+        self._current = numpy.zeros(nbins, dtype=numpy.uint32)
+
+    def add(self, records):
+        """
+        Process new records
+        records (ndarray of uint32): the next records, as read from the FIFO
+        return (ndarray of uint32 of shape N, nbins): the histograms of the
+          pixels completed by these records (N can be 0)
+        """
+        channel, dtime, _, markers, self._ofl_offset = decode_t3_records(records, self._ofl_offset)
+        is_marker = (markers != 0)
+
+        if not self._started:
+            first_marker = numpy.flatnonzero(is_marker)
+            if not first_marker.size:
+                return numpy.empty((0, self._nbins), dtype=numpy.uint32)
+            self._started = True
+            s = first_marker[0] + 1
+            channel, dtime, is_marker = channel[s:], dtime[s:], is_marker[s:]
+
+        # Index of the pixel of each record, 0 being the current pixel
+        pxi = numpy.cumsum(is_marker)
+        npix = int(pxi[-1]) if pxi.size else 0
+        photons = (channel != SPECIAL_CHANNEL)
+        dtime = numpy.minimum(dtime[photons], self._nbins - 1)
+        counts = numpy.bincount(pxi[photons] * self._nbins + dtime,
+                                minlength=(npix + 1) * self._nbins)
+        hists = counts.reshape(npix + 1, self._nbins).astype(numpy.uint32)
+        hists[0] += self._current
+        self._current = hists[-1].copy()
+        return hists[:-1]
+
+
 class BasicDataFlow(model.DataFlow):
     def __init__(self, detector):
         """
@@ -925,6 +1253,75 @@ class BasicDataFlow(model.DataFlow):
         self._detector.stop_generate()
 
 
+class PH300DataFlow(BasicDataFlow):
+    """
+    Dataflow of the histograms, which can be synchronized on an Event
+    """
+
+    def __init__(self, detector):
+        """
+        detector (PH300): the detector that the dataflow corresponds to
+        """
+        BasicDataFlow.__init__(self, detector)
+        self._sync_event = None  # synchronization Event
+        self._prev_max_discard = self._max_discard
+
+    def subscribe(self, listener):
+        # The device cannot acquire histograms and T3 records at the same time
+        if self._detector.tttr._count_listeners():
+            raise IOError("Cannot acquire histograms while the TTTR acquisition is running")
+        BasicDataFlow.subscribe(self, listener)
+
+    def synchronizedOn(self, event):
+        """
+        Synchronize the acquisition on the given event. Every time the event is
+          triggered, the DataFlow will start a new acquisition. The shutters
+          stay open in-between.
+        event (model.Event or None): event to synchronize with. Use None to
+          disable synchronization.
+        The DataFlow can be synchronized only with one Event at a time.
+        """
+        if self._sync_event == event:
+            return
+
+        if self._sync_event:
+            self._sync_event.unsubscribe(self._detector)
+            self.max_discard = self._prev_max_discard
+
+        self._sync_event = event
+        if self._sync_event:
+            # if the df is synchronized, the subscribers probably don't want to
+            # skip some data
+            self._prev_max_discard = self._max_discard
+            self.max_discard = 0
+            self._detector.set_trigger(True)
+            self._sync_event.subscribe(self._detector)
+        else:
+            self._detector.set_trigger(False)
+
+
+class TTTRDataFlow(model.DataFlow):
+    def __init__(self, detector):
+        """
+        detector (PH300): the detector that the dataflow corresponds to
+        """
+        model.DataFlow.__init__(self)
+        self._detector = detector
+
+    def subscribe(self, listener):
+        # The device cannot acquire histograms and T3 records at the same time
+        if self._detector.data._count_listeners():
+            raise IOError("Cannot start the TTTR acquisition while histograms are acquired")
+        model.DataFlow.subscribe(self, listener)
+
+    # start/stop_generate are _never_ called simultaneously (thread-safe)
+    def start_generate(self):
+        self._detector.start_tttr()
+
+    def stop_generate(self):
+        self._detector.stop_generate()
+
+
 # Only for testing/simulation purpose
 # Very rough version that is just enough so that if the wrapper behaves correctly,
 # it returns the expected values.
@@ -955,6 +1352,13 @@ def _val(obj):
         return obj
 
 
+# Simulated signals in T3 mode
+FAKE_SYNC_RATE = 40e6  # Hz, before the sync divider
+FAKE_PHOTON_RATE = 200e3  # photons/s
+FAKE_MARKER_PERIOD = 1e-3  # s, period of the (pixel clock) markers
+FAKE_DECAY = 500  # bins, decay constant of the start-stop time
+
+
 class FakePHDLL(object):
     """
     Fake PHDLL. It basically simulates one connected device, which returns
@@ -974,6 +1378,11 @@ class FakePHDLL(object):
         self._acq_end = None
         self._last_acq_dur = None  # s
 
+        # T3 mode: sync count up to which the records have been generated,
+        # and the records not yet read
+        self._t3_nsync = 0
+        self._fifo = numpy.empty((0,), dtype=numpy.uint32)
+
     def PH_OpenDevice(self, i, sn_str):
         if i == self._idx:
             sn_str.value = self._sn
@@ -1043,6 +1452,8 @@ class FakePHDLL(object):
             raise PHError(-16, PHDLL.err_code[-16])
         self._acq_start = time.time()
         self._acq_end = self._acq_start + _val(tacq) * 1e-3
+        self._t3_nsync = 0
+        self._fifo = numpy.empty((0,), dtype=numpy.uint32)
 
     def PH_StopMeas(self, i):
         if self._acq_start is not None:
@@ -1081,3 +1492,66 @@ class FakePHDLL(object):
 
         # Old numpy doesn't support dtype argument for randint
         ndbuffer[...] = numpy.random.randint(0, maxval + 1, HISTCHAN).astype(numpy.uint32)
+
+    def PH_GetFlags(self, i, p_flags):
+        flags = _deref(p_flags, c_int)
+        flags.value = 0
+
+    def PH_SetMarkerEdges(self, i, me0, me1, me2, me3):
+        return
+
+    def PH_SetMarkerEnable(self, i, en0, en1, en2, en3):
+        return
+
+    def PH_ReadFiFo(self, i, p_buffer, count, p_nactual):
+        if self._mode != MODE_T3:  # T2 mode is not simulated
+            raise PHError(-18, PHDLL.err_code[-18])  # ERROR_INVALID_MODE
+        nactual = _deref(p_nactual, c_int)
+        count = _val(count)
+
+        if self._acq_start is not None:
+            self._generate_t3_records(min(time.time(), self._acq_end))
+
+        n = min(count, self._fifo.size)
+        p = cast(p_buffer, POINTER(c_uint32))
+        ndbuffer = numpy.ctypeslib.as_array(p, (count,))
+        ndbuffer[:n] = self._fifo[:n]
+        self._fifo = self._fifo[n:]
+        nactual.value = n
+
+    def _generate_t3_records(self, now):
+        """
+        Add to the FIFO the records of the events which happened since the
+        last call: photons at random times, markers at a fixed period, and the
+        sync counter overflows.
+        now (float): time up to which to generate the events
+        """
+        sync_rate = FAKE_SYNC_RATE / max(1, self._syncdiv)
+        start = self._t3_nsync
+        end = int((now - self._acq_start) * sync_rate)
+        if end <= start:
+            return
+        self._t3_nsync = end
+
+        nph = numpy.random.poisson(FAKE_PHOTON_RATE * (end - start) / sync_rate)
+        ph_sync = start + (numpy.random.random(nph) * (end - start)).astype(numpy.int64)
+        ph_dtime = numpy.minimum(numpy.random.exponential(FAKE_DECAY, nph), T3HISTCHAN - 1).astype(numpy.int64)
+
+        mk_period = max(1, int(FAKE_MARKER_PERIOD * sync_rate))
+        mk_sync = numpy.arange(-(-start // mk_period) * mk_period, end, mk_period, dtype=numpy.int64)
+        # No overflow at the very beginning
+        ofl_start = max(1, -(-start // T3WRAPAROUND)) * T3WRAPAROUND
+        ofl_sync = numpy.arange(ofl_start, end, T3WRAPAROUND, dtype=numpy.int64)
+
+        sync = numpy.concatenate([ofl_sync, mk_sync, ph_sync])
+        # At the same sync count, the overflow comes first
+        kind = numpy.concatenate([numpy.zeros(ofl_sync.size, dtype=numpy.int64),
+                                  numpy.ones(mk_sync.size, dtype=numpy.int64),
+                                  numpy.full(nph, 2, dtype=numpy.int64)])
+        records = numpy.concatenate([
+            numpy.full(ofl_sync.size, SPECIAL_CHANNEL << 28, dtype=numpy.int64),
+            (SPECIAL_CHANNEL << 28) | (1 << 16) | (mk_sync % T3WRAPAROUND),
+            (1 << 28) | (ph_dtime << 16) | (ph_sync % T3WRAPAROUND),
+        ])
+        order = numpy.lexsort((kind, sync))
+        self._fifo = numpy.concatenate([self._fifo, records[order].astype(numpy.uint32)])
@@ -241,10 +241,17 @@ class Camera(model.DigitalCamera):
         """
         timer = self._generator  # might be replaced by None afterwards, so keep a copy
         gen_img = self._simulate()
-        self.data._waitSync()
+        evt_time = self.data._waitSync()
         if self.data._sync_event:
-            # If sync event, we need to simulate period after event (not efficient, but works)
-            time.sleep(self.exposureTime.value)
+            if evt_time is None:
+                # Acquisition stopped while waiting for the event => no frame
+                logging.debug("Synchronization stopped, not generating any image")
+                return
+            # If sync event, we need to simulate period after event (not efficient, but works).
+            # The exposure starts when the event is received, so if events were
+            # queued during the previous frame (eg, hardware triggers in a burst),
+            # it doesn't add up more delay than necessary.
+            time.sleep(max(0, evt_time + self.exposureTime.value - time.time()))
 
         metadata = gen_img.metadata.copy()  # MD of image
         metadata.update(self._metadata)  # MD of camera
@@ -383,6 +390,14 @@ class SimpleDataFlow(model.DataFlow):
         self._evtq = None  # a Queue to store received events (= float, time of the event)
 
     def start_generate(self):
+        if self._sync_event:
+            # Drop the events received while not acquiring (and the None put
+            # when stopping), so that each frame corresponds to a new event.
+            while True:
+                try:
+                    self._evtq.get(block=False)
+                except queue.Empty:
+                    break
         self._ccd._start_generate()
 
     def stop_generate(self):
@@ -419,7 +434,10 @@ class SimpleDataFlow(model.DataFlow):
         Block until the Event on which the dataflow is synchronised has been
           received. If the DataFlow is not synchronised on any event, this
           method immediatly returns
+        return (None or float): time the event was received, or None if not
+          synchronised (or the synchronisation was stopped)
         """
         if self._sync_event:
-            self._evtq.get()
+            return self._evtq.get()
+        return None
 
@@ -202,6 +202,23 @@ class Scanner(model.Emitter):
 
         self.dwellTime = model.FloatContinuous(1e-06, (1e-06, 1000), unit="s")
 
+        # List of positions (in px, same as .translation) to scan one after
+        # another (aka vector scan), instead of scanning once at .translation.
+        # Each position is scanned with the current resolution, scale and
+        # dwell time, and generates its own image. Empty list means standard
+        # scan.
+        self.scanPath = model.ListVA([], unit="px", setter=self._setScanPath)
+
+        # Event to allow another component to synchronize on the beginning of
+        # each position of the scan path. (Only sent during a vector scan)
+        self.newPosition = model.Event()
+        # The detectors all scan the path, but the event must be sent only once
+        # per position: the first detector reaching a position notifies it.
+        self._path_lock = threading.Lock()
+        self._path_id = 0  # incremented each time a new scan of the path starts
+        self._path_detectors = set()  # detectors currently scanning the path
+        self._path_notified = (0, 0)  # path id, number of positions notified
+
         # VAs to control the ebeam, purely fake
         self.probeCurrent = model.FloatEnumerated(1.3e-9,
                           {0.1e-9, 1.3e-9, 2.6e-9, 3.4e-9, 11.564e-9, 23e-9},
@@ -309,6 +326,52 @@ class Scanner(model.Emitter):
                 max(min(value[1], max_tran[1]), -max_tran[1]))
         return tran
 
+    def _setScanPath(self, value):
+        """
+        value (list of (float, float)): positions to scan, as translations.
+          Each position is clipped to the area reachable with the current
+          resolution and scale.
+        returns actual path accepted
+        """
+        return [self._setTranslation(tuple(p)) for p in value]
+
+    def _startPath(self, detector):
+        """
+        Indicates a detector starts scanning the scan path. If no other detector
+        is already scanning it, it's a new scan.
+        detector (Detector): the detector starting
+        returns (int): identifier of the scan of the path
+        """
+        with self._path_lock:
+            if not self._path_detectors:
+                self._path_id += 1
+            self._path_detectors.add(detector)
+            return self._path_id
+
+    def _stopPath(self, detector):
+        """
+        Indicates a detector has stopped scanning the scan path.
+        detector (Detector): the detector stopping
+        """
+        with self._path_lock:
+            self._path_detectors.discard(detector)
+
+    def _notifyPosition(self, path_id, i):
+        """
+        Notify the .newPosition Event for the given position of the scan path,
+        unless it has already been done (by another detector).
+        path_id (int): identifier of the scan, as returned by _startPath()
+        i (int): index of the position in the path
+        """
+        with self._path_lock:
+            pid, n = self._path_notified
+            if pid != path_id:
+                n = 0
+            if i < n:
+                return  # Already notified
+            self._path_notified = (path_id, i + 1)
+        self.newPosition.notify()
+
     def pixelToPhy(self, px_pos):
         """
         Converts a position in pixels to physical (at the current magnification)
@@ -428,10 +491,12 @@ class Detector(model.Detector):
 
         self.current_drift = drift
 
-    def _simulate_image(self):
+    def _simulate_image(self, trans=None):
         """
         Generates the fake output based on the translation, resolution and
         current drift.
+        trans (None or (float, float)): position to scan (in px). If None, the
+          scanner .translation is used.
         """
         metadata = self.parent._metadata.copy()
         scanner = self.parent._scanner
@@ -442,7 +507,7 @@ class Detector(model.Detector):
             logging.debug("Simulating an image")
             pxs = scanner.pixelSize.value  # m/px
 
-            pxs_pos = scanner.translation.value
+            pxs_pos = scanner.translation.value if trans is None else trans
             scale = scanner.scale.value
             res = scanner.resolution.value
             shi = scanner.shift.value
@@ -519,6 +584,19 @@ class Detector(model.Detector):
                 dwelltime = self.parent._scanner.dwellTime.value
                 resolution = self.parent._scanner.resolution.value
                 duration = numpy.prod(resolution) * dwelltime
+                path = list(self.parent._scanner.scanPath.value)
+                if path:
+                    path_id = self.parent._scanner._startPath(self)
+                    try:
+                        self.data._waitSync()
+                        self._scan_path(path_id, path, duration, callback)
+                        # The path is scanned only once, then the e-beam waits
+                        # until the acquisition is stopped
+                        self._acquisition_must_stop.wait()
+                    finally:
+                        self.parent._scanner._stopPath(self)
+                    break
+
                 if self._acquisition_must_stop.wait(duration):
                     break
                 # TODO: it's not a very proper simulation for multiple detectors,
@@ -533,6 +611,28 @@ class Detector(model.Detector):
             self._acquisition_must_stop.clear()
 
 
+    def _scan_path(self, path_id, path, duration, callback):
+        """
+        Simulates a vector scan: the positions of the path are scanned one after
+        another, and the scanner .newPosition is notified at the beginning of
+        each of them. With several detectors, it's notified only once per position.
+        path_id (int): identifier of the scan, as returned by scanner._startPath()
+        path (list of (float, float)): the translations to scan (in px)
+        duration (0 < float): time spent at each position (in s)
+        callback (callable): called with the data of each position
+        """
+        scanner = self.parent._scanner
+        tstart = time.time()
+        for i, trans in enumerate(path):
+            scanner._notifyPosition(path_id, i)
+            # The end of each position is computed from the beginning of the
+            # scan, so that the delays do not accumulate.
+            tend = tstart + (i + 1) * duration
+            if self._acquisition_must_stop.wait(max(0, tend - time.time())):
+                return
+            callback(self._simulate_image(trans))
+
+
 class SEMDataFlow(model.DataFlow):
     """
     This is an extension of model.DataFlow. It receives notifications from the
@@ -18,11 +18,16 @@ You should have received a copy of the GNU General Public License along with Ode
 
 from __future__ import division
 
+import collections
+from concurrent import futures
 import logging
 import os
+import queue
+import socket
 
 from odemis import model, util
 from odemis.driver import hamamatsurx
+import threading
 import time
 from odemis.driver import andorshrk
 
@@ -172,6 +177,20 @@ class TestHamamatsurxCam(unittest.TestCase):
         msg = self.streakcam.sendCommand("Appinfo", "type")
         self.assertEqual(msg, ["HPDTA"])
 
+    def test_SendCommandPipelined(self):
+        """Send multiple commands without waiting for the responses."""
+        fs = [self.streakcam.sendCommandAsync("Appinfo", "type") for i in range(5)]
+        fs.append(self.streakcam.sendCommandAsync("AsyncCommandStatus"))
+        for f in fs[:-1]:
+            self.assertEqual(f.result(5), ["HPDTA"])
+        self.assertEqual(len(fs[-1].result(5)), 4)
+
+        # Commands sent from multiple threads
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            fs = [executor.submit(self.streakcam.sendCommand, "Appinfo", "type") for i in range(10)]
+            for f in fs:
+                self.assertEqual(f.result(), ["HPDTA"])
+
     ### Readout camera #####################################################
     # resolution, binning VA tested in cam_test_abs
     def test_ExposureTime(self):
@@ -723,5 +742,181 @@ class TestHamamatsurxCamWithSpectrograph(unittest.TestCase):
         self.assertEqual(self.spectrograph.position.value["grating"], pos_grating)
 
 
+class TestHamamatsurxResponses(unittest.TestCase):
+    """
+    Test the matching of the RemoteEx responses to the pending commands.
+    No hardware needed: the methods are called directly.
+    """
+
+    def setUp(self):
+        # Only the attributes used for matching the responses
+        self.streakcam = CLASS_STREAKCAM.__new__(CLASS_STREAKCAM)
+        self.streakcam._pending_commands = collections.deque()
+        self.streakcam._lock_pending = threading.Lock()
+
+    def _addCommand(self, func):
+        f = futures.Future()
+        self.streakcam._pending_commands.append((func.lower(), f))
+        return f
+
+    def test_dispatch(self):
+        """Each response goes to the oldest pending command of the same name"""
+        f1 = self._addCommand("Appinfo")
+        f2 = self._addCommand("AsyncCommandStatus")
+        f3 = self._addCommand("Appinfo")
+
+        self.streakcam._dispatchResponse(["0", "AsyncCommandStatus", "0", "0", "0", "0"])
+        self.assertEqual(f2.result(0), ["0", "0", "0", "0"])
+        self.assertFalse(f1.done())
+
+        # Response name is not case sensitive
+        self.streakcam._dispatchResponse(["0", "appinfo", "HPDTA"])
+        self.assertEqual(f1.result(0), ["HPDTA"])
+        self.assertFalse(f3.done())
+
+        # Error => exception on the command
+        self.streakcam._dispatchResponse(["7", "Appinfo"])
+        with self.assertRaises(hamamatsurx.RemoteExError) as cm:
+            f3.result(0)
+        self.assertEqual(cm.exception.errno, 7)
+        self.assertEqual(len(self.streakcam._pending_commands), 0)
+
+        # Response to no command => discarded
+        self.streakcam._dispatchResponse(["0", "Appinfo", "HPDTA"])
+        self.assertEqual(len(self.streakcam._pending_commands), 0)
+
+    def test_discard(self):
+        """A discarded command doesn't get the response of a later command"""
+        f1 = self._addCommand("Appinfo")
+        f2 = self._addCommand("Appinfo")
+        self.streakcam._discardPendingCommand(f1)
+        self.streakcam._dispatchResponse(["0", "Appinfo", "HPDTA"])
+        self.assertFalse(f1.done())
+        self.assertEqual(f2.result(0), ["HPDTA"])
+
+    def test_fail(self):
+        """All the pending commands fail, apart from the one to keep"""
+        f1 = self._addCommand("Appinfo")
+        f2 = self._addCommand("AcqStart")
+        f3 = self._addCommand("Appinfo")
+        self.streakcam._failPendingCommands(IOError("Connection lost"), keep=f3)
+        for f in (f1, f2):
+            with self.assertRaises(IOError):
+                f.result(0)
+        self.assertFalse(f3.done())
+
+        self.streakcam._dispatchResponse(["0", "Appinfo", "HPDTA"])
+        self.assertEqual(f3.result(0), ["HPDTA"])
+
+
+# Time the RemoteEx stand-in takes to answer each command
+REMOTEEX_RESPONSE_DELAY = 0.2  # s
+
+
+class FakeRemoteEx(object):
+    """
+    Minimal TCP stand-in for the RemoteEx command port: answers every command
+    in order, after a delay, as RemoteEx processes one command at a time.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.errors = {}  # command name -> error code to return
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(1)
+        self.address = self._server.getsockname()
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name="Fake RemoteEx")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        self._conn, _ = self._server.accept()
+        received = b""
+        while True:
+            try:
+                data = self._conn.recv(4096)
+            except socket.error:
+                return
+            if not data:
+                return
+            received += data
+            cmds = received.split(b"\r")
+            cmds, received = cmds[:-1], cmds[-1]
+            for cmd in cmds:
+                func = cmd.split(b"(")[0].decode("ascii")
+                time.sleep(self.delay)
+                code = self.errors.get(func, 0)
+                self._conn.sendall(b"%d,%s\r" % (code, func.encode("ascii")))
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+        self._server.close()
+
+
+class TestHamamatsurxDeadTime(unittest.TestCase):
+    """
+    Measure the time the image thread is blocked when starting a synchronized
+    acquisition, with a TCP stand-in of RemoteEx. No hardware needed.
+    """
+
+    def setUp(self):
+        self.remoteex = FakeRemoteEx(REMOTEEX_RESPONSE_DELAY)
+        # Only the attributes used for sending commands and reading the responses
+        self.streakcam = CLASS_STREAKCAM.__new__(CLASS_STREAKCAM)
+        self.streakcam._commandport = socket.create_connection(self.remoteex.address, timeout=5)
+        self.streakcam._commandport.settimeout(1.0)
+        self.streakcam._pending_commands = collections.deque()
+        self.streakcam._lock_pending = threading.Lock()
+        self.streakcam._lock_command = threading.Lock()
+        self.streakcam._getReadoutCamInfo = False
+        self.streakcam.queue_img = queue.Queue()
+        self.streakcam.should_listen = True
+        self.streakcam._start_receiverThread()
+
+        self.readoutcam = hamamatsurx.ReadoutCamera.__new__(hamamatsurx.ReadoutCamera)
+        self.readoutcam._parent = None
+        self.readoutcam.parent = self.streakcam
+
+    def tearDown(self):
+        self.streakcam.should_listen = False
+        self.streakcam.t_receiver.join(5)
+        self.streakcam._commandport.close()
+        self.remoteex.close()
+
+    def test_start_latency(self):
+        """Starting a sync acquisition doesn't wait for RemoteEx to answer"""
+        # Previous behaviour: wait for the response of AcqStart
+        tstart = time.time()
+        self.streakcam.sendCommand("AcqStart", "SingleLive")
+        dt_blocking = time.time() - tstart
+
+        tstart = time.time()
+        self.readoutcam._startSyncAcquisition()
+        dt_async = time.time() - tstart
+        logging.info("Image thread blocked for %g s when waiting for the response, %g s when not waiting",
+                     dt_blocking, dt_async)
+        self.assertGreaterEqual(dt_blocking, REMOTEEX_RESPONSE_DELAY)
+        self.assertLess(dt_async, REMOTEEX_RESPONSE_DELAY / 4)
+
+        # Successful start => no message to the image thread
+        time.sleep(REMOTEEX_RESPONSE_DELAY * 2)
+        self.assertTrue(self.streakcam.queue_img.empty())
+
+    def test_start_busy(self):
+        """An acquisition still running is reported to the image thread"""
+        self.remoteex.errors["AcqStart"] = 7
+        self.readoutcam._startSyncAcquisition()
+        msg = self.streakcam.queue_img.get(timeout=REMOTEEX_RESPONSE_DELAY + 5)
+        self.assertEqual(msg, "busy")
+
+        self.remoteex.errors["AcqStart"] = 2
+        self.readoutcam._startSyncAcquisition()
+        msg = self.streakcam.queue_img.get(timeout=REMOTEEX_RESPONSE_DELAY + 5)
+        self.assertEqual(msg, "failed")
+
+
 if __name__ == '__main__':
     unittest.main()
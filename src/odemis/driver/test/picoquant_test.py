@@ -22,9 +22,11 @@ from __future__ import division, print_function
 
 import copy
 import logging
+import numpy
 from odemis import model
 from odemis.driver import picoquant, simulated
 import os
+import threading
 import time
 import unittest
 from odemis.driver import actuator, tmcm
@@ -69,6 +71,66 @@ class TestPH300Static(unittest.TestCase):
         wrong_config["device"] = "NOTAGOODSN"
         self.assertRaises(Exception, picoquant.PH300, **wrong_config)
 
+    def test_decode_t3(self):
+        """
+        Test decoding the T3 records and binning them per pixel
+        """
+        spec = picoquant.SPECIAL_CHANNEL << 28
+        records = numpy.array([
+            (1 << 28) | (5 << 16) | 10,  # photon before the first marker
+            spec | (1 << 16) | 20,  # marker => pixel 0
+            (1 << 28) | (7 << 16) | 30,
+            spec,  # overflow
+            (1 << 28) | (7 << 16) | 5,
+            spec | (2 << 16) | 40,  # marker => pixel 1
+            (1 << 28) | (3 << 16) | 50,
+        ], dtype=numpy.uint32)
+        channel, dtime, nsync, markers, ofl = picoquant.decode_t3_records(records)
+        numpy.testing.assert_array_equal(channel, [1, 15, 1, 15, 1, 15, 1])
+        numpy.testing.assert_array_equal(dtime[[0, 2, 6]], [5, 7, 3])
+        numpy.testing.assert_array_equal(markers, [0, 1, 0, 0, 0, 2, 0])
+        numpy.testing.assert_array_equal(nsync[[0, 4, 6]], [10, 65541, 65586])
+        self.assertEqual(ofl, 65536)
+
+        # Split the records in two batches: same result as all at once
+        binner = picoquant.T3PixelBinner()
+        hists = binner.add(records[:3])
+        self.assertEqual(hists.shape, (0, picoquant.T3HISTCHAN))
+        hists = binner.add(records[3:])
+        self.assertEqual(hists.shape, (1, picoquant.T3HISTCHAN))
+        self.assertEqual(hists[0, 7], 2)
+        self.assertEqual(hists.sum(), 2)
+
+    def test_acquire_tttr(self):
+        """
+        Test the T3 acquisition, with the simulator
+        """
+        sim_config = copy.deepcopy(CONFIG_PH)
+        sim_config["device"] = "fake"
+        dev = picoquant.PH300(**sim_config)
+
+        self._hists = []
+        dev.tttr.subscribe(self._on_tttr)
+        time.sleep(2)
+        # The histograms cannot be acquired at the same time
+        self.assertRaises(IOError, dev.data.get)
+        dev.tttr.unsubscribe(self._on_tttr)
+
+        hists = numpy.concatenate(self._hists)
+        # The simulator generates a marker every ms
+        self.assertGreater(hists.shape[0], 500)
+        self.assertEqual(hists.shape[1], picoquant.T3HISTCHAN)
+        self.assertGreater(hists.sum(), 0)
+        self.assertEqual(len(self._hists[-1].metadata[model.MD_TIME_LIST]), picoquant.T3HISTCHAN)
+
+        # Histogram mode still works afterwards
+        data = dev.data.get()
+        self.assertEqual(data.shape, dev.shape[-2::-1])
+        dev.terminate()
+
+    def _on_tttr(self, df, data):
+        self._hists.append(data)
+
 
 class TestPH300(unittest.TestCase):
     """
@@ -120,6 +182,65 @@ class TestPH300(unittest.TestCase):
         self._cnt += 1
         self._lastdata = data
 
+    def test_acquire_sync(self):
+        """Test the synchronized acquisition, with the software trigger"""
+        dt = 0.1  # s
+        df = self.dev.data
+        self.dev.dwellTime.value = dt
+        exp_shape = self.dev.shape[-2::-1]
+
+        self._cnt = 0
+        self._lastdata = None
+        self._data_received = threading.Event()
+        df.synchronizedOn(self.dev.softwareTrigger)
+        self.addCleanup(df.synchronizedOn, None)
+        df.subscribe(self._on_det_sync)
+        self.addCleanup(df.unsubscribe, self._on_det_sync)
+        time.sleep(dt * 5)
+        self.assertEqual(self._cnt, 0)  # No trigger => no data
+
+        for i in range(3):
+            self._data_received.clear()
+            self.dev.softwareTrigger.notify()
+            # Generous timeout, as the shutters (if any) may take time to open
+            self.assertTrue(self._data_received.wait(dt * 3 + 10), "No data after trigger %d" % (i,))
+            self.assertEqual(self._cnt, i + 1)
+        self.assertEqual(self._lastdata.shape, exp_shape)
+
+        df.unsubscribe(self._on_det_sync)
+        df.synchronizedOn(None)
+
+        # Not synchronized anymore => acquires continuously
+        data = df.get()
+        self.assertEqual(data.shape, exp_shape)
+
+    def test_acquire_sync_early_trigger(self):
+        """
+        Test the synchronized acquisition started, and triggered, while the
+        previous acquisition is still stopping
+        """
+        dt = 0.1  # s
+        df = self.dev.data
+        self.dev.dwellTime.value = dt
+        df.get()  # The acquisition stops (and the shutters close) just after
+
+        self._cnt = 0
+        self._lastdata = None
+        self._data_received = threading.Event()
+        df.synchronizedOn(self.dev.softwareTrigger)
+        self.addCleanup(df.synchronizedOn, None)
+        df.subscribe(self._on_det_sync)
+        self.addCleanup(df.unsubscribe, self._on_det_sync)
+        # Trigger immediately, before the acquisition is ready
+        self.dev.softwareTrigger.notify()
+        self.assertTrue(self._data_received.wait(dt * 3 + 10), "No data after early trigger")
+        self.assertEqual(self._cnt, 1)
+
+    def _on_det_sync(self, df, data):
+        self._cnt += 1
+        self._lastdata = data
+        self._data_received.set()
+
     def test_va(self):
         """Test changing VA"""
         dt = self.dev.dwellTime.range[0]
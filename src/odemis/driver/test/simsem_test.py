@@ -410,6 +410,55 @@ class TestSEM(unittest.TestCase):
         # if it has acquired a least 5 pictures we are already happy
         self.assertLessEqual(self.left, 10000)
 
+    def test_vector_scan(self):
+        """
+        Check the positions of the scan path are scanned one after another,
+        with a newPosition event for each of them.
+        """
+        self.scanner.resolution.value = (1, 1)
+        self.size = self.scanner.resolution.value
+        self.scanner.dwellTime.value = 0.01
+        path = [(-10, -10), (0, 0), (10, 5), (20, 20), (-5, 30)]
+        self.scanner.scanPath.value = path
+        self.assertEqual(len(self.scanner.scanPath.value), len(path))
+
+        self.left = len(path)
+        self.events = 0
+        self.positions = []
+        self.scanner.newPosition.subscribe(self)
+        self.sed.data.subscribe(self.receive_vector_image)
+        self.acq_done.wait(2 + len(path) * 0.01 * 1.1)
+        time.sleep(0.1)  # To catch any extra event
+        self.scanner.newPosition.unsubscribe(self)
+        self.scanner.scanPath.value = []
+
+        self.assertEqual(self.left, 0)
+        # The path is scanned only once
+        self.assertEqual(self.events, len(path))
+        # Each image is at a different position, following the path
+        pxs = self.scanner.pixelSize.value
+        pos0 = self.positions[1]  # (0, 0)
+        for (px, py), pos in zip(path, self.positions):
+            self.assertAlmostEqual(pos[0] - pos0[0], px * pxs[0])
+            self.assertAlmostEqual(pos[1] - pos0[1], -py * pxs[1])
+
+    def onEvent(self):
+        """
+        Called by the SEM when a new position happens
+        """
+        self.events += 1
+
+    def receive_vector_image(self, dataflow, image):
+        """
+        callback for df of test_vector_scan()
+        """
+        self.assertEqual(image.shape, self.size[-1:-3:-1])
+        self.positions.append(image.metadata[model.MD_POS])
+        self.left -= 1
+        if self.left <= 0:
+            dataflow.unsubscribe(self.receive_vector_image)
+            self.acq_done.set()
+
     def receive_image(self, dataflow, image):
         """
         callback for df of test_acquire_flow()
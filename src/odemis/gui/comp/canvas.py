@@ -146,7 +146,8 @@ from odemis.gui.evt import EVT_KNOB_ROTATE, EVT_KNOB_PRESS
 from odemis.gui.util import call_in_wx_main, capture_mouse_on_drag, \
     release_mouse_on_drag
 from odemis.gui.util.conversion import wxcol_to_frgb
-from odemis.gui.util.img import add_alpha_byte, apply_rotation, apply_shear, apply_flip, get_sub_img
+from odemis.gui.util.img import add_alpha_byte, apply_rotation, apply_shear, apply_flip, get_sub_img, \
+    bar_plot
 from odemis.util import intersect
 import os
 import wx
@@ -2018,46 +2019,7 @@ class PlotCanvas(BufferedCanvas):
 
     def _bar_plot(self, ctx, data, range_x, range_y):
         """ Do a bar plot of the current `_data` """
-
-        if len(data) < 2:
-            return
-
-        vx_to_px = self._val_x_to_pos_x
-        vy_to_py = self._val_y_to_pos_y
-
-        line_to = ctx.line_to
-        ctx.set_source_rgb(*self.fill_colour)
-
-        diff = (data[1][0] - data[0][0]) / 2.0
-        px = vx_to_px(data[0][0] - diff, range_x)
-        py = vy_to_py(0, range_y)
-
-        ctx.move_to(px, py)
-        # print "-", px, py
-
-        for i, (vx, vy) in enumerate(data[:-1]):
-            py = vy_to_py(vy, range_y)
-            # print "-", px, py
-            line_to(px, py)
-            px = vx_to_px((data[i + 1][0] + vx) / 2, range_x)
-            # print "-", px, py
-            line_to(px, py)
-
-        py = vy_to_py(data[-1][1], range_y)
-        # print "-", px, py
-        line_to(px, py)
-
-        diff = (data[-1][0] - data[-2][0]) / 2
-        px = vx_to_px(data[-1][0] + diff, range_x)
-        # print "-", px, py
-        line_to(px, py)
-
-        py = vy_to_py(0, range_y)
-        # print "-", px, py
-        line_to(px, py)
-
-        ctx.close_path()
-        ctx.fill()
+        bar_plot(ctx, data, range_x, range_y, self.ClientSize, self.fill_colour)
 
     def _line_plot(self, ctx, data, range_x, range_y):
         """ Do a line plot of the current `_data` """
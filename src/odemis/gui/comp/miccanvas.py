@@ -24,8 +24,10 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division
 
 import cairo
+import collections
 from decorator import decorator
 import logging
+import math
 import numpy
 from odemis import util, model
 from odemis.acq import stream
@@ -68,6 +70,13 @@ evtFitViewToContent, EVT_FIT_VIEW_TO_CONTENT = wx.lib.newevent.NewEvent()
 # Note: a Canvas with a fit_view_to_content method indicates that the view
 # can be adapted. (Some other components of the GUI will use this information)
 
+# Number of zoom levels for which the decimated plot data is kept
+MAX_DECIMATED_BUFFERS = 8
+# Number of columns of the decimation of the whole plot data, done only once.
+# The zoom levels with wider columns are derived from it. The ones with
+# narrower columns only decimate the data around the visible range.
+BASE_DECIMATION_COLUMNS = 8192
+
 
 class DblMicroscopeCanvas(canvas.DraggableCanvas):
     """ A draggable, flicker-free window class adapted to show pictures of two
@@ -1215,7 +1224,11 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
     with the mouse wheel.The plot can be panned with a middle mouse button drag.
     Therefore, the data range and display range are different.
 
-    The plot also re-samples large data sets to speed up their display.
+    The plot also reduces large data sets to the minimum and maximum of each
+    pixel column, to speed up their display. The whole data is reduced only
+    once, at a fine resolution, and each zoom level is derived from it (or from
+    the data around the displayed range, if zoomed in further). The reduced
+    data is cached for each zoom level, so panning doesn't need to recompute it.
 
     API:
     Read only values
@@ -1231,7 +1244,7 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
         .reset_ranges(): Resets the display ranges to the data ranges
         .refresh_plot(): Redraws the plot with the newest parameters.
             This function takes a window of the data set based on the current display range
-            and resamples large data sets so that they can be displayed quickly without lag.
+            and decimates large data sets so that they can be displayed quickly without lag.
 
     Note: fit_view_to_content does not function in the same way as the parent. Because the plot ranges
         are usually controlled by VA's in the viewport, this method now posts
@@ -1243,6 +1256,12 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
         super(NavigableBarPlotCanvas, self).__init__(*args, **kwargs)
         self.abilities |= {CAN_DRAG}
         self._data_buffer = None  # numpy arrays with the plot X and Y data
+        # (col_width, xs, ys): the whole _data_buffer decimated at the base resolution
+        self._base_buffer = None
+        # (column width (float), X range (None or (float, float))) -> (xs, ys):
+        # _data_buffer decimated for a zoom level, over the given X range (None
+        # if it's the whole data)
+        self._decimated_buffers = collections.OrderedDict()
         self.display_xrange = None  # range tuple of floats
         self.display_yrange = None  # range tuple of floats
         self.data_xrange = None  # range tuple of floats
@@ -1260,6 +1279,8 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
             msg = "X and Y list are of unequal length. X: %s, Y: %s, Xs: %s..."
             raise ValueError(msg % (len(xs), len(ys), str(xs)[:30]))
         self._data_buffer = (numpy.array(xs), numpy.array(ys))
+        self._base_buffer = None
+        self._decimated_buffers.clear()
         self.unit_x = unit_x
         self.unit_y = unit_y
 
@@ -1282,6 +1303,8 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
 
     def clear(self):
         self._data_buffer = None
+        self._base_buffer = None
+        self._decimated_buffers.clear()
         super(NavigableBarPlotCanvas, self).clear()
 
     # TODO: refactor so that the viewports has fit_view_to_content(), and they
@@ -1298,45 +1321,79 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
 
         self.set_ranges(self.data_xrange, self.data_yrange)
 
-    def _resample_plot(self, xs, ys, threshold):
+    def _get_base_buffer(self):
+        """
+        Reduce the whole data to the minimum and maximum of each column, with
+        BASE_DECIMATION_COLUMNS columns aligned on the first point. It's only
+        computed once for the data.
+        return col_width (float), xs, ys (ndarrays): the width of a column, and
+          the decimated X and Y data. col_width is 0 if the data cannot be decimated.
         """
-        Re-sample the data if there are more points than the threshold
-        xs, ys: two 1-D arrays with data
-        threshold: the minimum number of points for a re-sampling to occur
+        if self._base_buffer is None:
+            xs, ys = self._data_buffer
+            col_width = 0
+            if len(xs) > 0:
+                col_width = (xs[-1] - xs[0]) / BASE_DECIMATION_COLUMNS
+            if col_width > 0:
+                xs, ys = img.decimate_min_max(xs, ys, (xs[0], xs[-1]), BASE_DECIMATION_COLUMNS)
+                logging.debug("Decimated data from %d to %d points",
+                              len(self._data_buffer[0]), len(xs))
+            self._base_buffer = col_width, xs, ys
+        return self._base_buffer
+
+    def _get_decimated_buffer(self):
         """
-        # Re-sample data based on window size
-        if len(xs) > threshold:
-            rs_factor = len(xs) // (threshold // 2)
-            logging.debug("Re-sampling data with factor %d", rs_factor)
-
-            """
-            # TODO: One we support Scipy 1.2.1, we can use this function
-            xr = xs[::rs_factor]
-            # Add the peaks back into the data set so that features are displayed
-            # peaks, _ = scipy.signal.find_peaks(ys, height=0)
-            xr = numpy.append(xr, peaks)
-            xr = numpy.unique(xr)
-            xr.sort()
-            """
-            n = len(xs)
-            rem = n % rs_factor
-            new_shape = (n // rs_factor, rs_factor)
-
-            # Reshape the array into bins and take the max of each bin
-            xr = numpy.reshape(xs[:(n - rem)], new_shape)
-            xr = numpy.amax(xr, axis=1)
-
-            # in case there are remaining items left at the end (could not fit into
-            # an equally sized bin) add these to the end of the re-sampled dataset
-            rem_items = xs[(n - rem):n]
-            if len(rem_items) > 0:
-                xr = numpy.append(xr, max(rem_items))
-
-            yr = numpy.interp(xr, xs, ys)
-
-            return xr, yr
+        Reduce the data to the minimum and maximum of each pixel column, for
+        the current zoom level. The columns are aligned on the first point, so
+        that the result stays valid when panning, and it is cached.
+        If the columns are wider than the base decimation, the whole data is
+        decimated, from the base decimation. Otherwise, only the data around
+        the displayed range is decimated (from the original data).
+        return xs, ys (ndarrays): the decimated X and Y data
+        """
+        lo, hi = self.display_xrange
+        width = self.ClientSize.x
+        if hi <= lo or width <= 0:
+            return self._data_buffer
+
+        col_width = (hi - lo) / width
+        # The column width is computed from the displayed range, so when panning
+        # it might differ slightly due to floating point errors.
+        for (cw, rng), dec in self._decimated_buffers.items():
+            if (util.almost_equal(cw, col_width) and
+                (rng is None or (rng[0] <= lo and hi <= rng[1]))):
+                return dec
+
+        base_col_width, bxs, bys = self._get_base_buffer()
+        if base_col_width <= 0:  # Nothing to decimate
+            return bxs, bys
+
+        xs, ys = self._data_buffer
+        if col_width >= base_col_width:
+            # Zoomed out => reduce further the base decimation
+            rng = None
+            start = xs[0]
+            ncols = int(math.ceil((xs[-1] - xs[0]) / col_width)) + 1
+            sel_xs, sel_ys = bxs, bys
         else:
-            return xs, ys
+            # Zoomed in => only decimate the data displayed, with a margin of
+            # the displayed width on each side, to allow panning a little
+            margin = hi - lo
+            start = xs[0] + math.floor((lo - margin - xs[0]) / col_width) * col_width
+            ncols = int(math.ceil((hi + margin - start) / col_width))
+            rng = (start, start + ncols * col_width)
+            # Also keep the closest point outside on each side, to not leave a gap
+            i0 = max(0, numpy.searchsorted(xs, rng[0], side="left") - 1)
+            i1 = min(len(xs), numpy.searchsorted(xs, rng[1], side="right") + 1)
+            sel_xs, sel_ys = xs[i0:i1], ys[i0:i1]
+
+        dec = img.decimate_min_max(sel_xs, sel_ys, (start, start + ncols * col_width), ncols)
+        logging.debug("Decimated data from %d to %d points", len(sel_xs), len(dec[0]))
+
+        self._decimated_buffers[(col_width, rng)] = dec
+        while len(self._decimated_buffers) > MAX_DECIMATED_BUFFERS:
+            self._decimated_buffers.popitem(last=False)  # forget the oldest zoom level
+        return dec
 
     @limit_invocation(0.05)  # Max 20 Hz
     def refresh_plot(self):
@@ -1346,7 +1403,7 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
         if self._data_buffer is None:
             return
 
-        (xst , yst) = self._data_buffer
+        (xst, yst) = self._get_decimated_buffer()
 
         # Using the selected horizontal range, define a window
         # for display of the data.
@@ -1376,8 +1433,6 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
             xs = numpy.append(xs, xst[hix])
             ys = numpy.append(ys, yst[hix])
 
-        # Resample the plot (if necessary) for the view, and restack the data
-        xs, ys = self._resample_plot(xs, ys, self.ClientSize.x * 10)
         temp_data = numpy.column_stack((xs, ys))
 
         if temp_data.size == 0:
@@ -1398,7 +1453,7 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
         self.refresh_plot()
 
     def on_size(self, evt):
-        # Reset the data display to ensure the data resampling is done
+        # Reset the data display to ensure the data decimation is done
         self.refresh_plot()
         super(NavigableBarPlotCanvas, self).on_size(evt)
 
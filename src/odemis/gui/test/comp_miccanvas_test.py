@@ -31,8 +31,10 @@ from collections import deque
 import threading
 
 import unittest
+from unittest import mock
 import math
 import logging
+import numpy
 
 import wx
 import time
@@ -42,6 +44,7 @@ import odemis.gui.comp.canvas as canvas
 import odemis.gui.comp.viewport as viewport
 import odemis.gui.test as test
 from odemis.gui.test import generate_img_data
+from odemis.gui.util import img
 
 from builtins import range
 
@@ -391,6 +394,46 @@ class PlotCanvasTestCase(test.GuiTestCase):
 
         test.gui_loop()
 
+    def test_navigable_plot_canvas_decimation(self):
+        """
+        Check zooming on a large plot doesn't reduce again the whole data, and
+        never loses the peaks
+        """
+        cnvs = miccanvas.NavigableBarPlotCanvas(self.panel)
+        self.add_control(cnvs, wx.EXPAND, proportion=1)
+        test.gui_loop()
+
+        n = 1000000
+        xs = numpy.linspace(0, 1000, n)
+        ys = numpy.random.random(n)
+        ys[123456] = 10  # peak at X = 123.456
+
+        decimated_lengths = []  # number of points passed at each decimation
+        orig_decimate = img.decimate_min_max
+
+        def decimate_min_max(xs, ys, range_x, width):
+            decimated_lengths.append(len(xs))
+            return orig_decimate(xs, ys, range_x, width)
+
+        with mock.patch.object(img, "decimate_min_max", side_effect=decimate_min_max):
+            cnvs.set_1d_data(xs, ys)
+            test.gui_loop(0.2)
+
+            # Zoom out, zoom in a lot, and pan a little
+            for rng in ((0, 1000), (100, 200), (-500, 1500), (120, 130),
+                        (123.4, 123.5), (123.41, 123.51)):
+                cnvs.display_xrange = rng
+                dxs, dys = cnvs._get_decimated_buffer()
+                visible = (rng[0] <= dxs) & (dxs <= rng[1])
+                self.assertEqual(dys[visible].max(), 10)
+
+        # The whole data was only reduced once
+        self.assertEqual(decimated_lengths.count(n), 1)
+        # Zoomed in far, only the data around the displayed range is reduced
+        self.assertLess(max(l for l in decimated_lengths if l != n), n / 10)
+
+        test.gui_loop()
+
     def test_onedimensional_canvas(self):
         cnvs = miccanvas.TwoDPlotCanvas(self.panel)
         cnvs.SetBackgroundColour("#00599B")
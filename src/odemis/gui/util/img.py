@@ -1150,44 +1150,102 @@ def val_y_to_pos_y(val_y, client_size, range_y):
         return 0
 
 
+def decimate_min_max(xs, ys, range_x, width):
+    """
+    Reduce the number of points of a plot to at most two per pixel column: the
+    minimum and the maximum of the column. So, contrarily to a simple sub-sampling,
+    no peak is lost.
+    xs (ndarray of N floats): the X values, normally ordered. If not, the points
+      are sorted along X.
+    ys (ndarray of N floats): the Y values
+    range_x ((float, float)): the X values at the left and right of the plot.
+      The points outside of this range are merged into one column on each side.
+    width (0 < int): number of pixel columns of the plot
+    return:
+        xs (ndarray of M floats): the X values of the points kept (ordered)
+        ys (ndarray of M floats): the corresponding Y values
+      If there are not more than two points per column, the data is returned as-is.
+    """
+    xs = numpy.asarray(xs)
+    ys = numpy.asarray(ys)
+    n = len(xs)
+    data_width = range_x[1] - range_x[0]
+    if n <= 2 * width or data_width <= 0:
+        return xs, ys
+
+    if numpy.any(xs[1:] < xs[:-1]):
+        logging.debug("Sorting the %d points of the plot along X", n)
+        order = numpy.argsort(xs, kind="stable")
+        xs, ys = xs[order], ys[order]
+
+    # Column of each point (the data is ordered, so each column is a contiguous block)
+    cols = numpy.floor((xs - range_x[0]) * (width / data_width))
+    numpy.clip(cols, -1, width, out=cols)
+    starts = numpy.flatnonzero(cols[1:] != cols[:-1]) + 1
+    starts = numpy.insert(starts, 0, 0)
+    counts = numpy.diff(numpy.append(starts, n))
+
+    # Index of the first minimum and maximum of each column
+    idx = numpy.arange(n)
+    col_min = numpy.repeat(numpy.fmin.reduceat(ys, starts), counts)
+    col_max = numpy.repeat(numpy.fmax.reduceat(ys, starts), counts)
+    imin = numpy.minimum.reduceat(numpy.where(ys == col_min, idx, n), starts)
+    imax = numpy.minimum.reduceat(numpy.where(ys == col_max, idx, n), starts)
+    # Columns with only NaNs have no minimum => just pick the first point
+    imin = numpy.where(imin == n, starts, imin)
+    imax = numpy.where(imax == n, starts, imax)
+
+    # As the columns are ordered, sorting the indices keeps the points in order
+    kept = numpy.unique(numpy.concatenate((imin, imax)))
+    return xs[kept], ys[kept]
+
+
 def bar_plot(ctx, data, range_x, range_y, client_size, fill_colour):
-    """ Do a bar plot of the current `_data` 
+    """ Do a bar plot of the current `_data`
     data needs to be a list or ndarray, not an iterator
+    If the data has more points than pixels, it is first reduced to the minimum
+    and maximum of each pixel column.
     """
 
     if len(data) < 2:
         return
 
+    data = numpy.asarray(data, dtype=float)
+    xs, ys = decimate_min_max(data[:, 0], data[:, 1], range_x, client_size[0])
+    if len(xs) < 2:
+        return
+
+    # The bars go half-way to the neighbouring points
+    edges = numpy.empty(len(xs) + 1)
+    edges[1:-1] = (xs[:-1] + xs[1:]) / 2
+    edges[0] = xs[0] - (xs[1] - xs[0]) / 2
+    edges[-1] = xs[-1] + (xs[-1] - xs[-2]) / 2
+
+    # Same as val_x_to_pos_x() and val_y_to_pos_y(), but for all the points at once
+    data_width = range_x[1] - range_x[0]
+    if data_width:
+        pxs = (numpy.clip(edges, range_x[0], range_x[1]) - range_x[0]) * (client_size[0] / data_width)
+    else:
+        pxs = numpy.zeros(edges.shape)
+
+    data_height = range_y[1] - range_y[0]
+    if data_height == 0:
+        data_height = range_y[1]
+    if data_height:
+        pys = (range_y[1] - numpy.clip(ys, range_y[0], range_y[1])) * (client_size[1] / data_height)
+    else:
+        pys = numpy.zeros(ys.shape)
+    py0 = val_y_to_pos_y(0, client_size, range_y)
+
     line_to = ctx.line_to
     ctx.set_source_rgb(*fill_colour)
 
-    diff = (data[1][0] - data[0][0]) / 2
-    px = val_x_to_pos_x(data[0][0] - diff, client_size, range_x)
-    py = val_y_to_pos_y(0, client_size, range_y)
-
-    ctx.move_to(px, py)
-    # print "-", px, py
-
-    for i, (vx, vy) in enumerate(data[:-1]):
-        py = val_y_to_pos_y(vy, client_size, range_y)
-        # print "-", px, py
-        line_to(px, py)
-        px = val_x_to_pos_x((data[i + 1][0] + vx) / 2, client_size, range_x)
-        # print "-", px, py
-        line_to(px, py)
-
-    py = val_y_to_pos_y(data[-1][1], client_size, range_y)
-    # print "-", px, py
-    line_to(px, py)
-
-    diff = (data[-1][0] - data[-2][0]) / 2
-    px = val_x_to_pos_x(data[-1][0] + diff, client_size, range_x)
-    # print "-", px, py
-    line_to(px, py)
-
-    py = val_y_to_pos_y(0, client_size, range_y)
-    # print "-", px, py
-    line_to(px, py)
+    pxs = pxs.tolist()
+    ctx.move_to(pxs[0], py0)
+    for i, py in enumerate(pys.tolist()):
+        line_to(pxs[i], py)
+        line_to(pxs[i + 1], py)
+    line_to(pxs[-1], py0)
 
     ctx.close_path()
     ctx.fill()
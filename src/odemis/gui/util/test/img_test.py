@@ -174,6 +174,50 @@ class TestCalculateTicks(unittest.TestCase):
                                "Non-linear pixel spacing")
 
 
+class TestDecimateMinMax(unittest.TestCase):
+
+    def test_peaks(self):
+        """
+        The minimum and maximum of each column must be kept
+        """
+        xs = numpy.linspace(400e-9, 800e-9, 100000)
+        ys = numpy.random.random(xs.shape)
+        ys[12345] = 10  # a peak
+        ys[777] = -5  # a dip
+        width = 500
+
+        dxs, dys = img.decimate_min_max(xs, ys, (xs[0], xs[-1]), width)
+        self.assertLessEqual(len(dxs), 2 * (width + 2))
+        self.assertTrue(numpy.all(numpy.diff(dxs) > 0))  # still ordered
+        self.assertEqual(dys.max(), 10)
+        self.assertEqual(dys.min(), -5)
+        self.assertIn(xs[12345], dxs)
+        self.assertIn(xs[777], dxs)
+
+    def test_small_data(self):
+        """
+        Data with fewer points than columns should not be changed
+        """
+        xs = numpy.arange(100)
+        ys = numpy.random.random(xs.shape)
+        dxs, dys = img.decimate_min_max(xs, ys, (0, 99), 500)
+        numpy.testing.assert_array_equal(dxs, xs)
+        numpy.testing.assert_array_equal(dys, ys)
+
+    def test_unordered(self):
+        """
+        Data not ordered along X should give the same result as the ordered data
+        """
+        xs = numpy.linspace(0, 1, 10000)
+        ys = numpy.random.random(xs.shape)
+        exp_xs, exp_ys = img.decimate_min_max(xs, ys, (0, 1), 100)
+
+        order = numpy.random.permutation(len(xs))
+        dxs, dys = img.decimate_min_max(xs[order], ys[order], (0, 1), 100)
+        numpy.testing.assert_array_equal(dxs, exp_xs)
+        numpy.testing.assert_array_equal(dys, exp_ys)
+
+
 class TestARExport(unittest.TestCase):
     FILENAME_CSV = "test-ar.csv"
     FILENAME_PNG = "test-ar.png"
@@ -30,7 +30,7 @@ import Pyro4
 import logging
 import numpy
 from odemis.model import _metadata
-from odemis.util import inspect_getmembers
+from odemis.util import inspect_getmembers, TimeoutError
 from odemis.util.weak import WeakMethod, WeakRefLostError
 import os
 import threading
@@ -107,11 +107,40 @@ class DataFlowBase(object):
         self._listeners = set()
         self._lock = threading.RLock()  # need to be acquired to modify the set
 
-    # to be overridden
-    # not defined at all so that the proxy version automatically does a remote call
-#    def get(self):
-#        # TODO timeout argument?
-#        pass
+    # can be overridden
+    def get(self, asap=True, timeout=None):
+        """
+        Acquires one image and return it
+        asap (boolean): if True, returns the first image received, otherwise
+         ensures that the image has been acquired after the call to this function
+        timeout (None or 0 < float): maximum time to wait for the image (in s).
+          If None, it waits forever.
+        return (DataArray)
+        raise TimeoutError: if no image was received within the timeout
+        Default implementation: it subscribes and, after receiving the first
+         image, unsubscribes. It's inefficient but simple and works in every case.
+         On a proxy, the image is received via 0MQ, like for the subscribers,
+         which avoids copying (and pickling) the data.
+        """
+        if asap:
+            min_time = 0
+        else:
+            min_time = time.time()
+
+        is_received = threading.Event()
+        data_shared = [None] # in python2 we need to create a new container object
+
+        def receive_one_image(df, data, min_time=min_time):
+            if data.metadata.get(_metadata.MD_ACQ_DATE, float("inf")) >= min_time:
+                df.unsubscribe(receive_one_image)
+                data_shared[0] = data
+                is_received.set()
+
+        self.subscribe(receive_one_image)
+        if not is_received.wait(timeout):
+            self.unsubscribe(receive_one_image)
+            raise TimeoutError("No data received after %g s" % (timeout,))
+        return data_shared[0]
 
     def subscribe(self, listener):
         """
@@ -209,7 +238,18 @@ class DataFlow(DataFlowBase):
         Equivalent to __getstate__() of the proxy version
         """
         proxy_state = Pyro4.core.pyroObjectSerializer(self)[2]
-        return proxy_state, _core.dump_roattributes(self), self.max_discard
+        return (proxy_state, _core.dump_roattributes(self), self.max_discard,
+                self._has_default_get())
+
+    def _has_default_get(self):
+        """
+        return (bool): True if get() is the generic implementation (based on
+          subscribe()), False if the DataFlow has its own get().
+        """
+        get = type(self).get
+        get = getattr(get, "__func__", get)  # Python 2 unbound method
+        base_get = getattr(DataFlowBase.get, "__func__", DataFlowBase.get)
+        return get is base_get
 
     @property
     def max_discard(self):
@@ -293,33 +333,6 @@ class DataFlow(DataFlowBase):
     def _count_listeners(self):
         return len(self._listeners) + len(self._remote_listeners)
 
-    def get(self, asap=True):
-        """
-        Acquires one image and return it
-        asap (boolean): if True, returns the first image received, otherwise
-         ensures that the image has been acquired after the call to this function
-        return (DataArray)
-        Default implementation: it subscribes and, after receiving the first
-         image, unsubscribes. It's inefficient but simple and works in every case.
-        """
-        if asap:
-            min_time = 0
-        else:
-            min_time = time.time()
-
-        is_received = threading.Event()
-        data_shared = [None] # in python2 we need to create a new container object
-
-        def receive_one_image(df, data, min_time=min_time):
-            if data.metadata.get(_metadata.MD_ACQ_DATE, float("inf")) >= min_time:
-                df.unsubscribe(receive_one_image)
-                data_shared[0] = data
-                is_received.set()
-
-        self.subscribe(receive_one_image)
-        is_received.wait()
-        return data_shared[0]
-
     # subscribe and unsubscribe look like they could use @oneway (which would
     # speed up a bit calls to them), but as Pyro doesn't ensure the order, it's
     # not possible because it could lead to wrong behaviour in case of quick
@@ -408,6 +421,7 @@ class DataFlowProxy(DataFlowBase, Pyro4.Proxy):
         self._proxy_name = "%x/%x" % (os.getpid(), id(self))
         DataFlowBase.__init__(self)
         self.max_discard = max_discard
+        self._default_get = True
 
         self._ctx = None
         self._commands = None
@@ -416,10 +430,11 @@ class DataFlowProxy(DataFlowBase, Pyro4.Proxy):
     def __getstate__(self):
         # must permit to recreate a proxy to a data-flow in a different container
         proxy_state = Pyro4.Proxy.__getstate__(self)
-        return proxy_state, _core.dump_roattributes(self), self.max_discard
+        return (proxy_state, _core.dump_roattributes(self), self.max_discard,
+                self._default_get)
 
     def __setstate__(self, state):
-        proxy_state, roattributes, self.max_discard = state
+        proxy_state, roattributes, self.max_discard, self._default_get = state
         Pyro4.Proxy.__setstate__(self, proxy_state)
         _core.load_roattributes(self, roattributes)
 
@@ -431,7 +446,26 @@ class DataFlowProxy(DataFlowBase, Pyro4.Proxy):
         self._commands = None
         self._thread = None
 
-    # .get() is a direct remote call
+    def get(self, asap=True, timeout=None):
+        """
+        Acquires one image and return it. See DataFlowBase.get().
+        The image is received via 0MQ, unless the DataFlow has its own get(),
+        in which case it's a direct remote call.
+        raise ValueError: if a timeout is requested on a DataFlow with its own get()
+        """
+        if self._default_get:
+            return DataFlowBase.get(self, asap, timeout)
+
+        # The own get() of a DataFlow doesn't necessarily support a timeout.
+        # Using the generic implementation instead would acquire differently,
+        # so refuse it.
+        if timeout is not None:
+            raise ValueError("DataFlow %s has its own get(), which doesn't support a timeout"
+                             % (self._global_name,))
+        if asap:
+            return Pyro4.Proxy.__getattr__(self, "get")()
+        else:
+            return Pyro4.Proxy.__getattr__(self, "get")(asap=False)
 
     # next three methods are directly from DataFlowBase
     #.subscribe()
@@ -34,7 +34,6 @@ import threading
 import types
 import sys
 import zmq
-from scipy.spatial import distance
 
 from . import _core
 from odemis.util import inspect_getmembers
@@ -1011,6 +1010,8 @@ class VAEnumerated(VigilantAttribute, Enumerated):
 
         # find the closest choice (for numbers or tuples only)
         if isinstance(val, collections.Iterable) or isinstance(val, numbers.Real):
+            # Only imported when needed, as it's slow to load
+            from scipy.spatial import distance
             ls = []
 
             for choice in self.choices:
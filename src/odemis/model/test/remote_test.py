@@ -30,7 +30,7 @@ import logging
 import numpy
 from odemis import model
 from odemis.model import roattribute, oneway, isasync, VigilantAttributeBase
-from odemis.util import mock, timeout, executeAsyncTask
+from odemis.util import mock, timeout, executeAsyncTask, TimeoutError
 import os
 import pickle
 import sys
@@ -670,6 +670,29 @@ class RemoteTest(unittest.TestCase):
         self.assertEqual(array.shape, (2048, 2048))
         self.assertEqual(array[0][0], 0)
 
+        # The own get() doesn't support a timeout
+        with self.assertRaises(ValueError):
+            self.comp.data.get(timeout=5)
+
+#    @unittest.skip("simple")
+    def test_dataflow_get_zmq(self):
+        """
+        Check the default get() works remotely (via 0MQ), including the timeout
+        """
+        dfs = self.comp.datas
+        array = dfs.get()
+        self.assertEqual(array.shape, (2, 2))
+        self.assertEqual(array.metadata["a"], 2)
+
+        array = dfs.get(asap=False, timeout=5)
+        self.assertEqual(array.shape, (2, 2))
+
+        # Nothing is generated as the event is never triggered
+        dfs.synchronizedOn(self.comp.startAcquire)
+        with self.assertRaises(TimeoutError):
+            dfs.get(timeout=0.5)
+        dfs.synchronizedOn(None)
+
 #    @unittest.skip("simple")
     def test_va_update(self):
         prop = self.comp.prop
@@ -22,7 +22,6 @@ from __future__ import division
 from past.builtins import basestring, long
 
 import collections
-import cv2
 import json
 import logging
 import math
@@ -401,6 +400,7 @@ def get_img_transformation_md(mat, timage, src_img):
         [timage.shape[1], 0.0],
         [0.0, timage.shape[0]],
     ]
+    import cv2  # slow to load, so only when needed
     converted_points = cv2.perspectiveTransform(numpy.array([points]), mat)[0]
 
     center_point = converted_points[0]
@@ -178,6 +178,70 @@ def checkLightBand(band):
 
     # no error found
 
+
+class BufferPool(object):
+    """
+    Pool of (ctypes) memory buffers, to be used by the drivers to receive the
+    frames from the hardware, without allocating new memory for every frame.
+    A buffer is given back to the pool automatically, once nothing references
+    it anymore (ie, all the DataArrays created on top of it are deleted). So
+    the arrays should be created with numpy.frombuffer() or
+    numpy.ctypeslib.as_array() directly on the buffer (and not via ctypes.cast(),
+    which creates a reference cycle, only freed by the garbage collector).
+    """
+    # Number of references on a buffer, when only the pool holds it, as seen
+    # by sys.getrefcount(self._buffers[i]): the list + the argument.
+    _FREE_REFCOUNT = 2
+
+    def __init__(self, max_buffers=16):
+        """
+        max_buffers (0 < int): maximum number of buffers kept in the pool. If
+          more buffers are needed simultaneously, they are allocated as usual,
+          and freed once not used anymore.
+        """
+        self._max_buffers = max_buffers
+        self._buffers = []  # ctypes arrays
+        self._lock = threading.Lock()
+
+    def get(self, ctype, length):
+        """
+        Provides a buffer of the given type, either one previously used and
+          not referenced anymore, or a new one.
+        ctype (ctypes type): type of each element (eg, c_uint16)
+        length (0 < int): number of elements
+        return (ctypes array of ctype * length): the buffer. Its content is
+          undefined (ie, it's not necessarily zeros).
+        """
+        btype = ctype * length
+        with self._lock:
+            unused = []  # indices of the free buffers of a different type
+            for i in range(len(self._buffers)):
+                if sys.getrefcount(self._buffers[i]) > self._FREE_REFCOUNT:
+                    continue  # still in use
+                if type(self._buffers[i]) is btype:
+                    return self._buffers[i]
+                unused.append(i)
+
+            cbuffer = btype()  # empty array
+            if unused:
+                # Most likely the frame size has changed => drop the old buffers
+                for i in reversed(unused):
+                    del self._buffers[i]
+
+            if len(self._buffers) < self._max_buffers:
+                self._buffers.append(cbuffer)
+            else:
+                logging.debug("Buffer pool full, allocating a temporary buffer")
+            return cbuffer
+
+    def clear(self):
+        """
+        Forget all the buffers. The ones still in use will be freed when they
+          are not referenced anymore.
+        """
+        with self._lock:
+            self._buffers = []
+
 # Special trick functions for speeding up Pyro start-up
 def _speedUpPyroVAConnect(comp):
     """
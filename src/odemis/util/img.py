@@ -28,14 +28,14 @@ import logging
 import math
 import numpy
 from odemis import model
-import scipy.ndimage
-import cv2
+import sys
 
 from odemis.model import MD_DWELL_TIME, MD_EXP_TIME, TINT_FIT_TO_RGB, TINT_RGB_AS_IS
 from odemis.util import get_best_dtype_for_acc
 from odemis.util.conversion import get_img_transformation_matrix, rgb_to_frgb
-import matplotlib.colors as colors
-from matplotlib import cm
+
+# Note: matplotlib, OpenCV (cv2) and scipy are slow to load, so they are only
+# imported by the functions needing them.
 
 # See if the optimised (cython-based) functions are available
 try:
@@ -91,6 +91,17 @@ except ImportError:
 #    return ret
 
 
+def _isColormap(tint):
+    """
+    Check whether the tint is a matplotlib Colormap, without loading matplotlib
+    (if matplotlib is not loaded yet, it cannot be a Colormap).
+    tint (object): any kind of tint
+    return (bool): True if it's a matplotlib.colors.Colormap
+    """
+    colors = sys.modules.get("matplotlib.colors")
+    return colors is not None and isinstance(tint, colors.Colormap)
+
+
 def tint_to_md_format(tint):
     """
     Given a tint of a stream, which could be an RGB tuple or colormap object,
@@ -104,7 +115,7 @@ def tint_to_md_format(tint):
     """
     if isinstance(tint, tuple) or isinstance(tint, list):
         return tint
-    elif isinstance(tint, colors.Colormap):
+    elif _isColormap(tint):
         return tint.name
     elif tint in (TINT_FIT_TO_RGB, TINT_RGB_AS_IS):
         return tint
@@ -124,6 +135,7 @@ def md_format_to_tint(user_tint):
         return user_tint
     elif isinstance(user_tint, str):
         if user_tint != TINT_FIT_TO_RGB:
+            from matplotlib import cm
             try:
                 return cm.get_cmap(user_tint)
             except NameError:
@@ -382,7 +394,8 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
     # Determine if it is necessary to deal with the color map
     # Otherwise, continue with the old method
 
-    if isinstance(tint, colors.Colormap):
+    if _isColormap(tint):
+        from matplotlib import colors
         # Normalize the data to the interval [0, 1.0]
         # TODO: Add logarithmic normalization with LogNorm
         # norm = colors.LogNorm(vmin=data.min(), vmax=data.max())
@@ -498,6 +511,8 @@ def tintToColormap(tint):
     name (string): the name argument of the new colormap object
     returns matplotlib.colors.Colormap object
     """
+    from matplotlib import cm, colors
+
     if isinstance(tint, colors.Colormap):
         return tint
     elif isinstance(tint, tuple) or isinstance(tint, list):  # a tint RGB value
@@ -644,6 +659,7 @@ def rescale_hq(data, shape):
         # TODO: if C is not last dim, reshape (ie, call ensureYXC())
         # TODO: not all dtypes are supported by OpenCV (eg, uint32)
         # This is a normal spatial image
+        import cv2
         if any(s < 1 for s in scale):
             interpolation = cv2.INTER_AREA  # Gives best looking when shrinking
         else:
@@ -653,6 +669,7 @@ def rescale_hq(data, shape):
     else:
         # Weird number of dimensions => default to the less pretty but more
         # generic scipy version
+        import scipy.ndimage
         out = numpy.empty(shape, dtype=data.dtype)
         scipy.ndimage.interpolation.zoom(data, zoom=scale, output=out, order=1, prefilter=False)
 
@@ -702,6 +719,61 @@ def Subtract(a, b):
         return a - b
 
 
+def Subtract2RGBHistogram(data, bkg, irange, tint=(255, 255, 255)):
+    """
+    Subtract the background of an image, and compute both the RGB projection
+    and the histogram of the result. It is equivalent to calling Subtract(),
+    DataArray2RGB() and numpy.bincount(), but (when the optimised version is
+    available) it passes only once on the data, without allocating any
+    intermediary image.
+    :param data: (numpy.ndarray of uint16) 2D image greyscale
+    :param bkg: (None or numpy.ndarray of uint16) background image, of the same
+      shape as data. If None, no background is subtracted.
+    :param irange: (tuple of 2 values) min/max intensities mapped to black/white
+    :param tint: (3-tuple of 0 < int <256) RGB colour of the final image
+    :return:
+      rgb (numpy.ndarray of 3*shape of uint8): converted image in RGB
+      hist (numpy.ndarray of 0<=int): number of pixels for each value, from 0
+        up to the maximum value of the data (as numpy.bincount())
+    :raises ValueError: if the data is not supported (only uint16 and RGB tint)
+    """
+    if data.ndim != 2 or data.dtype != numpy.uint16:
+        raise ValueError("Only 2D uint16 data is supported, got %s %s" % (data.shape, data.dtype))
+    if bkg is not None and (bkg.shape != data.shape or bkg.dtype != data.dtype):
+        raise ValueError("Background %s %s doesn't match the data" % (bkg.shape, bkg.dtype))
+    if not isinstance(tint, tuple):
+        raise ValueError("Only RGB tint is supported, got %s" % (tint,))
+
+    data = data.view(numpy.ndarray)
+    if bkg is not None:
+        bkg = bkg.view(numpy.ndarray)
+
+    if img_fast:
+        # Same conversion of irange as DataArray2RGB()
+        irange = numpy.array(irange, data.dtype)
+        if irange[0] >= irange[1]:
+            if irange[0] > 0:
+                irange = (irange[0] - 1, irange[0])
+            else:
+                irange = (irange[0], irange[0] + 1)
+        try:
+            rgb, hist = img_fast.Subtract2RGBHistogram(data, bkg, irange, tint)
+            # Cut the (empty) end of the histogram, as numpy.bincount()
+            nz = numpy.flatnonzero(hist)
+            hist = hist[:nz[-1] + 1] if nz.size else hist[:0]
+            return rgb, hist
+        except ValueError as exp:
+            logging.info("Fast conversion cannot run: %s", exp)
+        except Exception:
+            logging.exception("Failed to use the fast conversion")
+
+    if bkg is not None:
+        data = Subtract(data, bkg)
+    hist = numpy.bincount(data.flat)
+    rgb = DataArray2RGB(data, irange, tint)
+    return rgb, hist
+
+
 # TODO: use VIPS to be fast?
 def Average(images, rect, mpp, merge=0.5):
     """
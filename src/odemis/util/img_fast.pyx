@@ -113,3 +113,101 @@ def DataArray2RGB(data, irange, tint=(255, 255, 255)):
     wrapDataArray2RGB(data, irange, tint, ret)
     return ret
 
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+cdef void cSubtract2RGBHistogram(uint16_t* data, uint16_t* bkg, int datalen,
+                                 uint16_t irange0, uint16_t irange1, int* tint,
+                                 numpy.uint8_t* ret, numpy.intp_t* hist) nogil:
+    # Same as cDataArray2RGB, but first subtracts the background (if bkg is not
+    # NULL), and counts the values (after subtraction) in hist.
+    cdef double b = 255. / <double>(irange1 - irange0)
+    cdef double br = (b * <double>tint[0]) / 255.
+    cdef double bg = (b * <double>tint[1]) / 255.
+    cdef double bb = (b * <double>tint[2]) / 255.
+    cdef bint no_tint = (tint[0] == tint[1] == tint[2] == 255)
+
+    cdef uint16_t v
+    cdef numpy.uint8_t di
+    cdef double df
+    cdef int retpos = 0
+
+    for i in range(datalen):
+        v = data[i]
+        if bkg != NULL:
+            # clip at 0, to avoid underflow
+            if v > bkg[i]:
+                v = v - bkg[i]
+            else:
+                v = 0
+        hist[v] += 1
+
+        if v <= irange0:
+            ret[retpos] = 0
+            ret[retpos + 1] = 0
+            ret[retpos + 2] = 0
+        elif v >= irange1:
+            ret[retpos] = tint[0]
+            ret[retpos + 1] = tint[1]
+            ret[retpos + 2] = tint[2]
+        elif no_tint:
+            di = <numpy.uint8_t> ((v - irange0) * b + 0.5)
+            ret[retpos] = di
+            ret[retpos + 1] = di
+            ret[retpos + 2] = di
+        else:
+            df = (v - irange0)
+            ret[retpos] = <numpy.uint8_t> (df * br + 0.5)
+            ret[retpos + 1] = <numpy.uint8_t> (df * bg + 0.5)
+            ret[retpos + 2] = <numpy.uint8_t> (df * bb + 0.5)
+        retpos += 3
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def wrapSubtract2RGBHistogram(numpy.ndarray[uint16_t, ndim=2] data not None,
+                              numpy.ndarray[uint16_t, ndim=2] bkg,
+                              irange,
+                              tint,
+                              numpy.ndarray[numpy.uint8_t, ndim=3] ret not None,
+                              numpy.ndarray[numpy.intp_t, ndim=1] hist not None):
+    cdef int ctint[3]
+    ctint[0] = tint[0]
+    ctint[1] = tint[1]
+    ctint[2] = tint[2]
+    cdef uint16_t* pbkg = NULL
+    if bkg is not None:
+        pbkg = &bkg[0,0]
+    cdef uint16_t* pdata = &data[0,0]
+    cdef int datalen = data.size
+    cdef uint16_t irange0 = irange[0]
+    cdef uint16_t irange1 = irange[1]
+    cdef numpy.uint8_t* pret = &ret[0,0,0]
+    cdef numpy.intp_t* phist = &hist[0]
+    # Release the GIL, so that other streams can be processed simultaneously
+    with nogil:
+        cSubtract2RGBHistogram(pdata, pbkg, datalen, irange0, irange1, ctint, pret, phist)
+
+
+def Subtract2RGBHistogram(data, bkg, irange, tint=(255, 255, 255)):
+    """
+    See img.Subtract2RGBHistogram()
+    return (ndarray of uint8, ndarray of intp): RGB image, histogram of the
+      whole uint16 range
+    """
+    if not data.flags.c_contiguous:
+        raise ValueError("Optimised version only works with C-contiguous arrays")
+    if data.dtype != numpy.uint16:
+        raise ValueError("Optimised version only works on uint16 (got %s)" % (data.dtype,))
+    if bkg is not None:
+        if not bkg.flags.c_contiguous or bkg.dtype != numpy.uint16:
+            raise ValueError("Optimised version only works with C-contiguous uint16 background")
+        if bkg.shape != data.shape:
+            raise ValueError("Background shape %s doesn't match data shape %s" % (bkg.shape, data.shape))
+    if irange[0] >= irange[1]:
+        raise ValueError("irange needs to be a tuple of low/high values")
+    ret = numpy.empty(data.shape + (3,), dtype=numpy.uint8)
+    hist = numpy.zeros(2 ** 16, dtype=numpy.intp)
+    wrapSubtract2RGBHistogram(data, bkg, irange, tint, ret, hist)
+    return ret, hist
@@ -16,11 +16,14 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from concurrent.futures._base import CancelledError, CANCELLED, FINISHED, RUNNING
 import logging
+import multiprocessing
 import numpy
 from odemis import model
 from scipy.optimize import curve_fit, OptimizeWarning
+import sys
 import threading
 import time
 import warnings
@@ -255,96 +258,212 @@ class PeakFitter(object):
                 ValueError if fitting cannot be applied
         """
         try:
-            # values based on experimental datasets
-            if len(wavelength) >= 2000:
-                divider = 20
-            elif len(wavelength) >= 1000:
-                divider = 25
-            else:
-                divider = 30
-            init_window_size = max(3, len(wavelength) // divider)
-            window_size = init_window_size
-            logging.debug("Starting peak detection on data (len = %d) with window = %d",
-                          len(wavelength), window_size)
-            try:
-                wl_rng = wavelength[-1] - wavelength[0]
-                width = wl_rng * WIDTH_RATIO  # initial peak width estimation
-                FitFunction = PEAK_FUNCTIONS[type]
-            except KeyError:
-                raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
-            for step in range(5):
+            return self._FitSpectrum(future, spectrum, wavelength, type)
+        except CancelledError:
+            logging.debug("Fitting of type %s was cancelled.", type)
+        finally:
+            with future._fit_lock:
                 if future._fit_state == CANCELLED:
                     raise CancelledError()
-                smoothed = Smooth(spectrum, window_len=window_size)
-                # Increase window size until peak detection finds enough peaks to fit
-                # the spectrum curve
-                peaks = Detect(smoothed, wavelength, lookahead=window_size, delta=5)[0]
-                if not peaks:
-                    window_size = int(round(window_size * 1.2))
-                    logging.debug("Retrying to fit peak with window = %d", window_size)
-                    continue
-
-                fit_list = []
-                lower_bounds = []
-                upper_bounds = []
-                for (pos, amplitude) in peaks:
+                future._fit_state = FINISHED
+
+    def _FitSpectrum(self, future, spectrum, wavelength, type):
+        """
+        Does the actual fitting of a spectrum. See _DoFit() for the arguments.
+        raises:
+                CancelledError if the future was cancelled
+        """
+        # values based on experimental datasets
+        if len(wavelength) >= 2000:
+            divider = 20
+        elif len(wavelength) >= 1000:
+            divider = 25
+        else:
+            divider = 30
+        init_window_size = max(3, len(wavelength) // divider)
+        window_size = init_window_size
+        logging.debug("Starting peak detection on data (len = %d) with window = %d",
+                      len(wavelength), window_size)
+        try:
+            wl_rng = wavelength[-1] - wavelength[0]
+            width = wl_rng * WIDTH_RATIO  # initial peak width estimation
+            FitFunction = PEAK_FUNCTIONS[type]
+        except KeyError:
+            raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
+        for step in range(5):
+            if future._fit_state == CANCELLED:
+                raise CancelledError()
+            smoothed = Smooth(spectrum, window_len=window_size)
+            # Increase window size until peak detection finds enough peaks to fit
+            # the spectrum curve
+            peaks = Detect(smoothed, wavelength, lookahead=window_size, delta=5)[0]
+            if not peaks:
+                window_size = int(round(window_size * 1.2))
+                logging.debug("Retrying to fit peak with window = %d", window_size)
+                continue
+
+            fit_list = []
+            if type in {'gaussian_energy', 'lorentzian_energy'}:
+                energy = apply_jacobian_x(wavelength)
+                spectra_energy = apply_jacobian_y(wavelength, spectrum)
+            for (pos, amplitude) in peaks:
+                if type in {'gaussian_energy', 'lorentzian_energy'}:
+                    fit_list.extend(peak_to_energy(pos, width, amplitude))
+                else:
+                    fit_list.extend([pos, width, amplitude])
+
+            # Initialize the offset with the minimum possible value
+            offset = 0
+            fit_list.append(offset)
+            param_bounds = _GetBounds(wavelength, spectrum, type, len(peaks))
+
+            if future._fit_state == CANCELLED:
+                raise CancelledError()
+
+            try:
+                with warnings.catch_warnings():
+                    # Hide scipy/optimize/minpack.py:690: OptimizeWarning: Covariance of the parameters could not be estimated
+                    warnings.filterwarnings("ignore", "", OptimizeWarning)
+                    # TODO, from scipy 0.17, curve_fit() supports the 'bounds' parameter.
+                    # It could be used to ensure the peaks params are positives.
+                    # (Once we don't support Ubuntu 12.04)
                     if type in {'gaussian_energy', 'lorentzian_energy'}:
-                        energy = apply_jacobian_x(wavelength)
-                        spectra_energy = apply_jacobian_y(wavelength, spectrum)
-                        fit_list.extend(peak_to_energy(pos, width, amplitude))
-                        # lower & upper bounds for center position, width, amplitude in energy domain
-                        en_rng = energy[0] - energy[-1]
-                        lower_bounds.extend([energy[-1] - en_rng / 2, en_rng / 1e4, 0])
-                        upper_bounds.extend([energy[0] + en_rng / 2, en_rng * 10, numpy.inf])
+                        params, _ = curve_fit(FitFunction, energy, spectra_energy, p0=fit_list, bounds=param_bounds)
                     else:
-                        # lower & upper bounds for center position, width, amplitude in space domain
-                        fit_list.extend([pos, width, amplitude])
-                        lower_bounds.extend([wavelength[0] - wl_rng / 2, wl_rng / 1e3, 0])
-                        upper_bounds.extend([wavelength[-1] + wl_rng / 2, wl_rng * 10, numpy.inf])
-
-                # Initialize the offset with the minimum possible value
-                offset = 0
-                fit_list.append(offset)
-                # Set the lower & upper bounds for the offset
-                lower_bounds.extend([0])
-                upper_bounds.extend([min(spectrum)])
-                param_bounds = (lower_bounds, upper_bounds)
+                        params, _ = curve_fit(FitFunction, wavelength, spectrum, p0=fit_list, bounds=param_bounds)
+                break
+            except Exception as ex:
+                window_size = int(round(window_size * 1.2))
+                logging.debug("Retrying to fit peak with window = %d due to error %s", window_size, ex)
+                continue
+        else:
+            raise ValueError("Could not apply peak fitting of type %s." % type)
+        # reformat parameters to (list of 3 tuples, offset)
+        peaks_params = []
+        for pos, width, amplitude in _Grouped(params[:-1], 3):
+            # Note: to avoid negative peaks, the fit functions only take the
+            # absolute of the amplitude/width. So now amplitude and width
+            # have 50% chances to be negative => Force positive now.
+            if type in {'gaussian_energy', 'lorentzian_energy'}:
+                peaks_params.append(peak_to_wavelength(pos, width, amplitude))
+            else:
+                peaks_params.append((pos, width, amplitude))
 
-                if future._fit_state == CANCELLED:
-                    raise CancelledError()
+        return peaks_params, params[-1], type
 
-                try:
-                    with warnings.catch_warnings():
-                        # Hide scipy/optimize/minpack.py:690: OptimizeWarning: Covariance of the parameters could not be estimated
-                        warnings.filterwarnings("ignore", "", OptimizeWarning)
-                        # TODO, from scipy 0.17, curve_fit() supports the 'bounds' parameter.
-                        # It could be used to ensure the peaks params are positives.
-                        # (Once we don't support Ubuntu 12.04)
-                        if type in {'gaussian_energy', 'lorentzian_energy'}:
-                            params, _ = curve_fit(FitFunction, energy, spectra_energy, p0=fit_list, bounds=param_bounds)
-                        else:
-                            params, _ = curve_fit(FitFunction, wavelength, spectrum, p0=fit_list, bounds=param_bounds)
-                    break
-                except Exception as ex:
-                    window_size = int(round(window_size * 1.2))
-                    logging.debug("Retrying to fit peak with window = %d due to error %s", window_size, ex)
-                    continue
-            else:
-                raise ValueError("Could not apply peak fitting of type %s." % type)
-            # reformat parameters to (list of 3 tuples, offset)
-            peaks_params = []
-            for pos, width, amplitude in _Grouped(params[:-1], 3):
-                # Note: to avoid negative peaks, the fit functions only take the
-                # absolute of the amplitude/width. So now amplitude and width
-                # have 50% chances to be negative => Force positive now.
-                if type in {'gaussian_energy', 'lorentzian_energy'}:
-                    peaks_params.append(peak_to_wavelength(pos, width, amplitude))
-                else:
-                    peaks_params.append((pos, width, amplitude))
+    def FitMap(self, data, wavelength, type='gaussian_space', max_workers=None):
+        """
+        Fits the peaks of every spectrum of a spectrum map (ie, typically a CL
+        spectrum acquisition). First, the mean spectrum is fitted, to detect the
+        peaks. Then every spectrum is fitted with the same number of peaks, using
+        multiple processes. Each fit is initialized with the result of the
+        neighbouring spectrum, which makes it much faster than the fitting of
+        a single spectrum.
+        data (DataArray of shape C11YX or CYX): The spectrum map.
+        wavelength (1d array of floats): The wavelength values corresponding to the
+        spectra given.
+        type (str): Type of fitting to be applied ('gaussian_space', 'lorentzian_space',
+        'gaussian_energy' or 'lorentzian_energy')
+        max_workers (None or 0<int): Number of processes used. If None, it's
+        the number of CPUs.
+        returns (model.ProgressiveFuture): Progress of the fitting. Its result is:
+             params (list of 3-tuple of DataArrays): For each peak, the position,
+              width and amplitude maps (DataArrays of shape YX). If the fitting
+              failed for a given spectrum, the values are NaN.
+             offset (DataArray of shape YX): Global offset for each spectrum
+             type (str): The type of fitting
+        """
+        if data.ndim < 3 or numpy.prod(data.shape[1:-2]) != 1:
+            raise ValueError("Data should be of shape CYX, but got %s" % (data.shape,))
+        if type not in PEAK_FUNCTIONS:
+            raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
+
+        est_start = time.time() + 0.1
+        f = model.ProgressiveFuture(start=est_start,
+                                    end=est_start + self.estimateFitMapTime(data, max_workers))
+        f._fit_state = RUNNING
+        f._fit_lock = threading.Lock()
+        f.task_canceller = self._CancelFit
+
+        return self._executor.submitf(f, self._DoFitMap, f, data, wavelength, type, max_workers)
 
-            return peaks_params, params[-1], type
+    def _DoFitMap(self, future, data, wavelength, type, max_workers):
+        """
+        Fits the peaks of every spectrum of a spectrum map. See FitMap() for
+        the arguments.
+        future (model.ProgressiveFuture): Progressive future provided by the wrapper
+        """
+        try:
+            spectra = numpy.asarray(data).reshape(data.shape[0], data.shape[-2], data.shape[-1])
+            nrows, ncols = spectra.shape[1:]
+            energy_domain = type in {'gaussian_energy', 'lorentzian_energy'}
+
+            # Find the peaks on the mean spectrum, to get the same model for all the spectra
+            mean_spec = spectra.reshape(spectra.shape[0], -1).mean(axis=1)
+            peaks_params, offset, _ = self._FitSpectrum(future, mean_spec, wavelength, type)
+            seed = []
+            for pos, width, amplitude in peaks_params:
+                if energy_domain:
+                    seed.extend(peak_to_energy(pos, width, amplitude))
+                else:
+                    seed.extend((pos, width, amplitude))
+            seed.append(offset)
+            logging.debug("Fitting %d spectra with %d peaks", nrows * ncols, len(peaks_params))
+
+            # Each row is fitted independently, in a separate process, as curve_fit()
+            # is not thread-safe.
+            params = numpy.empty((nrows, ncols, len(seed)), dtype=numpy.float64)
+            executor = _CreateProcessPool(max_workers)
+            rfutures = {}
+            try:
+                for y in range(nrows):
+                    rf = executor.submit(_FitRow, spectra[:, y, :].T, wavelength, type, seed)
+                    rfutures[rf] = y
+
+                tstart = time.time()
+                ndone = 0
+                pending = set(rfutures)
+                while pending:
+                    # Check regularly for cancellation, even if a row takes long
+                    if future._fit_state == CANCELLED:
+                        raise CancelledError()
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for rf in done:
+                        params[rfutures[rf]] = rf.result()
+                        ndone += 1
+                    if done:
+                        # Update the estimated end time, based on the rows already done
+                        tnow = time.time()
+                        future.set_progress(end=tnow + (tnow - tstart) * (nrows - ndone) / ndone)
+            finally:
+                # Don't leave any worker behind: drop the rows not yet started,
+                # and wait for the ones running.
+                for rf in rfutures:
+                    rf.cancel()
+                executor.shutdown(wait=True)
+
+            nfailed = numpy.isnan(params[:, :, -1]).sum()
+            if nfailed:
+                logging.info("Failed to fit %d spectra out of %d", nfailed, nrows * ncols)
+
+            # Convert to one DataArray per peak parameter
+            md = {model.MD_DIMS: "YX"}
+            for k in (model.MD_POS, model.MD_PIXEL_SIZE, model.MD_ACQ_DATE):
+                if k in getattr(data, "metadata", {}):
+                    md[k] = data.metadata[k]
+            peaks_maps = []
+            for i in range(len(peaks_params)):
+                pos, width, amplitude = params[:, :, 3 * i], params[:, :, 3 * i + 1], params[:, :, 3 * i + 2]
+                if energy_domain:
+                    pos, width, amplitude = peak_to_wavelength(pos, width, amplitude)
+                peaks_maps.append((model.DataArray(pos, md.copy()),
+                                   model.DataArray(width, md.copy()),
+                                   model.DataArray(amplitude, md.copy())))
+            offset_map = model.DataArray(params[:, :, -1], md.copy())
+
+            return peaks_maps, offset_map, type
         except CancelledError:
-            logging.debug("Fitting of type %s was cancelled.", type)
+            logging.debug("Fitting map of type %s was cancelled.", type)
         finally:
             with future._fit_lock:
                 if future._fit_state == CANCELLED:
@@ -372,6 +491,18 @@ class PeakFitter(object):
         # really rough estimation
         return len(data) * 10e-3  # s
 
+    def estimateFitMapTime(self, data, max_workers=None):
+        """
+        Estimates the duration of fitting a spectrum map
+        data (DataArray of shape C11YX or CYX): The spectrum map.
+        max_workers (None or 0<int): Number of processes used.
+        """
+        # really rough estimation: a complete fit for the mean spectrum, and then
+        # each fit is fast, as it starts from the neighbour's parameters
+        nworkers = max_workers or multiprocessing.cpu_count()
+        npixels = data.shape[-1] * data.shape[-2]
+        return self.estimateFitTime(data) + npixels * len(data) * 50e-6 / nworkers  # s
+
 
 def peak_to_energy(pos, width, amplitude):
     """
@@ -496,6 +627,105 @@ def Curve(wavelength, peak_parameters, offset, type='gaussian_space'):
     return curve
 
 
+def _CreateProcessPool(max_workers):
+    """
+    Creates a process pool safe to use from a thread of a multi-threaded process.
+    Forking such a process (the default on Linux) only copies the calling thread,
+    which can leave locks held in the children, so the processes are started
+    from a fresh server process instead, when supported.
+    max_workers (None or 0<int): Number of processes used.
+    returns (ProcessPoolExecutor)
+    """
+    if sys.version_info >= (3, 7):
+        methods = multiprocessing.get_all_start_methods()
+        method = "forkserver" if "forkserver" in methods else "spawn"
+        return ProcessPoolExecutor(max_workers=max_workers,
+                                   mp_context=multiprocessing.get_context(method))
+    else:
+        # No way to select the start method per pool
+        return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def _FitRow(spectra, wavelength, type, seed):
+    """
+    Fits a series of spectra, typically a row of a spectrum map, with a given
+    number of peaks. Each fit is initialized with the result of the previous
+    spectrum, as neighbouring spectra are typically very similar.
+    Note: it's run in a separate process, by PeakFitter.FitMap().
+    spectra (2d array of shape N, C): The data representing the spectra.
+    wavelength (1d array of floats): The wavelength values corresponding to the
+    spectra given.
+    type (str): Type of fitting to be applied
+    seed (list of floats): Initial parameters (in the domain of the fitting),
+    used for the first spectrum, and whenever the previous fit failed.
+    returns (2d array of floats of shape N, P): The fitted parameters (in the
+    domain of the fitting), for each spectrum. NaN if the fitting failed.
+    """
+    FitFunction = PEAK_FUNCTIONS[type]
+    npeaks = (len(seed) - 1) // 3
+    energy_domain = type in {'gaussian_energy', 'lorentzian_energy'}
+    if energy_domain:
+        xdata = apply_jacobian_x(wavelength)
+    else:
+        xdata = numpy.asarray(wavelength)
+
+    params = numpy.empty((len(spectra), len(seed)), dtype=numpy.float64)
+    params[...] = numpy.nan
+    p0 = seed
+    for i, spectrum in enumerate(spectra):
+        spectrum = spectrum.astype(numpy.float64)
+        lower_bounds, upper_bounds = _GetBounds(wavelength, spectrum, type, npeaks)
+        if upper_bounds[-1] <= lower_bounds[-1]:
+            # No positive value in the spectrum => just leave a tiny room for the offset
+            upper_bounds[-1] = numpy.nextafter(lower_bounds[-1], numpy.inf)
+        if energy_domain:
+            ydata = apply_jacobian_y(wavelength, spectrum)
+        else:
+            ydata = spectrum
+
+        try:
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", "", OptimizeWarning)
+                p0 = numpy.clip(p0, lower_bounds, upper_bounds)
+                params[i], _ = curve_fit(FitFunction, xdata, ydata, p0=p0,
+                                         bounds=(lower_bounds, upper_bounds))
+            p0 = params[i]
+        except Exception as ex:
+            logging.debug("Failed to fit spectrum %d: %s", i, ex)
+            p0 = seed
+
+    return params
+
+
+def _GetBounds(wavelength, spectrum, type, npeaks):
+    """
+    Computes the bounds of the parameters for fitting a spectrum
+    wavelength (1d array of floats): The wavelength values corresponding to the
+    spectrum given.
+    spectrum (1d array of floats): The data representing the spectrum.
+    type (str): Type of fitting
+    npeaks (int): number of peaks fitted
+    returns (list of floats, list of floats): the lower and upper bounds for
+      each parameter: pos, width, amplitude for each peak, and finally the offset.
+    """
+    if type in {'gaussian_energy', 'lorentzian_energy'}:
+        # lower & upper bounds for center position, width, amplitude in energy domain
+        energy = apply_jacobian_x(wavelength)
+        en_rng = energy[0] - energy[-1]
+        lower_bounds = [energy[-1] - en_rng / 2, en_rng / 1e4, 0] * npeaks
+        upper_bounds = [energy[0] + en_rng / 2, en_rng * 10, numpy.inf] * npeaks
+    else:
+        # lower & upper bounds for center position, width, amplitude in space domain
+        wl_rng = wavelength[-1] - wavelength[0]
+        lower_bounds = [wavelength[0] - wl_rng / 2, wl_rng / 1e3, 0] * npeaks
+        upper_bounds = [wavelength[-1] + wl_rng / 2, wl_rng * 10, numpy.inf] * npeaks
+
+    # Set the lower & upper bounds for the offset
+    lower_bounds.append(0)
+    upper_bounds.append(min(spectrum))
+    return lower_bounds, upper_bounds
+
+
 def _Grouped(iterable, n):
     """
     Iterate over the iterable, n elements at a time
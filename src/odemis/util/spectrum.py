@@ -28,7 +28,9 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 from __future__ import division
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import numpy
 from odemis import model
 from builtins import range
 
@@ -194,3 +196,113 @@ def coefficients_to_dataarray(coef):
     da.metadata[model.MD_WL_LIST] = wl_list
 
     return da
+
+
+# Number of spectra processed at once by remove_spikes(). It bounds the memory
+# used for the temporary arrays (which are C * 4 bytes per spectrum).
+SPIKE_CHUNK_SIZE = 4096
+
+
+def remove_spikes(data, threshold=8, margin=1, spacing=3, max_workers=1):
+    """
+    Detect and remove the spikes in spectral data. Such peaks are typically
+    caused by cosmic rays hitting the CCD during acquisition.
+    The spike detection is performed by comparing the signal differential
+    with the average differential of the whole data. If the differential exceeds
+    the threshold, the spectrum pixel is marked as part of a spike. Each spike
+    is then replaced by a linear interpolation between its (extended) edges.
+    The spectra are processed independently, as they were acquired independently,
+    but in a vectorized way, by chunks of spectra.
+
+    :param data: (numpy.array of shape C...): the spectral data. All the other
+      dimensions are considered as independent spectra.
+    :param threshold: (0<float): sensitivity of the detection. The lower, the more
+      sensitive. It's relative to the root mean square of the differential.
+    :param margin: (0<=int): number of spectrum pixels left and right of each spike
+      that are also corrected.
+    :param spacing: (0<int): minimum distance (in spectrum pixels) between two parts of
+      a spectrum over the threshold to be considered two separate spikes.
+    :param max_workers: (0<int): number of threads processing the chunks of spectra
+      simultaneously.
+    :return:
+      corrected (numpy.array of same shape and dtype as data): the data without spikes
+      npixels (int): number of spectra (ie, e-beam positions) corrected
+      nspikes (int): total number of spikes corrected
+    """
+    corrected = data.copy()
+    nc = data.shape[0]
+    if nc < 2:
+        return corrected, 0, 0
+    specs = corrected.reshape(nc, -1)  # C, N
+    n = specs.shape[1]
+    chunks = [slice(i, min(i + SPIKE_CHUNK_SIZE, n)) for i in range(0, n, SPIKE_CHUNK_SIZE)]
+
+    # The threshold is based on the global average. Using a more local average
+    # could help identifying spikes more precisely, but it's more involved and
+    # possibly overkill.
+    # The differential requires higher precision than 16 bits, as it is squared.
+    ms_step = 0
+    for c in chunks:
+        ms_step += (numpy.diff(specs[:, c].astype(numpy.float32), axis=0) ** 2).sum(dtype=numpy.float64)
+    ms_step /= (nc - 1) * n
+    sq_threshold = ms_step * threshold ** 2
+
+    def remove_spikes_chunk(c):
+        return _remove_spikes_chunk(specs[:, c], sq_threshold, margin, spacing)
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            counts = list(executor.map(remove_spikes_chunk, chunks))
+    else:
+        counts = [remove_spikes_chunk(c) for c in chunks]
+
+    npixels = sum(c[0] for c in counts)
+    nspikes = sum(c[1] for c in counts)
+    logging.debug("Corrected %d spikes in %d spectra", nspikes, npixels)
+    return corrected, npixels, nspikes
+
+
+def _remove_spikes_chunk(specs, sq_threshold, margin, spacing):
+    """
+    Remove the spikes of the given spectra. See remove_spikes() for the details.
+    specs (numpy.array of shape C, N): the spectra, which are updated in place
+    sq_threshold (float): the threshold for the squared differential
+    return:
+      npixels (int): number of spectra corrected
+      nspikes (int): number of spikes corrected
+    """
+    nc = specs.shape[0]
+    over = numpy.diff(specs.astype(numpy.float32), axis=0) ** 2 > sq_threshold  # C-1, N
+
+    # Only one step that deviates is no spike
+    has_spikes = numpy.count_nonzero(over, axis=0) > 1
+    pixels = numpy.flatnonzero(has_spikes)
+    if not pixels.size:
+        return 0, 0
+
+    # All the indices above threshold, sorted by spectrum, and then by index
+    pi, idx = numpy.nonzero(over[:, pixels].T)
+
+    # Split into spikes: a new spike starts either on a new spectrum, or when
+    # the previous index above threshold is far enough.
+    starts = numpy.ones(idx.shape, dtype=bool)
+    starts[1:] = (pi[1:] != pi[:-1]) | (numpy.diff(idx) > spacing)
+    sstart = numpy.flatnonzero(starts)
+    send = numpy.append(sstart[1:], idx.size) - 1
+    spix = pixels[pi[sstart]]  # spectrum of each spike
+    low = numpy.maximum(idx[sstart] - margin, 0)
+    high = numpy.minimum(idx[send] + margin, nc - 1)
+
+    # Replace each spike by a line between its edges, without the edges which
+    # are kept as-is.
+    length = high - low + 1
+    vlow = specs[low, spix].astype(numpy.float64)
+    vhigh = specs[high, spix].astype(numpy.float64)
+    step = (vhigh - vlow) / numpy.maximum(length - 1, 1)
+    sid = numpy.repeat(numpy.arange(spix.size), length)
+    k = numpy.arange(sid.size) - numpy.repeat(numpy.cumsum(length) - length, length)
+    inside = (k > 0) & (k < length[sid] - 1)
+    sid, k = sid[inside], k[inside]
+    specs[low[sid] + k, spix[sid]] = k * step[sid] + vlow[sid]
+
+    return pixels.size, spix.size
@@ -213,6 +213,134 @@ def FindCenterCoordinates(image, smoothing=True):
     return xc, yc
 
 
+def FindCenterCoordinatesBatch(images, smoothing=True):
+    """
+    Returns the radial symmetry center of multiple images with sub-pixel
+    resolution. It gives the same result as calling FindCenterCoordinates() on
+    each image, but all the images of the same shape are processed at once, in
+    a vectorized way, which is much faster when there are many images.
+
+    Parameters
+    ----------
+    images : array_like of shape (N, h, w), or sequence of N 2D array_like
+        The images of which to determine the radial symmetry center. If passed
+        as a sequence, the images can have different shapes.
+    smoothing : boolean
+        Apply a smoothing kernel to the intensity gradient.
+
+    Returns
+    -------
+    pos : array like of shape (N, 2)
+        Position (x, y) of the radial symmetry center of each image in px from
+        the center of the image.
+
+    """
+    if isinstance(images, numpy.ndarray) and images.ndim == 3:
+        return _FindCenterCoordinatesStack(images.astype(numpy.float64), smoothing)
+
+    # Group the images by shape, and process each group at once
+    pos = numpy.empty((len(images), 2), dtype=numpy.float64)
+    shapes = {}
+    for i, im in enumerate(images):
+        shapes.setdefault(numpy.shape(im), []).append(i)
+    for idx in shapes.values():
+        stack = numpy.array([images[i] for i in idx], dtype=numpy.float64)
+        pos[idx] = _FindCenterCoordinatesStack(stack, smoothing)
+    return pos
+
+
+def _FindCenterCoordinatesStack(images, smoothing):
+    """
+    Vectorized version of FindCenterCoordinates() on a stack of images.
+
+    Parameters
+    ----------
+    images : array like of float of shape (N, n, m)
+        The images of which to determine the radial symmetry center.
+    smoothing : boolean
+        Apply a smoothing kernel to the intensity gradient.
+
+    Returns
+    -------
+    pos : array like of shape (N, 2)
+        Position (x, y) of the radial symmetry center of each image in px from
+        the center of the image.
+
+    """
+    n, m = images.shape[1:]
+
+    # Compute lattice midpoints (ik, jk).
+    jk, ik = numpy.meshgrid(numpy.arange(m - 1) + 0.5, numpy.arange(n - 1) + 0.5)
+
+    # Calculate the intensity gradient, identical to the 2x2 convolutions done
+    # in FindCenterCoordinates().
+    d1 = images[:, 1:, 1:] - images[:, :-1, :-1]
+    d2 = images[:, 1:, :-1] - images[:, :-1, 1:]
+    dIdi = d1 + d2
+    dIdj = d1 - d2
+    if smoothing:
+        # 3x3 mean filter with symmetric boundaries
+        dIdi = _BoxFilter3x3(dIdi)
+        dIdj = _BoxFilter3x3(dIdj)
+    dI2 = numpy.square(dIdi) + numpy.square(dIdj)
+
+    # Entries where the intensity gradient magnitude is zero are ignored, by
+    # setting their weight to 0.
+    valid = dI2 > 0
+    dI = numpy.sqrt(dI2)
+    dI[~valid] = 1  # Any value, to avoid the division by 0
+
+    # Construct the set of equations for a line passing through the midpoint
+    # (ik, jk), parallel to the gradient intensity, in implicit form:
+    # `a*i + b*j + c = 0`, normalized such that `a^2 + b^2 = 1`.
+    a = -dIdj / dI
+    b = dIdi / dI
+    c = a * ik + b * jk
+
+    # Weighting: weight by the square of the gradient magnitude and inverse
+    # distance to the centroid of the square of the gradient intensity
+    # magnitude.
+    sdI2 = numpy.sum(dI2, axis=(1, 2))
+    i0 = numpy.sum(dI2 * ik, axis=(1, 2)) / sdI2
+    j0 = numpy.sum(dI2 * jk, axis=(1, 2)) / sdI2
+    dist = numpy.hypot(ik - i0[:, None, None], jk - j0[:, None, None])
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        w2 = numpy.where(valid, dI2 / dist, 0)
+
+    # Solve the linear set of equations in a least-squares sense, for each
+    # image, via the (2x2) normal equations.
+    saa = numpy.sum(w2 * a * a, axis=(1, 2))
+    sab = numpy.sum(w2 * a * b, axis=(1, 2))
+    sbb = numpy.sum(w2 * b * b, axis=(1, 2))
+    sac = numpy.sum(w2 * a * c, axis=(1, 2))
+    sbc = numpy.sum(w2 * b * c, axis=(1, 2))
+    det = saa * sbb - sab * sab
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ic = (sbb * sac - sab * sbc) / det
+        jc = (saa * sbc - sab * sac) / det
+
+    # Convert from index (top-left) to (center) position information.
+    xc = jc - 0.5 * float(m) + 0.5
+    yc = ic - 0.5 * float(n) + 0.5
+
+    return numpy.stack((xc, yc), axis=1)
+
+
+def _BoxFilter3x3(data):
+    """
+    Apply a 3x3 mean filter on the last 2 dimensions, with symmetric boundaries.
+    Same as scipy.signal.convolve2d(data, numpy.ones((3, 3)) / 9, boundary='symm', mode='same')
+    but for a stack of images.
+    data (array like of shape (N, n, m))
+    returns (array like of shape (N, n, m))
+    """
+    n, m = data.shape[1:]
+    padded = numpy.pad(data, ((0, 0), (1, 1), (1, 1)), mode="symmetric")
+    # sum over the 3 rows, then over the 3 columns
+    rows = padded[:, 0:n] + padded[:, 1:n + 1] + padded[:, 2:n + 2]
+    return (rows[:, :, 0:m] + rows[:, :, 1:m + 1] + rows[:, :, 2:m + 2]) / 9
+
+
 def _CreateSEDisk(r=3):
     """
     Create a flat disk-shaped structuring element with the specified radius r. The structuring element can be used
@@ -281,10 +409,10 @@ def MaximaFind(image, qty, len_object=18):
         logging.debug("Only %d maxima found, while expected %d", len(pos), qty)
     # Improve center estimate using radial symmetry method.
     w = len_object // 2
-    refined_center = numpy.zeros_like(pos)
     pos = numpy.rint(pos).astype(numpy.int16)
     y_max, x_max = image.shape
-    for idx, xy in enumerate(pos):
+    spots = []
+    for xy in pos:
         x_start, y_start = xy - w + 1
         x_end, y_end = xy + w
         # If the spot is near the edge of the image, crop so it is still in the center of the sub-image. Subtract the
@@ -302,8 +430,9 @@ def MaximaFind(image, qty, len_object=18):
         elif y_end > y_max:
             y_start += y_end - y_max
             y_end = y_max
-        spot = filtered[y_start:y_end, x_start:x_end]
-        refined_center[idx] = numpy.array(FindCenterCoordinates(spot))
+        spots.append(filtered[y_start:y_end, x_start:x_end])
+    # All the spots are processed at once (most of them have the same shape)
+    refined_center = FindCenterCoordinatesBatch(spots)
     refined_position = pos + refined_center
     return refined_position
 
@@ -21,12 +21,14 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 from __future__ import division
 
+from ctypes import c_uint16, addressof
 import logging
+import numpy
 from odemis import model
 import odemis
 from odemis.util import test
 from odemis.util.driver import getSerialDriver, speedUpPyroConnect, readMemoryUsage, \
-    get_linux_version
+    get_linux_version, BufferPool
 import os
 import sys
 import time
@@ -83,6 +85,47 @@ class TestDriver(unittest.TestCase):
                 v = get_linux_version()
 
 
+class TestBufferPool(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = BufferPool(max_buffers=4)
+        cbuffer = pool.get(c_uint16, 200)
+        self.assertEqual(len(cbuffer), 200)
+        addr = addressof(cbuffer)
+        da = model.DataArray(numpy.ctypeslib.as_array(cbuffer).reshape(10, 20))
+        del cbuffer
+
+        # A view on the data is enough to keep the buffer in use
+        sub = da[2:5, :]
+        del da
+        cbuffer2 = pool.get(c_uint16, 200)
+        self.assertNotEqual(addressof(cbuffer2), addr)
+
+        # Once nothing uses it anymore, it should be reused
+        del sub
+        cbuffer3 = pool.get(c_uint16, 200)
+        self.assertEqual(addressof(cbuffer3), addr)
+
+        # Different size => new buffer
+        cbuffer4 = pool.get(c_uint16, 100)
+        self.assertEqual(len(cbuffer4), 100)
+
+    def test_full(self):
+        pool = BufferPool(max_buffers=2)
+        buffers = [pool.get(c_uint16, 50) for i in range(5)]
+        addrs = set(addressof(b) for b in buffers)
+        self.assertEqual(len(addrs), 5)
+
+        del buffers
+        # Only the first 2 buffers are kept
+        b1 = pool.get(c_uint16, 50)
+        b2 = pool.get(c_uint16, 50)
+        b3 = pool.get(c_uint16, 50)
+        self.assertEqual(len({addressof(b1), addressof(b2)} & addrs), 2)
+        self.assertNotEqual(addressof(b3), addressof(b1))
+        self.assertNotEqual(addressof(b3), addressof(b2))
+
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
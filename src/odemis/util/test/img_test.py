@@ -22,6 +22,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division, print_function
 
 import logging
+import matplotlib.colors as colors
 import numpy
 from odemis import model
 from odemis.util import img, get_best_dtype_for_acc
@@ -592,6 +593,55 @@ class TestDataArray2RGB(unittest.TestCase):
         self.assertEqual(hist[-2], 0)
 
 
+class TestSubtract2RGBHistogram(unittest.TestCase):
+
+    def test_simple(self):
+        data = numpy.zeros((251, 200), dtype="uint16")
+        data[:, :] = numpy.arange(200) * 20
+        data[2, :] = 56
+        data[200, 2] = 3
+        bkg = numpy.full(data.shape, 100, dtype="uint16")
+        bkg[:, 50] = 5000  # more than data => should be clipped to 0
+        irange = (10, 3000)
+
+        for b in (None, bkg):
+            rgb, hist = img.Subtract2RGBHistogram(data, b, irange)
+            if b is None:
+                sub = data
+            else:
+                sub = img.Subtract(data, b)
+            numpy.testing.assert_array_equal(hist, numpy.bincount(sub.flat))
+            exp_rgb = img.DataArray2RGB(sub, irange)
+            self.assertEqual(rgb.shape, data.shape + (3,))
+            # ±1, to handle the rounding differences of the standard converter
+            numpy.testing.assert_almost_equal(rgb, exp_rgb, decimal=0)
+
+    def test_tint(self):
+        data = numpy.zeros((10, 20), dtype="uint16")
+        data[:, 10:] = 1000
+        bkg = numpy.ones(data.shape, dtype="uint16")
+        rgb, hist = img.Subtract2RGBHistogram(data, bkg, (0, 999), (0, 73, 255))
+        self.assertEqual(hist[0], 100)
+        self.assertEqual(hist[999], 100)
+        self.assertEqual(hist.size, 1000)
+        numpy.testing.assert_array_equal(rgb[0, 0], [0, 0, 0])
+        numpy.testing.assert_array_equal(rgb[0, 15], [0, 73, 255])
+
+    def test_unsupported(self):
+        data = numpy.zeros((10, 20), dtype="uint8")
+        with self.assertRaises(ValueError):
+            img.Subtract2RGBHistogram(data, None, (0, 255))
+
+        data = numpy.zeros((10, 20), dtype="uint16")
+        bkg = numpy.zeros((20, 10), dtype="uint16")
+        with self.assertRaises(ValueError):
+            img.Subtract2RGBHistogram(data, bkg, (0, 255))
+
+        with self.assertRaises(ValueError):
+            cmap = colors.LinearSegmentedColormap.from_list("test", ["black", "red"])
+            img.Subtract2RGBHistogram(data, None, (0, 255), cmap)
+
+
 class TestMergeMetadata(unittest.TestCase):
 
     def test_simple(self):
@@ -90,6 +90,35 @@ class TestPeak(unittest.TestCase):
         # Assert wrong fitting type
         self.assertRaises(KeyError, peak.Curve, wl, params, offset, type='wrongType')
 
+    def test_fit_map(self):
+        data = self.data[:, 15:21, 15:23]
+        wl = self.wl_in_meters
+
+        for fit_type in ('gaussian_space', 'lorentzian_energy'):
+            f = self._peak_fitter.FitMap(data, wl, type=fit_type)
+            params, offset, curve_type = f.result()
+            self.assertEqual(curve_type, fit_type)
+            self.assertEqual(offset.shape, data.shape[1:])
+            self.assertTrue(1 <= len(params) < 20)
+            for pos, width, amplitude in params:
+                for m in (pos, width, amplitude):
+                    self.assertEqual(m.shape, data.shape[1:])
+                # Most pixels should be fitted, with positive parameters
+                fitted = ~numpy.isnan(pos)
+                self.assertGreater(numpy.count_nonzero(fitted), pos.size // 2)
+                self.assertTrue(numpy.all(pos[fitted] > 0))
+                self.assertTrue(numpy.all(width[fitted] > 0))
+                self.assertTrue(numpy.all(amplitude[fitted] >= 0))
+
+        # Wrong shape
+        with self.assertRaises(ValueError):
+            self._peak_fitter.FitMap(data[:, 0, :], wl)
+
+    def test_fit_map_cancel(self):
+        f = self._peak_fitter.FitMap(self.data, self.wl_in_meters)
+        f.cancel()
+        self.assertTrue(f.cancelled())
+
     def test_peakfitting_space(self):
         data = self.data
         wl = self.wl_in_pixels
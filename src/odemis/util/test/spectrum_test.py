@@ -66,5 +66,55 @@ class TestCoefToDA(unittest.TestCase):
         numpy.testing.assert_equal(da[:, 0, 0, 0, 0], dcalib)
         numpy.testing.assert_equal(da.metadata[model.MD_WL_LIST], wl_calib * 1e-9)
 
+
+class TestRemoveSpikes(unittest.TestCase):
+
+    def setUp(self):
+        # Smooth spectra (a gaussian), with a few spikes
+        shape = (512, 1, 1, 30, 40)
+        wl = numpy.arange(shape[0])
+        spec = 100 + 1000 * numpy.exp(-(wl - 250) ** 2 / (2 * 50 ** 2))
+        self.orig = numpy.empty(shape, dtype=numpy.uint16)
+        self.orig[...] = spec.reshape(shape[0], 1, 1, 1, 1)
+
+        self.data = self.orig.copy()
+        self.data[100, 0, 0, 3, 5] += 5000  # 1 px spike
+        self.data[300:303, 0, 0, 10, 20] += 8000  # 3 px spike
+        self.data[20, 0, 0, 12, 7] += 6000  # 2 spikes in the same spectrum
+        self.data[400, 0, 0, 12, 7] += 6000
+        self.data[1, 0, 0, 29, 39] += 6000  # spike at the beginning
+        self.data[510, 0, 0, 0, 0] += 6000  # spike at the end
+
+    def test_simple(self):
+        corrected, npixels, nspikes = spectrum.remove_spikes(self.data)
+        self.assertEqual(corrected.shape, self.data.shape)
+        self.assertEqual(corrected.dtype, self.data.dtype)
+        self.assertEqual(npixels, 5)
+        self.assertEqual(nspikes, 6)
+        # The original data is not modified
+        self.assertEqual(self.data[100, 0, 0, 3, 5], self.orig[100, 0, 0, 3, 5] + 5000)
+        # The spikes are replaced by values close from the original ones
+        numpy.testing.assert_allclose(corrected, self.orig, atol=5)
+
+    def test_no_spike(self):
+        corrected, npixels, nspikes = spectrum.remove_spikes(self.orig)
+        self.assertEqual((npixels, nspikes), (0, 0))
+        numpy.testing.assert_array_equal(corrected, self.orig)
+
+    def test_parallel(self):
+        """
+        Check the result is the same when running in parallel on multiple chunks
+        """
+        exp_corrected, exp_npixels, exp_nspikes = spectrum.remove_spikes(self.data)
+        prev_chunk_size = spectrum.SPIKE_CHUNK_SIZE
+        spectrum.SPIKE_CHUNK_SIZE = 50
+        try:
+            corrected, npixels, nspikes = spectrum.remove_spikes(self.data, max_workers=4)
+        finally:
+            spectrum.SPIKE_CHUNK_SIZE = prev_chunk_size
+        self.assertEqual((npixels, nspikes), (exp_npixels, exp_nspikes))
+        numpy.testing.assert_array_equal(corrected, exp_corrected)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -217,6 +217,26 @@ class TestFindCenterCoordinates(unittest.TestCase):
                         self.assertAlmostEqual(j, xc + 0.5 * (m - 1))
                         self.assertAlmostEqual(i, yc + 0.5 * (n - 1))
 
+    def test_batch(self):
+        """
+        FindCenterCoordinatesBatch should give the same result as
+        FindCenterCoordinates on each image, including when the images have
+        different shapes.
+        """
+        coords = numpy.array(list(map(spot.FindCenterCoordinates, self.imgdata)))
+        coords_batch = spot.FindCenterCoordinatesBatch(numpy.asarray(self.imgdata))
+        numpy.testing.assert_almost_equal(coords_batch, coords, 10)
+
+        imgs = []
+        for n, m, i, j in ((7, 7, 3, 2), (9, 11, 5, 6), (7, 7, 2, 4), (12, 8, 6, 3)):
+            img = numpy.zeros((n, m))
+            img[i, j] = 1
+            imgs.append(img)
+        coords = numpy.array([spot.FindCenterCoordinates(img) for img in imgs])
+        coords_batch = spot.FindCenterCoordinatesBatch(imgs)
+        self.assertEqual(coords_batch.shape, (len(imgs), 2))
+        numpy.testing.assert_almost_equal(coords_batch, coords, 10)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -26,6 +26,7 @@ import itertools
 import numpy
 from numpy.linalg import LinAlgError
 import unittest
+from unittest import mock
 
 from odemis.util.spot import GridPoints
 from odemis.util.transform import (_rotation_matrix_from_angle,
@@ -878,5 +879,83 @@ class AnamorphosisTransformKnownValues(unittest.TestCase):
             self.assertAlmostEqual(scale, numpy.abs(b1))
 
 
+class TransformApplyInverse(unittest.TestCase):
+
+    def test_apply_inverse_roundtrip(self):
+        """
+        apply_inverse should return the same result as inverse().apply, also
+        for many points at once.
+        """
+        x = numpy.random.uniform(-10, 10, (1000, 2))
+        for tform in (RigidTransform(rotation=ROT45, translation=TXY),
+                      SimilarityTransform(rotation=ROT90, scale=SQ2, translation=TX),
+                      ScalingTransform(rotation=ROT135, scale=S23, translation=TY),
+                      AffineTransform(rotation=-ROT45, scale=S23, shear=0.5, translation=TXY)):
+            y = tform.apply(x)
+            numpy.testing.assert_array_almost_equal(tform.inverse().apply(y), tform.apply_inverse(y))
+            numpy.testing.assert_array_almost_equal(x, tform.apply_inverse(y))
+
+    def test_apply_parameter_change(self):
+        """
+        Changing the parameters should be taken into account by apply.
+        """
+        tform = AffineTransform(rotation=ROT45, scale=S23, translation=TXY)
+        src = RIGID_KNOWN_VALUES[0][-1]
+        tform.apply(src)
+        tform.apply_inverse(src)
+        tform.rotation = ROT90
+        tform.scale = (1., 1.)
+        expected = RigidTransform(rotation=ROT90, translation=TXY).apply(src)
+        numpy.testing.assert_array_almost_equal(expected, tform.apply(src))
+        numpy.testing.assert_array_almost_equal(src, tform.apply_inverse(expected))
+
+
+    def test_apply_inverse_cached(self):
+        """
+        The inverse matrix should only be computed again when a parameter changes.
+        """
+        tform = AffineTransform(rotation=ROT45, scale=S23, shear=0.5, translation=TXY)
+        y = tform.apply(RIGID_KNOWN_VALUES[0][-1])
+        with mock.patch("numpy.linalg.inv", wraps=numpy.linalg.inv) as inv:
+            x1 = tform.apply_inverse(y)
+            x2 = tform.apply_inverse(y)
+            self.assertEqual(inv.call_count, 1)
+            numpy.testing.assert_array_equal(x1, x2)
+
+            tform.shear = 0
+            x3 = tform.apply_inverse(y)
+            self.assertEqual(inv.call_count, 2)
+            expected = AffineTransform(rotation=ROT45, scale=S23, translation=TXY).apply_inverse(y)
+            numpy.testing.assert_array_almost_equal(expected, x3)
+
+
+class TransformFromPointsetRansac(unittest.TestCase):
+
+    def test_from_pointset_ransac_outliers(self):
+        """
+        from_pointset_ransac should find the transformation, even when a large
+        part of the points are outliers, and report which points are inliers.
+        """
+        rng = numpy.random.RandomState(42)
+        src = rng.uniform(-100, 100, (400, 2))
+        outliers = rng.uniform(size=len(src)) < 0.3
+        for tform in (RigidTransform(rotation=ROT45, translation=TXY),
+                      SimilarityTransform(rotation=ROT90, scale=SQ2, translation=TX),
+                      ScalingTransform(rotation=ROT135, scale=S23, translation=TY),
+                      AffineTransform(rotation=-ROT45, scale=S23, shear=0.5, translation=TXY)):
+            dst = tform.apply(src) + rng.normal(0, 1e-3, src.shape)
+            dst[outliers] += rng.uniform(10, 50, (numpy.count_nonzero(outliers), 2))
+            est, inliers = tform.__class__.from_pointset_ransac(src, dst, 0.01, random_state=rng)
+            self.assertIsInstance(est, tform.__class__)
+            numpy.testing.assert_array_equal(inliers, ~outliers)
+            numpy.testing.assert_array_almost_equal(tform.transformation_matrix,
+                                                    est.transformation_matrix, decimal=4)
+            numpy.testing.assert_array_almost_equal(tform.translation, est.translation, decimal=3)
+
+    def test_from_pointset_ransac_not_enough_points(self):
+        with self.assertRaises(ValueError):
+            AffineTransform.from_pointset_ransac([(0., 0.), (1., 0.)], [(0., 0.), (1., 0.)], 0.1)
+
+
 if __name__ == '__main__':
     unittest.main()
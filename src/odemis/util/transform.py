@@ -194,6 +194,91 @@ def _optimal_rotation(x, y):
     return numpy.dot(V.T, U.T)
 
 
+def _rigid_candidates(x, y, scaling=False):
+    """
+    Returns the optimal rigid (or similarity) transformations of multiple
+    pairs of point sets, all computed at once.
+
+    Parameters
+    ----------
+    x : (m, k, 2) array
+        m sets of k coordinates in the source reference frame.
+    y : (m, k, 2) array
+        m sets of k coordinates in the destination reference frame.
+    scaling : bool
+        If True, also estimate the isotropic scaling (similarity transform).
+
+    Returns
+    -------
+    matrix : (m, 2, 2) array
+        Transformation matrices.
+    translation : (m, 2) array
+        Translation vectors.
+
+    """
+    x0 = numpy.mean(x, axis=1)
+    y0 = numpy.mean(y, axis=1)
+    dx = x - x0[:, numpy.newaxis]
+    dy = y - y0[:, numpy.newaxis]
+    H = numpy.einsum('mni,mnj->mij', dx, dy)
+    U, _, V = numpy.linalg.svd(H)  # H = USV (not V')
+    improper = numpy.linalg.det(U) * numpy.linalg.det(V) < 0.0
+    U[improper, :, -1] = -U[improper, :, -1]
+    A = numpy.einsum('mji,mkj->mik', V, U)  # V'U'
+    if scaling:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            s = (numpy.einsum('mik,mjk,mji->m', A, dx, dy) /
+                 numpy.einsum('mij,mij->m', dx, dx))
+        A *= s[:, numpy.newaxis, numpy.newaxis]
+    t = y0 - numpy.einsum('mik,mk->mi', A, x0)
+    return A, t
+
+
+def _similarity_candidates(x, y):
+    """
+    Returns the optimal similarity transformations of multiple pairs of point
+    sets, all computed at once. See `_rigid_candidates`.
+    """
+    return _rigid_candidates(x, y, scaling=True)
+
+
+def _affine_candidates(x, y):
+    """
+    Returns the least-squares affine transformations of multiple pairs of
+    point sets, all computed at once. The degenerate point sets (eg, collinear
+    points) are skipped.
+
+    Parameters
+    ----------
+    x : (m, k, 2) array
+        m sets of k coordinates in the source reference frame.
+    y : (m, k, 2) array
+        m sets of k coordinates in the destination reference frame.
+
+    Returns
+    -------
+    matrix : (m', 2, 2) array
+        Transformation matrices, with m' <= m.
+    translation : (m', 2) array
+        Translation vectors.
+
+    """
+    x0 = numpy.mean(x, axis=1)
+    y0 = numpy.mean(y, axis=1)
+    dx = x - x0[:, numpy.newaxis]
+    dy = y - y0[:, numpy.newaxis]
+    # Normal equations of dy = dx A', for all the point sets
+    XtX = numpy.einsum('mni,mnj->mij', dx, dx)
+    XtY = numpy.einsum('mni,mnj->mij', dx, dy)
+    det = numpy.linalg.det(XtX)
+    norm = numpy.einsum('mii->m', XtX)
+    valid = numpy.abs(det) > 1e-12 * norm * norm
+    P = numpy.linalg.solve(XtX[valid], XtY[valid])
+    A = numpy.transpose(P, (0, 2, 1))
+    t = y0[valid] - numpy.einsum('mik,mk->mi', A, x0[valid])
+    return A, t
+
+
 def to_physical_space(ji, shape=None, pixel_size=None):
     """
     Converts an image pixel index into a coordinate in physical space.
@@ -426,7 +511,8 @@ class GeometricTransform(with_metaclass(ABCMeta, object)):
         Parameters
         ----------
         x : ndarray
-            Input coordinates
+            Input coordinates. Any number of coordinates can be passed at once,
+            as an array of shape (..., 2).
 
         Returns
         -------
@@ -437,6 +523,79 @@ class GeometricTransform(with_metaclass(ABCMeta, object)):
         x = numpy.asarray(x)
         return numpy.einsum('ik,...k->...i', self.transformation_matrix, x) + self.translation
 
+    def apply_inverse(self, y):
+        """
+        Apply the inverse transformation to a (set of) output coordinates.
+        Equivalent to `inverse().apply(y)`, but without creating a new
+        transformation.
+
+        Parameters
+        ----------
+        y : ndarray
+            Output coordinates. Any number of coordinates can be passed at
+            once, as an array of shape (..., 2).
+
+        Returns
+        -------
+        x : ndarray
+            Input coordinates; same shape as `y`.
+
+        """
+        y = numpy.asarray(y)
+        return numpy.einsum('ik,...k->...i', self._get_inverse_matrix(), y - self.translation)
+
+    def _get_inverse_matrix(self):
+        """
+        Returns the inverse of the transformation matrix. It is only computed
+        once, and then cached until one of the parameters (rotation, scale or
+        shear) is set again.
+        Note: modifying a parameter in-place (eg, `tform.scale[0] = 2`) is not
+        detected, so the parameter should always be set as a whole.
+
+        Returns
+        -------
+        matrix : (2, 2) array
+            Inverse of the transformation matrix.
+
+        """
+        matrix = getattr(self, "_inverse_matrix", None)
+        if matrix is None:
+            matrix = numpy.linalg.inv(self.transformation_matrix)
+            self._inverse_matrix = matrix
+        return matrix
+
+    # The parameters of the transformation matrix. Each time they are set, the
+    # cached inverse matrix is discarded.
+    @property
+    def rotation(self):
+        """Rotation angle in counter-clockwise direction as radians."""
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self._rotation = rotation
+        self._inverse_matrix = None
+
+    @property
+    def scale(self):
+        """x, y scale factors."""
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale = scale
+        self._inverse_matrix = None
+
+    @property
+    def shear(self):
+        """Shear factor."""
+        return self._shear
+
+    @shear.setter
+    def shear(self, shear):
+        self._shear = shear
+        self._inverse_matrix = None
+
     def __call__(self, x):
         warnings.warn("__call__ is deprecated, use apply instead",
                       DeprecationWarning)
@@ -531,6 +690,11 @@ class RigidTransform(GeometricTransform):
 
     """
 
+    # Number of points needed to estimate the transformation, and estimator of
+    # the transformations of multiple point sets at once (cf from_pointset_ransac)
+    _min_samples = 2
+    _estimate_candidates = staticmethod(_rigid_candidates)
+
     def __init__(self, matrix=None, rotation=None, translation=None):
         GeometricTransform.__init__(self, matrix=matrix, rotation=rotation,
                                     translation=translation)
@@ -568,6 +732,89 @@ class RigidTransform(GeometricTransform):
         t = y0 - numpy.dot(R, x0)
         return cls(matrix=R, translation=t)
 
+    @classmethod
+    def from_pointset_ransac(cls, x, y, threshold, max_trials=1000, random_state=None):
+        """
+        Estimate the transformation from a set of corresponding points, which
+        may contain outliers (RANSAC).
+
+        Random minimal subsets of the points are drawn, and the candidate
+        transformations of all the subsets are computed at once. The candidate
+        matching the most points is selected, and the transformation is then
+        estimated with `from_pointset` on the points matching it (the inliers).
+
+        Parameters
+        ----------
+        x : (n, 2) array
+            Coordinates in the source reference frame.
+        y : (n, 2) array
+            Coordinates in the destination reference frame. Must be of same
+            dimensions as `x`.
+        threshold : float, positive
+            Maximum distance, in the destination reference frame, between a
+            transformed point and its corresponding point to be an inlier.
+        max_trials : int, positive
+            Number of random subsets drawn.
+        random_state : numpy.random.RandomState, optional
+            Random generator used to draw the subsets, to get reproducible
+            results.
+
+        Returns
+        -------
+        tform : RigidTransform
+            Optimal coordinate transformation, of the same class as `cls`.
+        inliers : (n,) array of bool
+            True for the points matching the transformation.
+
+        Raises
+        ------
+        ValueError
+            If there are not enough points, or no transformation matching
+            enough points is found.
+
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        n = len(x)
+        k = cls._min_samples
+        if n < k:
+            raise ValueError("At least %d points are needed, but got %d" % (k, n))
+        if random_state is None:
+            random_state = numpy.random.RandomState()
+
+        # Draw all the subsets, and discard the ones with duplicated points
+        idx = random_state.randint(0, n, size=(max_trials, k))
+        idx = idx[numpy.all(numpy.diff(numpy.sort(idx, axis=1), axis=1) > 0, axis=1)]
+        A, t = cls._estimate_candidates(x[idx], y[idx])
+
+        # Count the inliers of each candidate, a chunk of candidates at a time,
+        # to limit the memory usage.
+        best_count = 0
+        best = None
+        chunk = max(1, 2 ** 20 // n)
+        for i in range(0, len(A), chunk):
+            Ac, tc = A[i:i + chunk], t[i:i + chunk]
+            delta = numpy.matmul(x, numpy.transpose(Ac, (0, 2, 1))) + tc[:, numpy.newaxis] - y
+            with numpy.errstate(invalid='ignore'):
+                dist2 = numpy.einsum('mni,mni->mn', delta, delta)
+                counts = numpy.count_nonzero(dist2 <= threshold ** 2, axis=1)
+            j = numpy.argmax(counts)
+            if counts[j] > best_count:
+                best_count = counts[j]
+                best = Ac[j], tc[j]
+
+        if best_count < k:
+            raise ValueError("No transformation found matching at least %d points" % (k,))
+
+        delta = numpy.dot(x, best[0].T) + best[1] - y
+        inliers = numpy.einsum('ni,ni->n', delta, delta) <= threshold ** 2
+        tform = cls.from_pointset(x[inliers], y[inliers])
+
+        # Update the inliers based on the final transformation
+        delta = tform.apply(x) - y
+        inliers = numpy.einsum('ni,ni->n', delta, delta) <= threshold ** 2
+        return tform, inliers
+
     def inverse(self):
         """
         Return the inverse transformation.
@@ -639,6 +886,8 @@ class SimilarityTransform(RigidTransform):
 
     """
 
+    _estimate_candidates = staticmethod(_similarity_candidates)
+
     def __init__(self, matrix=None, rotation=None, scale=None, translation=None):
         GeometricTransform.__init__(self, matrix=matrix, rotation=rotation,
                                     translation=translation)
@@ -761,6 +1010,10 @@ class ScalingTransform(RigidTransform):
 
     """
 
+    # There is no closed-form solution, so use affine transforms as candidates
+    _min_samples = 3
+    _estimate_candidates = staticmethod(_affine_candidates)
+
     def __init__(self, matrix=None, rotation=None, scale=None, translation=None):
         GeometricTransform.__init__(self, matrix=matrix, rotation=rotation,
                                     scale=scale, translation=translation)
@@ -920,6 +1173,9 @@ class AffineTransform(RigidTransform):
 
     """
 
+    _min_samples = 3
+    _estimate_candidates = staticmethod(_affine_candidates)
+
     def __init__(self, matrix=None, rotation=None, scale=None, shear=None,
                  translation=None):
         GeometricTransform.__init__(self, matrix=matrix, rotation=rotation,
@@ -1217,3 +1473,7 @@ class AnamorphosisTransform(AffineTransform):
     def inverse(self):
         raise NotImplementedError("The inverse of the AnamorphosisTransform "
                                   "is not an Anamorphosis transform itself.")
+
+    def apply_inverse(self, y):
+        raise NotImplementedError("The inverse of the AnamorphosisTransform "
+                                  "cannot be computed directly.")